@@ -0,0 +1,178 @@
+"""
+Request and response layer: body size limits, CORS and security headers,
+and chunked image bodies.
+
+BodyLimitMiddleware caps request bodies before the multipart parser spools
+them to disk: a declared Content-Length over the limit is answered with 413
+without reading the body, and a body that turns out longer (chunked uploads,
+or a wrong Content-Length) fails the read as soon as the limit is passed.
+
+SecurityHeadersMiddleware is a plain ASGI middleware. It adds headers that
+are encoded once at import, instead of wrapping every request in a function
+middleware. That function middleware ran each response through
+BaseHTTPMiddleware's task group and memory stream, and rebuilt the CSP string
+on every call. The headers replace any the application set under the same
+names, and CORS preflights are answered directly with the same headers.
+
+ImageResponse sends an encoded image (a memoryview over the encoder's buffer)
+as a series of chunks of that buffer rather than as one body message. The
+server can then apply flow control to slow clients between chunks. ASGI
+bodies must be bytes, so each chunk is copied out of the buffer as it is
+sent, and the whole image is never duplicated at once.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CHUNK_SIZE = int(os.environ.get("AI_RESPONSE_CHUNK_BYTES", str(64 * 1024)))
+
+CONTENT_SECURITY_POLICY = " ".join((
+    "default-src 'self';",
+    "connect-src 'self' http://localhost:8000 http://127.0.0.1:8000 ws: wss:;",
+    "img-src 'self' data: blob: http: https:;",
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval';",
+    "style-src 'self' 'unsafe-inline';",
+    "font-src 'self' data:;",
+))
+
+RESPONSE_HEADERS = (
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS"),
+    ("Access-Control-Allow-Headers", "*"),
+    ("Access-Control-Allow-Credentials", "true"),
+    # So browsers can read X-Cache, X-Encoding, Server-Timing and friends
+    ("Access-Control-Expose-Headers", "*"),
+    ("Content-Security-Policy", CONTENT_SECURITY_POLICY),
+    ("X-Content-Type-Options", "nosniff"),
+    ("X-Frame-Options", "DENY"),
+    ("X-XSS-Protection", "1; mode=block"),
+    ("Referrer-Policy", "no-referrer-when-downgrade"),
+)
+
+
+class RequestTooLargeError(HTTPException):
+    """
+    Request body over the limit. Raised from receive() while the app reads the
+    body; FastAPI passes HTTPExceptions from body parsing through unchanged.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"Request body exceeds {limit} bytes")
+
+
+class BodyLimitMiddleware:
+    def __init__(self, app: ASGIApp, limit: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.limit = limit
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.path_limits.get(scope["path"], self.limit)
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                await self.reject(scope, receive, send, RequestTooLargeError(limit))
+                return
+
+        received = 0
+        started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise RequestTooLargeError(limit)
+            return message
+
+        async def tracked_send(message: Message) -> None:
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except RequestTooLargeError as e:
+            # Only reached when nothing inside turned it into a response
+            if started:
+                raise
+            await self.reject(scope, receive, send, e)
+
+    @staticmethod
+    async def reject(scope: Scope, receive: Receive, send: Send, error: RequestTooLargeError) -> None:
+        # The rest of the body is never read, so the connection can't be reused
+        response = JSONResponse({"detail": error.detail}, status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+
+def encode_headers(headers: Iterable[Tuple[str, str]]) -> List[Tuple[bytes, bytes]]:
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+class SecurityHeadersMiddleware:
+    def __init__(self, app: ASGIApp, headers: Iterable[Tuple[str, str]] = RESPONSE_HEADERS):
+        self.app = app
+        self.headers = encode_headers(headers)
+        self.names = frozenset(name for name, _ in self.headers)
+        preflight_body = json.dumps({"status": "ok"}, separators=(",", ":")).encode()
+        self.preflight_start = {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": encode_headers((
+                ("Content-Type", "application/json"),
+                ("Content-Length", str(len(preflight_body))),
+            )) + self.headers,
+        }
+        self.preflight_body = {"type": "http.response.body", "body": preflight_body}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["method"] == "OPTIONS":
+            await send(dict(self.preflight_start))
+            await send(dict(self.preflight_body))
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    header for header in message.get("headers", ()) if header[0].lower() not in self.names
+                ] + self.headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class ImageResponse(Response):
+    """Response for an encoded body, sent in chunk_size bytes copied from the one buffer"""
+
+    def __init__(
+        self,
+        content,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+        media_type: Optional[str] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        super().__init__(content, status_code, headers, media_type)
+        self.chunk_size = max(1, chunk_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        body = memoryview(self.body)
+        for start in range(0, len(body), self.chunk_size):
+            end = start + self.chunk_size
+            await send({"type": "http.response.body", "body": bytes(body[start:end]), "more_body": end < len(body)})
+        if not len(body):
+            await send({"type": "http.response.body", "body": b""})
+        if self.background is not None:
+            await self.background()
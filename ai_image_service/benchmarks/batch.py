@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Batch throughput benchmark: /process-images against /remove-background.
+
+Generates N distinct product-like images on textured backgrounds (so the
+classical fast path doesn't apply) and measures images per second for
+sequential single-image requests, concurrent single-image requests and one
+batch request, all through an in-process ASGI client.
+
+Usage:
+    python benchmarks/batch.py [--count 32] [--size 768] [--concurrency 4]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import traceback
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Service modules live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_images(count: int, size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        background = (rng.random((size, size, 3)) * 80 + 90).astype(np.uint8)
+        img = Image.fromarray(background)
+        draw = ImageDraw.Draw(img)
+        x, y = rng.integers(size // 8, size // 3, 2)
+        draw.ellipse((x, y, size - x, size - y), fill=tuple(int(c) for c in rng.integers(0, 255, 3)))
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=90)
+        images.append((f'product_{i}.jpg', buffer.getvalue()))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=32)
+    parser.add_argument('--size', type=int, default=768)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    # Admit every concurrent request so the comparison measures throughput, not 429s
+    os.environ.setdefault('AI_QUEUE_DEPTH', str(args.concurrency))
+
+    from fastapi.testclient import TestClient
+    import main as service
+
+    # Each mode gets its own images so the result cache never answers
+    sets = [make_images(args.count, args.size, seed) for seed in range(3)]
+
+    with TestClient(service.app) as client:
+        def single(item):
+            name, data = item
+            response = client.post('/remove-background', files={'file': (name, data, 'image/jpeg')})
+            response.raise_for_status()
+
+        started = time.perf_counter()
+        for item in sets[0]:
+            single(item)
+        sequential = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            list(executor.map(single, sets[1]))
+        concurrent = time.perf_counter() - started
+
+        started = time.perf_counter()
+        response = client.post(
+            '/process-images',
+            params={'enhance': 'false'},
+            files=[('files', (name, data, 'image/jpeg')) for name, data in sets[2]],
+        )
+        response.raise_for_status()
+        batch = time.perf_counter() - started
+        entries = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+        assert len(entries) == args.count + 1, entries
+
+    print(f"📊 {args.count} images of {args.size}px, background removal only")
+    print(f"  single, sequential:      {args.count / sequential:6.2f} img/s")
+    print(f"  single, {args.concurrency} concurrent:    {args.count / concurrent:6.2f} img/s")
+    print(f"  /process-images batch:   {args.count / batch:6.2f} img/s")
+
+
+if __name__ == '__main__':
+    status = 0
+    try:
+        main()
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(status)  # onnxruntime threads can keep the interpreter alive
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Compositing benchmark: one cutout onto N background colours.
+
+Compares the per-colour Pillow paste that variants.composite() uses with two
+ways of compositing every colour in one numpy broadcast: float32 blending,
+and integer blending that computes the foreground term once and shares it
+across colours. The cutout is the synthetic product from encoders.py. Every
+method's output is checked against Pillow's, and the largest per-channel
+difference is reported alongside the median time. No models are needed.
+
+Usage:
+    python benchmarks/compositing.py [--sizes 512,1024,2048] [--colors 1,4,8] [--repeats 5] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import traceback
+from typing import Callable, Dict, List
+
+import numpy as np
+from PIL import Image
+
+# Service modules live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoders import synthetic_cutout  # noqa: E402
+
+PALETTE = [(255, 255, 255), (244, 241, 234), (0, 0, 128), (0, 0, 0), (200, 30, 40), (30, 160, 90), (240, 200, 0), (90, 90, 90)]
+
+
+def numpy_float(cutout: Image.Image, colors) -> List[Image.Image]:
+    rgba = np.asarray(cutout, dtype=np.float32)
+    alpha = rgba[:, :, 3:] / 255.0
+    backgrounds = np.asarray(colors, dtype=np.float32)[:, None, None, :]
+    blended = rgba[None, :, :, :3] * alpha + backgrounds * (1 - alpha)
+    return [Image.fromarray(frame) for frame in (blended + 0.5).astype(np.uint8)]
+
+
+def numpy_int(cutout: Image.Image, colors) -> List[Image.Image]:
+    rgba = np.asarray(cutout)
+    alpha = rgba[:, :, 3:].astype(np.uint16)
+    foreground = rgba[:, :, :3] * alpha  # shared by every colour
+    inverse = 255 - alpha
+    backgrounds = np.asarray(colors, dtype=np.uint16)[:, None, None, :]
+    blended = (foreground[None] + backgrounds * inverse[None] + 127) // 255
+    return [Image.fromarray(frame) for frame in blended.astype(np.uint8)]
+
+
+def pillow(cutout: Image.Image, colors) -> List[Image.Image]:
+    from variants import composite
+
+    return composite(cutout, colors)
+
+
+METHODS: Dict[str, Callable] = {"pillow": pillow, "numpy_float": numpy_float, "numpy_int": numpy_int}
+
+
+def median_ms(method: Callable, cutout: Image.Image, colors, repeats: int) -> float:
+    method(cutout, colors)  # warm-up, not measured
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        method(cutout, colors)
+        samples.append(time.perf_counter() - started)
+    return round(float(np.median(samples)) * 1000, 2)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='512,1024,2048', help='comma separated cutout sides')
+    parser.add_argument('--colors', default='1,4,8', help='comma separated colour counts (at most 8)')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'size':>6}{'colors':>8}" + "".join(f"{name:>14}" for name in METHODS) + "  max diff vs pillow")
+    for size in (int(value) for value in args.sizes.split(',')):
+        cutout = synthetic_cutout(size)
+        for count in (int(value) for value in args.colors.split(',')):
+            colors = PALETTE[:count]
+            reference = [np.asarray(image, dtype=np.int16) for image in pillow(cutout, colors)]
+            row = {"size": size, "colors": count, "ms": {}, "max_diff": {}}
+            for name, method in METHODS.items():
+                row["ms"][name] = median_ms(method, cutout, colors, args.repeats)
+                row["max_diff"][name] = int(max(
+                    np.abs(np.asarray(image, dtype=np.int16) - expected).max()
+                    for image, expected in zip(method(cutout, colors), reference)
+                ))
+            results.append(row)
+            print(f"{size:>6}{count:>8}" + "".join(f"{row['ms'][name]:>12.1f}ms" for name in METHODS)
+                  + "  " + ", ".join(f"{name} {diff}" for name, diff in row["max_diff"].items() if name != "pillow"),
+                  flush=True)
+
+    if args.json:
+        report = {
+            "meta": {
+                "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "pillow": Image.__version__,
+                "numpy": np.__version__,
+                "repeats": args.repeats,
+            },
+            "results": results,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        status = main()
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    sys.exit(status)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Output encoding benchmark: encode time and bytes per format, preset and size.
+
+Encodes a synthetic product cutout (transparent, as /remove-background
+returns it) and the same cutout on white (opaque, as white_background=true
+returns it) with every format and encoder preset the server supports, at
+each of the requested widths, produced the way the service produces
+responsive sizes. No models are needed.
+
+Usage:
+    python benchmarks/encoders.py [--size 1024] [--widths 1024,512,256] [--repeats 3] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import traceback
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# Service modules live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_cutout(size: int) -> Image.Image:
+    """A smooth, lightly textured product shape with a transparent background"""
+    rng = np.random.default_rng(size)
+    image = Image.fromarray((rng.random((size, size, 3)) * 40 + 100).astype(np.uint8)).filter(ImageFilter.GaussianBlur(3))
+    alpha = Image.new('L', image.size, 0)
+    ImageDraw.Draw(alpha).ellipse((size // 5, size // 5, size * 4 // 5, size * 5 // 6), fill=255)
+    cutout = image.convert('RGBA')
+    cutout.putalpha(alpha.filter(ImageFilter.GaussianBlur(1)))
+    return cutout
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--widths', default='1024,512,256', help='comma separated output widths')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    from encoding import PRESETS, available_formats, encode_timed, parse_sizes, responsive_sizes
+    from variants import composite
+
+    cutout = synthetic_cutout(args.size)
+    sources = {"transparent": cutout, "opaque": composite(cutout, [(255, 255, 255)])[0]}
+    widths = parse_sizes(args.widths)
+
+    results = []
+    for kind, source in sources.items():
+        images = responsive_sizes(source, widths)
+        for format in available_formats():
+            if format == "jpeg" and kind == "transparent":
+                continue
+            for preset in PRESETS:
+                for image in images:
+                    reports = [encode_timed(image, format, preset)[1] for _ in range(args.repeats)]
+                    results.append({
+                        "source": kind,
+                        **reports[0],
+                        "encode_ms": round(float(np.median([report["encode_ms"] for report in reports])), 2),
+                    })
+                    print(f"{kind:<12}{format:<6}{preset:<10}{image.width:>6}px"
+                          f"{results[-1]['encode_ms']:>10.1f}ms{results[-1]['bytes'] / 1024:>10.1f}KB", flush=True)
+
+    if args.json:
+        report = {
+            "meta": {
+                "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "pillow": Image.__version__,
+                "repeats": args.repeats,
+            },
+            "results": results,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        status = main()
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    sys.exit(status)
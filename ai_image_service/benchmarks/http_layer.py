@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Response layer load test: the old header middleware against asgi.py.
+
+Starts the service twice in uvicorn subprocesses:
+- legacy: CORSMiddleware plus the former @app.middleware("http") function
+  that rebuilt the CSP and overwrote the CORS headers on every response,
+  with image bodies sent as one message
+- lean: the service as shipped, SecurityHeadersMiddleware and ImageResponse
+  chunks
+
+Both serve the same routes. Each gets concurrent /health requests, then
+concurrent /process-image requests for one large image. After the first of
+those, the result cache answers, so only the request and response path is
+measured. Reports latency percentiles, requests per second, and the growth of
+each server's peak resident memory during the load.
+
+Usage:
+    python benchmarks/http_layer.py [--requests 2000] [--image-requests 200]
+        [--concurrency 16] [--size 2048] [--json out.json]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVICE_DIR)
+
+STACKS = ("legacy", "lean")
+
+
+def legacy_app(service):
+    """The service's routes behind the middleware stack it had before asgi.py"""
+    from fastapi import FastAPI, Request
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI(title=service.app.title, version=service.app.version)
+    app.router = service.app.router
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["*"],
+    )
+
+    @app.middleware("http")
+    async def add_security_headers(request: Request, call_next):
+        if request.method == "OPTIONS":
+            response = JSONResponse(status_code=200, content={"status": "ok"})
+        else:
+            response = await call_next(request)
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "*"
+        response.headers["Access-Control-Allow-Credentials"] = "true"
+        csp = """
+            default-src 'self';
+            connect-src 'self' http://localhost:8000 http://127.0.0.1:8000 ws: wss:;
+            img-src 'self' data: blob: http: https:;
+            script-src 'self' 'unsafe-inline' 'unsafe-eval';
+            style-src 'self' 'unsafe-inline';
+            font-src 'self' data:;
+        """.strip().replace('\n', ' ')
+        response.headers["Content-Security-Policy"] = csp
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        response.headers["Referrer-Policy"] = "no-referrer-when-downgrade"
+        return response
+
+    return app
+
+
+def serve(stack: str, port: int) -> None:
+    import uvicorn
+    import main as service
+
+    app = legacy_app(service) if stack == "legacy" else service.app
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def memory(pid: int, field: str) -> int:
+    """VmRSS (resident) or VmHWM (peak resident) of a process in bytes (Linux)"""
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def reset_peak(pid: int) -> None:
+    """Restart VmHWM from the current resident size (Linux >= 4.0)"""
+    with open(f"/proc/{pid}/clear_refs", "w") as f:
+        f.write("5")
+
+
+def make_image(size: int) -> bytes:
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    Image.fromarray((rng.random((size, size, 3)) * 255).astype(np.uint8)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+async def load(client, count: int, concurrency: int, request) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    response_bytes = 0
+
+    async def one():
+        nonlocal response_bytes
+        async with semaphore:
+            started = time.perf_counter()
+            response = await request(client)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+            response_bytes = len(response.content)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    elapsed = time.perf_counter() - started
+    values = np.asarray(latencies) * 1000
+    return {
+        "requests": count,
+        "requests_per_second": round(count / elapsed, 1),
+        "response_bytes": response_bytes,
+        "latency_ms": {q: round(float(np.percentile(values, int(q[1:]))), 3) for q in ("p50", "p95", "p99")},
+    }
+
+
+async def bench_stack(stack: str, args, image: bytes) -> dict:
+    import httpx
+
+    port = free_port()
+    env = dict(os.environ, AI_LOG_LEVEL="WARNING", AI_QUEUE_DEPTH=str(args.concurrency))
+    if stack == "legacy":
+        # One body message per image, as Response sent it
+        env["AI_RESPONSE_CHUNK_BYTES"] = str(1 << 40)
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", stack, "--port", str(port)], env=env, cwd=SERVICE_DIR
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+            for _ in range(600):
+                try:
+                    if (await client.get("/readyz")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+            else:
+                raise RuntimeError(f"{stack} server didn't become ready")
+
+            def health(client):
+                return client.get("/health")
+
+            def process(client):
+                return client.post(
+                    "/process-image",
+                    params={"remove_bg": "false", "enhance": "false", "format": "png", "preset": "fast",
+                            "max_size": str(args.size)},
+                    files={"file": ("noise.jpg", image, "image/jpeg")},
+                )
+
+            # Warm up both routes and fill the result cache before measuring
+            await load(client, args.concurrency, args.concurrency, health)
+            (await process(client)).raise_for_status()
+            await load(client, args.concurrency, args.concurrency, process)
+
+            results = {}
+            for name, request, count in (("health", health, args.requests), ("process_image", process, args.image_requests)):
+                reset_peak(server.pid)
+                before = memory(server.pid, "VmRSS")
+                results[name] = await load(client, count, args.concurrency, request)
+                results[name]["peak_rss_growth_bytes"] = memory(server.pid, "VmHWM") - before
+            results["rss_bytes"] = memory(server.pid, "VmRSS")
+            return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="/health requests per stack")
+    parser.add_argument("--image-requests", type=int, default=200, help="/process-image requests per stack")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--size", type=int, default=2048, help="side of the test image")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--serve", choices=STACKS, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return 0
+
+    image = make_image(args.size)
+    results = {}
+    for stack in STACKS:
+        print(f"⏱️  {stack}", flush=True)
+        results[stack] = asyncio.run(bench_stack(stack, args, image))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "concurrency": args.concurrency,
+            "image_size": args.size,
+        },
+        "results": results,
+    }
+    print(f"\n📊 {report['meta']['platform']}, {report['meta']['cpu_count']} CPUs, concurrency {args.concurrency}")
+    print(f"{'route':<15}{'stack':<8}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'peak RSS +':>13}")
+    for route in ("health", "process_image"):
+        for stack in STACKS:
+            result = results[stack][route]
+            latency = result["latency_ms"]
+            print(f"{route:<15}{stack:<8}{result['requests_per_second']:>9.1f}{latency['p50']:>8.2f}ms"
+                  f"{latency['p95']:>8.2f}ms{latency['p99']:>8.2f}ms"
+                  f"{result['peak_rss_growth_bytes'] / 2 ** 20:>10.1f} MB")
+    print(f"   {results['lean']['process_image']['response_bytes'] / 2 ** 20:.1f} MB per image response")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    status = 0
+    try:
+        status = main()
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(status)  # onnxruntime threads can keep the interpreter alive
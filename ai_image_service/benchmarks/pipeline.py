@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark: per-stage and end-to-end latency, throughput and memory.
+
+Synthetic product shots are generated at several resolutions on three kinds
+of background, like create_test_images() in test_background.py: a uniform
+backdrop (classical fast path), a gradient and a noisy texture (both go to
+U²-Net). For every case the pipeline is run in-process to collect the stage
+timings it reports (decode, resize, segmentation, matting, enhance,
+composite, encode), then once more under tracemalloc for the peak of Python
+and numpy allocations (onnxruntime's native arenas are not included), and
+finally through /process-image with an in-process ASGI client, sequentially
+and concurrently. The result cache is disabled so every request does the
+full work.
+
+With --stub-models, stand-in ONNX models are written to a temporary
+directory, so it runs offline on a CPU-only machine; otherwise the locally
+cached rembg models and AI_MODEL_DIR are used. Results are written as JSON;
+--compare reports regressions between two result files and exits with
+status 1 if there are any.
+
+Usage:
+    python benchmarks/pipeline.py [--sizes 512,1024,2048] [--repeats 5] [--enhance] [--stub-models] [--json out.json]
+    python benchmarks/pipeline.py --compare baseline.json current.json [--threshold 0.15]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Service modules live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BACKGROUNDS = ("uniform", "gradient", "textured")
+# Below this many milliseconds, differences are timer noise rather than regressions
+MIN_DELTA_MS = 2.0
+
+
+def synthetic_image(background: str, size: int, seed: int) -> bytes:
+    """A product-like shape on the given kind of background, as JPEG bytes"""
+    rng = np.random.default_rng(seed)
+    if background == "uniform":
+        img = Image.new('RGB', (size, size), color=(245, 245, 245))
+    elif background == "gradient":
+        ramp = np.linspace(40, 220, size, dtype=np.float32)
+        img = Image.fromarray(np.repeat(np.tile(ramp, (size, 1))[:, :, None], 3, axis=2).astype(np.uint8))
+    else:
+        img = Image.fromarray((rng.random((size, size, 3)) * 80 + 90).astype(np.uint8))
+
+    draw = ImageDraw.Draw(img)
+    x, y = rng.integers(size // 8, size // 4, 2)
+    draw.ellipse((x, y, size - x, size - y), fill=tuple(int(c) for c in rng.integers(0, 160, 3)))
+    draw.rectangle((size // 3, size // 3, size // 2, size * 2 // 3), fill='green')
+    draw.text((size // 2, size // 2), 'TEST', fill='white')
+
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50 and p95 of samples in seconds, reported in milliseconds"""
+    values = np.asarray(samples) * 1000
+    return {"p50": round(float(np.percentile(values, 50)), 3), "p95": round(float(np.percentile(values, 95)), 3)}
+
+
+def bench_stages(service, data: bytes, repeats: int, options: dict) -> dict:
+    """Run the pipeline in-process and aggregate the stage timings it reports"""
+    service.run_pipeline(data, **options)  # warm-up, not measured
+    totals, stages = [], {}
+    for _ in range(repeats):
+        started = time.perf_counter()
+        _, _, info = service.run_pipeline(data, **options)
+        totals.append(time.perf_counter() - started)
+        for name, seconds in info['timings'].items():
+            stages.setdefault(name, []).append(seconds)
+
+    tracemalloc.start()
+    service.run_pipeline(data, **options)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "stages_ms": {name: percentiles(samples) for name, samples in stages.items()},
+        "pipeline_ms": percentiles(totals),
+        "throughput_ips": round(repeats / sum(totals), 3),
+        "peak_alloc_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def bench_endpoint(client, images: List[bytes], options: dict, concurrency: int) -> dict:
+    """POST each image to /process-image, sequentially and then concurrently"""
+    params = {name: str(value).lower() for name, value in options.items()}
+
+    def post(data: bytes) -> float:
+        started = time.perf_counter()
+        response = client.post('/process-image', params=params, files={'file': ('bench.jpg', data, 'image/jpeg')})
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    post(images[0])  # warm-up, not measured
+    latencies = [post(data) for data in images]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(post, images))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "e2e_ms": percentiles(latencies),
+        "e2e_throughput_ips": round(len(images) / elapsed, 3),
+    }
+
+
+def run(args) -> dict:
+    if args.stub_models:
+        from stubs import write_stub_models  # benchmarks/ is on sys.path as the script dir
+        write_stub_models(tempfile.mkdtemp(prefix='ai-bench-models-'))
+
+    # Every request must do the full work, and concurrent requests must all be admitted
+    os.environ['AI_CACHE_MEMORY_BYTES'] = '0'
+    os.environ['AI_CACHE_DIR'] = ''
+    os.environ.setdefault('AI_QUEUE_DEPTH', str(args.concurrency))
+    os.environ.setdefault('AI_LOG_LEVEL', 'WARNING')
+
+    from fastapi.testclient import TestClient
+    import main as service
+
+    options = {"remove_bg": True, "enhance": args.enhance, "white_background": False,
+               "max_size": args.max_size, "matting": args.matting}
+    results = {}
+    with TestClient(service.app) as client:
+        if args.enhance and service.esrgan_upsampler is None:
+            raise SystemExit("--enhance needs upscaler weights in AI_MODEL_DIR (or --stub-models)")
+
+        for size in args.sizes:
+            for background in BACKGROUNDS:
+                case = f"{background}-{size}"
+                print(f"⏱️  {case}", flush=True)
+                data = synthetic_image(background, size, seed=size)
+                result = bench_stages(service, data, args.repeats, options)
+                # Distinct images per request; the same image would only measure the cache
+                images = [synthetic_image(background, size, seed=size + i + 1) for i in range(args.repeats)]
+                result.update(bench_endpoint(client, images, options, args.concurrency))
+                results[case] = result
+
+    return {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "stub_models": args.stub_models,
+            "upscaler": service.esrgan_upsampler.name if service.esrgan_upsampler is not None else None,
+            "options": options,
+            "repeats": args.repeats,
+            "concurrency": args.concurrency,
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "results": results,
+    }
+
+
+def print_results(report: dict) -> None:
+    print(f"\n📊 {report['meta']['platform']}, {report['meta']['cpu_count']} CPUs"
+          f"{', stub models' if report['meta']['stub_models'] else ''}")
+    print(f"{'case':<16}{'pipeline p50':>14}{'e2e p50':>10}{'e2e img/s':>11}{'peak MB':>9}  stages p50 (ms)")
+    for case, result in report['results'].items():
+        stages = ", ".join(f"{name} {value['p50']:.1f}" for name, value in result['stages_ms'].items())
+        print(f"{case:<16}{result['pipeline_ms']['p50']:>12.1f}ms{result['e2e_ms']['p50']:>8.1f}ms"
+              f"{result['e2e_throughput_ips']:>11.2f}{result['peak_alloc_mb']:>9.1f}  {stages}")
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Regressions of current against baseline, as printable lines"""
+    regressions = []
+
+    def slower(label: str, before: float, after: float) -> None:
+        if after > before * (1 + threshold) and after - before > MIN_DELTA_MS:
+            regressions.append(f"{label}: {before:.1f}ms -> {after:.1f}ms (+{(after / before - 1) * 100:.0f}%)")
+
+    for case, after in current['results'].items():
+        before = baseline['results'].get(case)
+        if before is None:
+            continue
+        for name, value in after['stages_ms'].items():
+            if name in before['stages_ms']:
+                slower(f"{case} {name} p50", before['stages_ms'][name]['p50'], value['p50'])
+        slower(f"{case} pipeline p50", before['pipeline_ms']['p50'], after['pipeline_ms']['p50'])
+        slower(f"{case} e2e p95", before['e2e_ms']['p95'], after['e2e_ms']['p95'])
+        for key, label in (("throughput_ips", "throughput"), ("e2e_throughput_ips", "e2e throughput")):
+            if after[key] < before[key] * (1 - threshold):
+                regressions.append(f"{case} {label}: {before[key]:.2f} -> {after[key]:.2f} img/s")
+        if after['peak_alloc_mb'] > before['peak_alloc_mb'] * (1 + threshold):
+            regressions.append(f"{case} peak memory: {before['peak_alloc_mb']:.1f} -> {after['peak_alloc_mb']:.1f} MB")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='512,1024,2048', help='comma separated image sizes')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--max-size', type=int, default=1024)
+    parser.add_argument('--matting', default='edge', choices=['none', 'edge', 'full'])
+    parser.add_argument('--enhance', action='store_true', help='include Real-ESRGAN enhancement')
+    parser.add_argument('--stub-models', action='store_true', help='use stand-in ONNX models (offline)')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='compare two result files')
+    parser.add_argument('--threshold', type=float, default=0.15, help='relative slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for line in regressions:
+            print(f"❌ {line}")
+        if not regressions:
+            print(f"✅ No regressions above {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    report = run(args)
+    print_results(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    status = 0
+    try:
+        status = main()
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+        if e.code and not isinstance(e.code, int):
+            print(e.code, file=sys.stderr)
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(status)  # onnxruntime threads can keep the interpreter alive
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Segmentation quality tier benchmark: latency against mask accuracy.
+
+Every tier (fast, balanced, best) is run on the same synthetic product shots
+on textured backgrounds, whose true foreground masks are known, through
+remove_background() with the classical fast path disabled. For each tier it
+reports the model the tier resolved to, segmentation latency (p50/p95), the
+mean IoU of the thresholded alpha against the true mask, and the mean IoU
+against the best tier's mask (how much a cheaper tier changes the cutout).
+
+With --stub-models, stand-in ONNX models (and an INT8 variant of the u2netp
+stub) are written to a temporary directory so it runs offline; the IoU of
+stub models is meaningless, only their timings of the code around the model
+are. Run it with the real weights in AI_MODEL_DIR to choose a default tier.
+
+Usage:
+    python benchmarks/quality.py [--count 8] [--size 1024] [--repeats 3] [--stub-models] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import traceback
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Service modules live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def labelled_image(size: int, seed: int) -> Tuple[Image.Image, np.ndarray]:
+    """A product-like shape on a noisy background, and its true foreground mask"""
+    rng = np.random.default_rng(seed)
+    img = Image.fromarray((rng.random((size, size, 3)) * 80 + 90).astype(np.uint8))
+    truth = Image.new('L', (size, size), 0)
+    x, y = rng.integers(size // 8, size // 4, 2)
+    colour = tuple(int(c) for c in rng.integers(0, 160, 3))
+    for target, fill in ((ImageDraw.Draw(img), colour), (ImageDraw.Draw(truth), 255)):
+        target.ellipse((x, y, size - x, size - y), fill=fill)
+    return img, np.asarray(truth) > 127
+
+
+def iou(alpha: np.ndarray, truth: np.ndarray) -> float:
+    predicted = alpha > 127
+    union = np.logical_or(predicted, truth).sum()
+    return float(np.logical_and(predicted, truth).sum() / union) if union else 1.0
+
+
+def bench_tier(
+    service, quality: str, samples: List[Tuple[Image.Image, np.ndarray]], repeats: int
+) -> Tuple[dict, List[np.ndarray]]:
+    """The tier's results, and its alpha for every sample"""
+    from metrics import StageTimer
+
+    service.remove_background(samples[0][0], "none", quality=quality)  # loads and warms the session
+    latencies, scores, alphas, model = [], [], [], None
+    for image, truth in samples:
+        for _ in range(repeats):
+            timer = StageTimer()
+            result = service.remove_background(image, "edge", timer, quality)
+            latencies.append(timer.timings.get("segmentation", 0.0))
+        model = result.info.get('model', model)
+        alphas.append(np.asarray(result.getchannel('A')))
+        scores.append(iou(alphas[-1], truth))
+
+    values = np.asarray(latencies) * 1000
+    return {
+        "model": model,
+        "segmentation_ms": {
+            "p50": round(float(np.percentile(values, 50)), 3),
+            "p95": round(float(np.percentile(values, 95)), 3),
+        },
+        "mean_iou": round(float(np.mean(scores)), 4),
+    }, alphas
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=8, help='distinct images')
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--stub-models', action='store_true', help='use stand-in ONNX models (offline)')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    if args.stub_models:
+        from stubs import write_stub_models  # benchmarks/ is on sys.path as the script dir
+        directory = tempfile.mkdtemp(prefix='ai-bench-models-')
+        write_stub_models(directory)
+        import model_registry
+        model_registry.quantize("u2netp", directory)
+
+    # Every image has to go through the network
+    os.environ['AI_FASTPATH'] = '0'
+    os.environ.setdefault('AI_LOG_LEVEL', 'WARNING')
+    import main as service
+    from sessions import QUALITY_TIERS, inference_threads
+
+    samples = [labelled_image(args.size, seed) for seed in range(args.count)]
+    results, alphas = {}, {}
+    for quality in QUALITY_TIERS:
+        print(f"⏱️  {quality}", flush=True)
+        results[quality], alphas[quality] = bench_tier(service, quality, samples, args.repeats)
+    for quality, result in results.items():
+        result["iou_vs_best"] = round(float(np.mean([
+            iou(alpha, best > 127) for alpha, best in zip(alphas[quality], alphas["best"])
+        ])), 4)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "intra_op_threads": inference_threads(),
+            "stub_models": args.stub_models,
+            "count": args.count,
+            "size": args.size,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+
+    print(f"\n📊 {report['meta']['platform']}, {report['meta']['cpu_count']} CPUs, "
+          f"{report['meta']['intra_op_threads']} threads per session{', stub models' if args.stub_models else ''}")
+    print(f"{'tier':<10}{'model':<20}{'seg p50':>10}{'seg p95':>10}{'mean IoU':>10}{'vs best':>10}")
+    for quality, result in results.items():
+        print(f"{quality:<10}{result['model'] or '-':<20}{result['segmentation_ms']['p50']:>8.1f}ms"
+              f"{result['segmentation_ms']['p95']:>8.1f}ms{result['mean_iou']:>10.3f}{result['iou_vs_best']:>10.3f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Results written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    status = 0
+    try:
+        status = main()
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(status)  # onnxruntime threads can keep the interpreter alive
@@ -0,0 +1,76 @@
+"""
+Stand-in model files so the benchmarks run offline on a CPU-only machine.
+
+The stubs have the same input and output contracts as the real models
+(a single-channel mask at the segmentation model's input size, an x2 image
+for the upscaler) but almost no compute, so numbers taken with them measure the
+service around the models: decoding, resizing, matting, compositing,
+encoding and request handling. Building them needs the onnx package.
+"""
+
+import os
+from typing import Dict
+
+import numpy as np
+
+# Model name -> input size
+SEGMENTATION_MODELS = {"u2net": 320, "u2netp": 320, "silueta": 320, "isnet-general-use": 1024}
+UPSCALER_STUB = "RealESRGAN_x2plus"
+
+
+def _model(helper, graph):
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8  # readable by older onnxruntime releases too
+    return model
+
+
+def _segmentation_stub(size: int):
+    from onnx import TensorProto, helper, numpy_helper
+
+    # A 1x1 convolution (blue minus red) gives a mask with some structure, not a constant
+    weight = numpy_helper.from_array(np.array([-10, 0, 10], dtype=np.float32).reshape(1, 3, 1, 1), "weight")
+    bias = numpy_helper.from_array(np.array([0], dtype=np.float32), "bias")
+    graph = helper.make_graph(
+        [helper.make_node("Conv", ["input.1", "weight", "bias"], ["mask"])],
+        "segmentation_stub",
+        [helper.make_tensor_value_info("input.1", TensorProto.FLOAT, ["batch", 3, size, size])],
+        [helper.make_tensor_value_info("mask", TensorProto.FLOAT, ["batch", 1, size, size])],
+        [weight, bias],
+    )
+    return _model(helper, graph)
+
+
+def _upscaler_stub():
+    from onnx import TensorProto, helper, numpy_helper
+
+    scales = numpy_helper.from_array(np.array([1, 1, 2, 2], dtype=np.float32), "scales")
+    graph = helper.make_graph(
+        [helper.make_node("Resize", ["input", "", "scales"], ["output"], mode="linear")],
+        "upscaler_stub",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["batch", 3, "height", "width"])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch", 3, "height2", "width2"])],
+        [scales],
+    )
+    return _model(helper, graph)
+
+
+def write_stub_models(directory: str) -> Dict[str, str]:
+    """
+    Write the stubs into directory and point the service at them. Must run
+    before the service modules are imported. Returns the environment it set.
+    """
+    import onnx
+
+    os.makedirs(directory, exist_ok=True)
+    for name, size in SEGMENTATION_MODELS.items():
+        onnx.save(_segmentation_stub(size), os.path.join(directory, name + ".onnx"))
+    onnx.save(_upscaler_stub(), os.path.join(directory, UPSCALER_STUB + ".onnx"))
+
+    env = {
+        "U2NET_HOME": directory,  # where rembg looks for <model>.onnx
+        "MODEL_CHECKSUM_DISABLED": "1",  # the stubs don't match rembg's published hashes
+        "AI_MODEL_DIR": directory,
+        "AI_UPSCALER_BACKEND": "onnx",
+    }
+    os.environ.update(env)
+    return env
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Upscaler benchmark: latency and quality of every locally available model.
+
+Each reference image is downscaled by 2 and upscaled back to its original
+size, then compared with the reference (PSNR and SSIM). Native x2 models are
+measured against the x4 models followed by a downscale, which is what the
+service used to do.
+
+Usage:
+    python benchmarks/upscalers.py [--image photo.jpg ...] [--backend auto|torch|onnx] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Service modules live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upscaler import UPSCALER_MODELS, load_model  # noqa: E402
+
+
+def synthetic_reference(size: int = 512) -> np.ndarray:
+    """Product-like test image with edges, gradients and fine texture"""
+    img = Image.new('RGB', (size, size), color='white')
+    draw = ImageDraw.Draw(img)
+    for i in range(size):
+        draw.line([(i, 0), (i, size)], fill=(i * 255 // size, 200, 255 - i * 255 // size))
+    draw.ellipse((size // 4, size // 4, size * 3 // 4, size * 3 // 4), fill='blue', outline='black', width=3)
+    draw.rectangle((size // 8, size // 2, size // 3, size * 7 // 8), fill='green')
+    for x in range(0, size, 8):
+        draw.line([(x, size * 7 // 8), (x + 4, size)], fill='black')
+    draw.text((size // 3, size // 2), 'PRODUCT 123', fill='white')
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 4, (size, size, 3))
+    return np.clip(np.asarray(img, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def ssim(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean SSIM on luma with the usual 11x11 Gaussian window"""
+    x = cv2.cvtColor(a, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    y = cv2.cvtColor(b, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda img: cv2.GaussianBlur(img, (11, 11), 1.5)  # noqa: E731
+    mu_x, mu_y = blur(x), blur(y)
+    sigma_x = blur(x * x) - mu_x ** 2
+    sigma_y = blur(y * y) - mu_y ** 2
+    sigma_xy = blur(x * y) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / (
+        (mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2)
+    )
+    return float(ssim_map.mean())
+
+
+def run(references, backend: str, repeats: int):
+    results = []
+    for name in UPSCALER_MODELS:
+        upscaler = load_model(name, backend=backend)
+        if upscaler is None:
+            print(f"  {name}: weights not found, skipped")
+            continue
+        for label, reference in references:
+            height, width = reference.shape[:2]
+            low = cv2.resize(reference, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+            upscaler.upscale(low, outscale=2)  # warm-up
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                output = upscaler.upscale(low, outscale=2)
+                timings.append(time.perf_counter() - started)
+            output = output[:height, :width]
+            results.append({
+                "model": name,
+                "backend": upscaler.backend,
+                "native_scale": upscaler.scale,
+                "image": label,
+                "latency_ms": round(1000 * float(np.median(timings)), 1),
+                "psnr": round(psnr(output, reference), 2),
+                "ssim": round(ssim(output, reference), 4),
+            })
+
+    # Bicubic baseline so the numbers have a floor to compare against
+    for label, reference in references:
+        height, width = reference.shape[:2]
+        low = cv2.resize(reference, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+        started = time.perf_counter()
+        output = cv2.resize(low, (width, height), interpolation=cv2.INTER_CUBIC)
+        results.append({
+            "model": "bicubic", "backend": "opencv", "native_scale": 2, "image": label,
+            "latency_ms": round(1000 * (time.perf_counter() - started), 1),
+            "psnr": round(psnr(output, reference), 2),
+            "ssim": round(ssim(output, reference), 4),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--image', action='append', default=[], help='reference image (repeatable)')
+    parser.add_argument('--backend', default='auto', choices=['auto', 'torch', 'onnx'])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    references = [(path, np.asarray(Image.open(path).convert('RGB'))) for path in args.image]
+    if not references:
+        references = [('synthetic-512', synthetic_reference(512))]
+
+    print("📊 Upscaler benchmark (x2 output)")
+    results = run(references, args.backend, args.repeats)
+    print(f"{'model':<24}{'backend':<9}{'image':<16}{'ms':>9}{'PSNR':>8}{'SSIM':>8}")
+    for row in results:
+        print(f"{row['model']:<24}{row['backend']:<9}{row['image'][:15]:<16}"
+              f"{row['latency_ms']:>9}{row['psnr']:>8}{row['ssim']:>8}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
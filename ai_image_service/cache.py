@@ -0,0 +1,246 @@
+"""
+Content-addressed cache for processed images.
+
+Results are keyed by a hash of the uploaded bytes plus every option that
+affects the output, so re-uploading the same photo with the same toggles is
+answered without running the pipeline again. There is a bounded in-memory LRU
+tier and an optional on-disk tier with size-based eviction. Identical requests
+that arrive while the first one is still being computed share its result
+(single-flight).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# Bump when the pipeline output changes so stale entries are never served
+CACHE_VERSION = "5"
+
+MEMORY_BYTES = int(os.environ.get("AI_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+DISK_DIR = os.environ.get("AI_CACHE_DIR", "")  # empty disables the disk tier
+DISK_BYTES = int(os.environ.get("AI_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+
+CachedResult = Tuple[bytes, str, dict]  # (content, media_type, processing info)
+
+_EXTENSIONS = {
+    "image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/avif": ".avif",
+    "multipart/form-data": ".multipart",
+}
+
+
+class ComputationCancelled(Exception):
+    """A shared computation was cancelled along with the request that started it"""
+
+
+def cache_key(content_digest: str, **options) -> str:
+    """Hash of the uploaded bytes' SHA-256 digest and the processing options"""
+    digest = hashlib.sha256()
+    digest.update(CACHE_VERSION.encode())
+    digest.update(content_digest.encode())
+    for name in sorted(options):
+        digest.update(f"|{name}={options[name]}".encode())
+    return digest.hexdigest()
+
+
+def etag_for(key: str) -> str:
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match: Optional[str], key: str) -> bool:
+    """Check an If-None-Match header value against the key's ETag"""
+    if not if_none_match:
+        return False
+    etag = etag_for(key)
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+class ResultCache:
+    def __init__(
+        self,
+        memory_bytes: int = MEMORY_BYTES,
+        disk_dir: str = DISK_DIR,
+        disk_bytes: int = DISK_BYTES,
+    ):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._memory: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = 0
+        self._disk_lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_used = sum(size for _, _, size in self._disk_entries())
+
+    # Memory tier
+
+    def _memory_get(self, key: str) -> Optional[CachedResult]:
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: CachedResult) -> None:
+        size = len(value[0])
+        if size > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_used -= len(self._memory.pop(key)[0])
+        self._memory[key] = value
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted[0])
+
+    # Disk tier
+
+    def _disk_entries(self):
+        """(path, mtime, size) for every cached file"""
+        with os.scandir(self.disk_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime, stat.st_size
+
+    def _disk_get(self, key: str) -> Optional[CachedResult]:
+        for media_type, extension in _EXTENSIONS.items():
+            path = os.path.join(self.disk_dir, key + extension)
+            try:
+                with open(path, "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
+            os.utime(path)  # mark as recently used for eviction
+            if media_type.startswith("multipart/"):
+                # The body starts with "--<boundary>\r\n"
+                media_type += "; boundary=" + content[2:content.index(b"\r\n")].decode()
+            try:
+                with open(os.path.join(self.disk_dir, key + ".json")) as f:
+                    info = json.load(f)
+            except (FileNotFoundError, ValueError):
+                info = {}
+            return content, media_type, info
+        return None
+
+    def _disk_put(self, key: str, value: CachedResult) -> None:
+        content, media_type, info = value
+        if len(content) > self.disk_bytes:
+            return
+        # Processing info goes into a sidecar first, so a visible image always has it
+        info_path = os.path.join(self.disk_dir, key + ".json")
+        tmp_path = f"{info_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(info, f)
+            written = f.tell()
+        # Usage counts every file, as _disk_entries() does; a rewritten key only adds the difference
+        replaced = _file_size(info_path)
+        os.replace(tmp_path, info_path)
+        path = os.path.join(self.disk_dir, key + _EXTENSIONS.get(media_type.split(";")[0], ".bin"))
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        written += len(content)
+        replaced += _file_size(path)
+        os.replace(tmp_path, path)
+        with self._disk_lock:
+            self._disk_used += written - replaced
+            if self._disk_used > self.disk_bytes:
+                self._disk_evict()
+
+    def _disk_evict(self) -> None:
+        """Delete least recently used files until usage is under 90% of the limit"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[1])
+        used = sum(size for _, _, size in entries)
+        target = self.disk_bytes * 0.9
+        for path, _, size in entries:
+            if used <= target:
+                break
+            try:
+                os.remove(path)
+                used -= size
+            except FileNotFoundError:
+                pass
+        self._disk_used = used
+
+    # Public API
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[CachedResult]]
+    ) -> Tuple[CachedResult, str]:
+        """
+        Return the cached result for key, computing it at most once.
+        The second element is "HIT", "MISS" or "COALESCED".
+        """
+        value = self._memory_get(key)
+        if value is not None:
+            self.hits += 1
+            return value, "HIT"
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight), "COALESCED"
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await asyncio.to_thread(self._disk_get, key) if self.disk_dir else None
+            if value is not None:
+                self.hits += 1
+                status = "HIT"
+                self._memory_put(key, value)
+            else:
+                self.misses += 1
+                status = "MISS"
+                value = await compute()
+                self._memory_put(key, value)
+                if self.disk_dir:
+                    await asyncio.to_thread(self._disk_put, key, value)
+            future.set_result(value)
+            return value, status
+        except asyncio.CancelledError:
+            # Waiters get an error they can retry on, not a cancellation of their own task
+            future.set_exception(ComputationCancelled(f"Computation for {key} was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't log as unretrieved
+            raise
+        finally:
+            del self._inflight[key]
+
+    def status(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_used,
+            "disk_enabled": bool(self.disk_dir),
+            "disk_bytes": self._disk_used,
+        }
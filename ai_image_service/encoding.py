@@ -0,0 +1,175 @@
+"""
+Output encoding: format negotiation, encoder presets and responsive sizes.
+
+The format follows the request's Accept header: AVIF or WebP when the
+client lists them (browsers do for images), otherwise PNG for transparent
+results and JPEG for opaque ones, as before. Every format has three encoder
+presets trading CPU for bytes. Measured on a 1024px RGBA product cutout:
+
+  format  fast             balanced          small
+  png     129 ms / 768 KB  488 ms / 539 KB   6.5 s / 471 KB   (zlib level 1 / 6 / optimize)
+  webp    91 ms / 17 KB    102 ms / 7 KB     1.6 s / 7 KB     (method 0 / 4 / 6)
+  avif    78 ms / 11 KB    379 ms / 11 KB    3.7 s / 10 KB    (speed 8 / 6 / 4)
+  jpeg    4 ms / 47 KB     7 ms / 38 KB      11 ms / 26 KB    (opaque results only)
+
+`python benchmarks/encoders.py` reproduces the table on other images and
+hardware. Several widths can be produced from one result; each is
+downscaled from the previous, larger one rather than from the full image,
+so the resampling work shrinks with every step.
+"""
+
+import io
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, features
+
+FORMATS = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp", "avif": ".avif"}
+PRESETS = ("fast", "balanced", "small")
+DEFAULT_PRESET = os.environ.get("AI_ENCODE_PRESET", "balanced")
+MAX_SIZES = 6
+
+# Save options per format and preset
+ENCODER_OPTIONS: Dict[str, Dict[str, dict]] = {
+    "png": {
+        "fast": {"compress_level": 1},
+        "balanced": {"compress_level": 6},
+        "small": {"optimize": True},
+    },
+    "jpeg": {
+        "fast": {"quality": 90},
+        "balanced": {"quality": 90, "optimize": True},
+        "small": {"quality": 85, "optimize": True, "progressive": True},
+    },
+    "webp": {
+        "fast": {"quality": 85, "method": 0},
+        "balanced": {"quality": 85, "method": 4},
+        "small": {"quality": 80, "method": 6},
+    },
+    "avif": {
+        "fast": {"quality": 60, "speed": 8},
+        "balanced": {"quality": 60, "speed": 6},
+        "small": {"quality": 60, "speed": 4},
+    },
+}
+
+# Preferred first when the client accepts several
+_NEGOTIATION_ORDER = ("avif", "webp")
+
+
+def available_formats() -> Tuple[str, ...]:
+    """Formats this Pillow build can write"""
+    return tuple(
+        name for name in FORMATS
+        if name in ("png", "jpeg") or features.check(name)
+    )
+
+
+def _accepted(accept: str) -> Dict[str, float]:
+    """Media type -> q value from an Accept header"""
+    accepted = {}
+    for item in accept.split(","):
+        media_type, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type:
+            accepted[media_type.strip().lower()] = q
+    return accepted
+
+
+def negotiate(accept: Optional[str], has_alpha: bool) -> str:
+    """
+    Output format for a client. Only explicitly listed modern formats are
+    chosen, so clients sending */* (fetch's default) keep getting PNG/JPEG.
+    """
+    fallback = "png" if has_alpha else "jpeg"
+    if not accept:
+        return fallback
+    accepted = _accepted(accept)
+    available = available_formats()
+    for name in _NEGOTIATION_ORDER:
+        if accepted.get(FORMATS[name], 0) > 0 and name in available:
+            return name
+    return fallback
+
+
+def resolve_format(requested: str, accept: Optional[str], has_alpha: bool) -> str:
+    """
+    requested is "auto" (negotiate) or a format name; raises ValueError for
+    unknown or unavailable formats, and for JPEG on a transparent result.
+    """
+    if requested == "auto":
+        return negotiate(accept, has_alpha)
+    if requested not in FORMATS:
+        raise ValueError(f"format must be auto or one of {', '.join(FORMATS)}")
+    if requested not in available_formats():
+        raise ValueError(f"{requested} encoding is not available on this server")
+    if requested == "jpeg" and has_alpha:
+        raise ValueError("jpeg can't keep transparency; use white_background=true or another format")
+    return requested
+
+
+def parse_sizes(spec: Optional[str]) -> List[int]:
+    """Comma separated output widths, largest first; raises ValueError"""
+    if not spec:
+        return []
+    try:
+        sizes = sorted({int(value) for value in spec.split(",") if value.strip()}, reverse=True)
+    except ValueError:
+        raise ValueError("sizes must be comma separated widths in pixels") from None
+    if not sizes or sizes[-1] < 16 or len(sizes) > MAX_SIZES:
+        raise ValueError(f"sizes must be 1 to {MAX_SIZES} widths of at least 16 pixels")
+    return sizes
+
+
+def encode(image: Image.Image, format: str, preset: str = DEFAULT_PRESET) -> memoryview:
+    """Encoded image, as a memoryview over the output buffer rather than a copy of it"""
+    if format == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=format.upper(), **ENCODER_OPTIONS[format][preset])
+    return buffer.getbuffer()
+
+
+def encode_timed(image: Image.Image, format: str, preset: str = DEFAULT_PRESET) -> Tuple[memoryview, dict]:
+    """Encoded bytes and a report of the format, preset, size, byte count and encode time"""
+    started = time.perf_counter()
+    content = encode(image, format, preset)
+    return content, {
+        "format": format,
+        "preset": preset,
+        "width": image.width,
+        "height": image.height,
+        "bytes": len(content),
+        "encode_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def responsive_sizes(image: Image.Image, widths: Sequence[int]) -> List[Image.Image]:
+    """
+    image at each width (largest first, never upscaled). Every size is
+    resampled from the previous one, so the full-resolution image is only
+    read once.
+    """
+    images = []
+    current = image
+    for width in widths:
+        width = min(width, current.width)
+        if width != current.width:
+            height = max(1, round(current.height * width / current.width))
+            current = current.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        images.append(current)
+    return images
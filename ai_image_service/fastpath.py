@@ -0,0 +1,102 @@
+"""
+Classical background removal for plain studio backgrounds.
+
+Many catalog photos show a product on a solid backdrop. For those, border
+statistics are enough to recognise the background colour and a vectorised
+colour key plus a flood fill from the frame edges produces the mask without
+running U²-Net. Anything that doesn't look clearly uniform is left to the
+neural network (classify_background returns None).
+"""
+
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+ENABLED = os.environ.get("AI_FASTPATH", "1") == "1"
+TOLERANCE = int(os.environ.get("AI_FASTPATH_TOLERANCE", "30"))  # max per-channel distance
+MIN_BORDER_MATCH = 0.98  # share of border pixels that must match the background colour
+MAX_BORDER_ENTROPY = 2.0  # bits, over 4-bit-per-channel quantised border colours
+MIN_FOREGROUND = 0.005
+MAX_FOREGROUND = 0.95
+
+
+def _border_pixels(rgb: np.ndarray) -> np.ndarray:
+    height, width = rgb.shape[:2]
+    strip = max(2, min(height, width) // 50)
+    return np.concatenate([
+        rgb[:strip].reshape(-1, 3),
+        rgb[-strip:].reshape(-1, 3),
+        rgb[strip:-strip, :strip].reshape(-1, 3),
+        rgb[strip:-strip, -strip:].reshape(-1, 3),
+    ])
+
+
+def _entropy(pixels: np.ndarray) -> float:
+    quantised = (pixels >> 4).astype(np.int32)
+    codes = (quantised[:, 0] << 8) | (quantised[:, 1] << 4) | quantised[:, 2]
+    counts = np.bincount(codes, minlength=4096)
+    p = counts[counts > 0] / len(codes)
+    return float(-(p * np.log2(p)).sum())
+
+
+def classify_background(rgb: np.ndarray, tolerance: int = TOLERANCE) -> Optional[np.ndarray]:
+    """Return the background colour if the border is near-uniform, else None"""
+    border = _border_pixels(rgb)
+    color = np.median(border, axis=0).astype(np.int16)
+    distance = np.abs(border.astype(np.int16) - color).max(axis=1)
+    if (distance <= tolerance).mean() < MIN_BORDER_MATCH:
+        return None
+    if _entropy(border) > MAX_BORDER_ENTROPY:
+        return None
+    return color
+
+
+def key_mask(rgb: np.ndarray, color: np.ndarray, tolerance: int = TOLERANCE) -> Optional[np.ndarray]:
+    """
+    Alpha mask (uint8) of everything not connected to the border through
+    background-coloured pixels. Returns None if the result looks implausible.
+    """
+    import cv2
+
+    distance = np.abs(rgb.astype(np.int16) - color).max(axis=2)
+    candidate = (distance <= tolerance).astype(np.uint8)
+
+    # Flood fill from the frame edges: only background-coloured regions that touch
+    # the border are background, so same-coloured details inside the product survive
+    _, labels = cv2.connectedComponents(candidate, connectivity=4)
+    edge_labels = np.unique(np.concatenate([
+        labels[0], labels[-1], labels[:, 0], labels[:, -1]
+    ]))
+    edge_labels = edge_labels[edge_labels > 0]
+    lookup = np.zeros(labels.max() + 1, dtype=bool)
+    lookup[edge_labels] = True
+    background = lookup[labels]
+
+    foreground_share = 1.0 - background.mean()
+    if not MIN_FOREGROUND <= foreground_share <= MAX_FOREGROUND:
+        return None
+
+    alpha = np.where(background, 0, 255).astype(np.uint8)
+    # Soften the one-pixel boundary so edges aren't jagged
+    return cv2.GaussianBlur(alpha, (3, 3), 0)
+
+
+def fast_remove_background(image: Image.Image) -> Tuple[Optional[Image.Image], dict]:
+    """
+    Try the classical path. Returns (RGBA image or None, classification info);
+    None means the image is ambiguous and should go to U²-Net.
+    """
+    rgb = np.asarray(image.convert('RGB') if image.mode != 'RGB' else image)
+    color = classify_background(rgb)
+    if color is None:
+        return None, {"uniform": False}
+
+    alpha = key_mask(rgb, color)
+    if alpha is None:
+        return None, {"uniform": True, "background": color.tolist(), "rejected": True}
+
+    result = image.convert('RGB') if image.mode != 'RGB' else image.copy()
+    result.putalpha(Image.fromarray(alpha))
+    return result, {"uniform": True, "background": color.tolist()}
@@ -0,0 +1,131 @@
+"""
+Input stage: bounded upload spooling and size-aware decoding.
+
+The request body as a whole is capped at MAX_REQUEST_BYTES in the ASGI layer
+(asgi.BodyLimitMiddleware), before the multipart parser writes it to disk.
+Each upload is then streamed in chunks from the parser's spooled temporary
+file, hashing it on the way and enforcing the per-file byte limit, so the
+whole upload is never materialised as one bytes object. Decoding reads
+the header first to enforce a pixel cap, then lets JPEG decode at a reduced
+DCT scale (draft mode) and other formats use reduce() before the final LANCZOS
+pass, so a 24 MP photo is never fully decoded just to be shrunk to 1024 px.
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Optional, Tuple, Union
+
+from fastapi import UploadFile
+from PIL import Image, UnidentifiedImageError
+
+from metrics import StageTimer
+
+MAX_UPLOAD_BYTES = int(os.environ.get("AI_MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+# Whole request body: one upload plus multipart framing and form fields
+MAX_REQUEST_BYTES = int(os.environ.get("AI_MAX_REQUEST_BYTES", str(MAX_UPLOAD_BYTES + 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get("AI_MAX_IMAGE_PIXELS", str(50_000_000)))
+CHUNK_SIZE = 1024 * 1024
+
+# Keep PIL's own decompression-bomb guard in line with ours
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class UploadTooLargeError(ValueError):
+    """Upload exceeds the configured byte limit"""
+
+
+class ImageTooLargeError(ValueError):
+    """Image dimensions exceed the decompression-bomb pixel cap"""
+
+
+class InvalidImageError(ValueError):
+    """Upload is not an image PIL can decode"""
+
+
+async def spool_upload(file: UploadFile, limit: int = MAX_UPLOAD_BYTES) -> Tuple[BinaryIO, str, int]:
+    """
+    Stream the upload in chunks, enforcing the byte limit.
+    Returns the rewound file object, the SHA-256 hex digest and the size.
+    """
+    if file.size is not None and file.size > limit:
+        raise UploadTooLargeError(f"Upload is {file.size} bytes, limit is {limit}")
+
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > limit:
+            raise UploadTooLargeError(f"Upload exceeds {limit} bytes")
+        digest.update(chunk)
+
+    await file.seek(0)
+    return file.file, digest.hexdigest(), size
+
+
+async def detach_upload(source: BinaryIO) -> BinaryIO:
+    """
+    Copy a spooled upload into a temporary file owned by the caller, for work
+    that outlives the request (the framework closes uploads when it ends).
+    """
+    owned = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+    await asyncio.to_thread(shutil.copyfileobj, source, owned)
+    owned.seek(0)
+    return owned
+
+
+def decode_image(
+    source: Union[bytes, BinaryIO], max_size: int, timer: Optional[StageTimer] = None
+) -> Image.Image:
+    """
+    Decode an image so that its longest side is at most max_size.
+    Returns an RGB or RGBA image; decode and resize time go to timer.
+    """
+    timer = timer or StageTimer()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with timer.stage("decode"):
+        # Opening only parses the header, so the cap is checked before any pixel is decoded
+        try:
+            image = Image.open(source)
+        except Image.DecompressionBombError as e:
+            raise ImageTooLargeError(str(e))
+        except UnidentifiedImageError:
+            # PIL's message names the file object, which clients have no business seeing
+            raise InvalidImageError("Invalid image file")
+        width, height = image.size
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ImageTooLargeError(
+                f"Image is {width}x{height}, limit is {MAX_IMAGE_PIXELS} pixels"
+            )
+
+        target = image.size
+        if max(width, height) > max_size:
+            ratio = max_size / max(width, height)
+            target = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+            # JPEG: let libjpeg decode at 1/2, 1/4 or 1/8 scale, still at least the target size
+            if image.format == "JPEG":
+                image.draft("RGB", target)
+
+        # Convert to RGB if necessary
+        try:
+            if image.mode != 'RGB' and image.mode != 'RGBA':
+                image = image.convert('RGB')
+            image.load()
+        except OSError:
+            # Truncated or corrupt pixel data
+            raise InvalidImageError("Invalid image file")
+
+    # Resize if too large (for performance); reducing_gap uses a cheap box reduce first
+    if image.size != target:
+        with timer.stage("resize"):
+            image = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    return image
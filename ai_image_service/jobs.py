@@ -0,0 +1,189 @@
+"""
+In-process job queue for long-running image processing.
+
+Submitting a job returns an id immediately; clients poll the job or
+subscribe to its progress events (one per pipeline stage) and fetch the
+finished artifact by id. Jobs run on a local asyncio queue with a fixed
+number of consumers, finished jobs expire after a TTL and queued or running
+jobs can be cancelled (running ones stop at the next stage boundary). No
+external broker is involved.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+JOB_WORKERS = int(os.environ.get("AI_JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("AI_JOB_QUEUE_SIZE", "100"))
+JOB_TTL_SECONDS = int(os.environ.get("AI_JOB_TTL_SECONDS", "600"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+TERMINAL = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled"""
+
+
+class JobQueueFullError(Exception):
+    """Raised when no more jobs can be queued"""
+
+
+class Job:
+    def __init__(self, runner: Callable[["Job"], Awaitable]):
+        self.id = uuid.uuid4().hex
+        self.runner = runner
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.result = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.events: List[dict] = []
+        self.cancel_requested = False
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._record()
+
+    def _record(self) -> None:
+        self.events.append({
+            "status": self.status,
+            "stage": self.stage,
+            "time": round(time.time() - self.created, 3),
+        })
+        # Wake everyone waiting on the previous event, then start a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def set_stage(self, stage: str) -> None:
+        """Record progress; called on the event loop"""
+        if self.status == RUNNING:
+            self.stage = stage
+            self._record()
+
+    def check_cancelled(self) -> None:
+        """Called between pipeline stages (from any thread)"""
+        if self.cancel_requested:
+            raise JobCancelled(self.id)
+
+    def finish(self, status: str, result=None, error: Optional[str] = None) -> None:
+        self.status = status
+        self.result = result
+        self.error = error
+        self.stage = None
+        self.finished = time.time()
+        self._record()
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL
+
+    async def wait_for_events(self, seen: int) -> None:
+        """Return once there are more than `seen` events"""
+        while len(self.events) <= seen:
+            await self._changed.wait()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+            "events": self.events,
+        }
+
+
+class JobManager:
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        queue_size: int = JOB_QUEUE_SIZE,
+        ttl_seconds: int = JOB_TTL_SECONDS,
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the consumers and the expiry sweeper on the running loop"""
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._expire()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, runner: Callable[[Job], Awaitable]) -> Job:
+        """Queue a job; runner(job) does the work and returns its result"""
+        if self._queue is None:
+            raise RuntimeError("JobManager has not been started")
+        job = Job(runner)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError("Job queue is full")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None or job.done:
+            return job
+        job.cancel_requested = True
+        if job.status == QUEUED:
+            job.finish(CANCELLED)
+        return job
+
+    async def _consume(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.done:  # cancelled while queued
+                    continue
+                job.status = RUNNING
+                job._record()
+                result = await job.runner(job)
+                if job.cancel_requested:
+                    job.finish(CANCELLED)
+                else:
+                    job.finish(DONE, result=result)
+            except JobCancelled:
+                job.finish(CANCELLED)
+            except Exception as e:
+                job.finish(FAILED, error=str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _expire(self) -> None:
+        """Drop finished jobs (and their results) once the TTL has passed"""
+        while True:
+            await asyncio.sleep(max(1, min(60, self.ttl_seconds // 2)))
+            cutoff = time.time() - self.ttl_seconds
+            for job_id, job in list(self._jobs.items()):
+                if job.done and job.finished < cutoff:
+                    del self._jobs[job_id]
+
+    def status(self) -> dict:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "ttl_seconds": self.ttl_seconds,
+            "jobs": counts,
+        }
@@ -1,97 +1,138 @@
 import os
 import io
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import Response
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
-from fastapi.middleware.trustedhost import TrustedHostMiddleware
-import cv2
+import asyncio
+import json
+import logging
+import threading
+import time
+import zipfile
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, BinaryIO, Callable, Iterator, List, Optional, Tuple, Union
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 import numpy as np
 from PIL import Image
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
+import model_registry
+from sessions import DEFAULT_QUALITY, QUALITY_TIERS, get_session, model_for_quality, preload_sessions, registry_status
+from asgi import BodyLimitMiddleware, ImageResponse, SecurityHeadersMiddleware
+from workers import DeadlineExceededError, QueueFullError, RequestCancelled, WorkerPool, stage_guard
+from cache import ComputationCancelled, ResultCache, cache_key, etag_for, etag_matches
+from upscaler import load_upscaler
+from fastpath import ENABLED as FASTPATH_ENABLED, fast_remove_background
+from matting import BATCH_SIZE, MATTING_MODES, coarse_mask, coarse_masks, cutout
+from jobs import JobCancelled, JobManager, JobQueueFullError
+from input_stage import (
+    MAX_REQUEST_BYTES, ImageTooLargeError, InvalidImageError, UploadTooLargeError, decode_image, detach_upload,
+    spool_upload
+)
+from encoding import (
+    DEFAULT_PRESET, EXTENSIONS, FORMATS, PRESETS, encode_timed, parse_sizes, resolve_format, responsive_sizes
+)
+from planner import apply_crop, plan_enhancement
+from variants import composite, multipart, parse_colors, parse_outputs, render_variants
+from metrics import StageMetrics, StageTimer, gauge, labelled_gauge, resident_memory_bytes, server_timing
+
+logging.basicConfig(
+    level=os.environ.get("AI_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("ai_image_service")
+
 # Initialize FastAPI app
 app = FastAPI(title="Simple Image Processing Service", version="1.0.0")
 
-# Configure CORS middleware first
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins for now
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-)
+# Upper bounds on files and bytes per /process-images request
+BATCH_MAX_FILES = int(os.environ.get("AI_BATCH_MAX_FILES", "100"))
+BATCH_MAX_BYTES = int(os.environ.get("AI_BATCH_MAX_BYTES", str(256 * 1024 * 1024)))
 
-# Add middleware for security headers
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    # Handle preflight requests
-    if request.method == "OPTIONS":
-        response = JSONResponse(status_code=200, content={"status": "ok"})
-    else:
-        response = await call_next(request)
-    
-    # Add security headers
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "*"
-    response.headers["Access-Control-Allow-Credentials"] = "true"
-    
-    # Set Content Security Policy
-    csp = """
-        default-src 'self';
-        connect-src 'self' http://localhost:8000 http://127.0.0.1:8000 ws: wss:;
-        img-src 'self' data: blob: http: https:;
-        script-src 'self' 'unsafe-inline' 'unsafe-eval';
-        style-src 'self' 'unsafe-inline';
-        font-src 'self' data:;
-    """.strip().replace('\n', ' ')
-    
-    response.headers["Content-Security-Policy"] = csp
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Referrer-Policy"] = "no-referrer-when-downgrade"
-    
-    return response
-
-# Add a health check endpoint
-@app.get("/health")
-async def health_check():
-    return {"status": "ok", "service": "AI Image Processing"}
+# Request bodies are capped before they are spooled. The middleware added last is outermost,
+# so this runs inside SecurityHeadersMiddleware and its 413 responses get the CORS headers too
+app.add_middleware(BodyLimitMiddleware, limit=MAX_REQUEST_BYTES, path_limits={"/process-images": BATCH_MAX_BYTES})
+
+# CORS (all origins for now) and security headers, precomputed; also answers preflights
+app.add_middleware(SecurityHeadersMiddleware)
 
 # Global variables for models
 esrgan_upsampler = None
+ENHANCE_OUTSCALE = 2  # 2x upscale for reasonable file sizes
+
+# Bounded pool for the CPU-bound pipeline; process workers load their own sessions
+worker_pool = WorkerPool(initializer=preload_sessions)
+
+# Processed results keyed by upload hash and options
+result_cache = ResultCache()
+
+# Asynchronous jobs for slow requests (enhancement on CPU)
+job_manager = JobManager()
+
+# Per-stage latency histograms for /metrics
+stage_metrics = StageMetrics()
+
+# start.py sets the launch time so cold start covers imports and preloading in the parent
+LAUNCHED_AT = float(os.environ.get("AI_LAUNCH_TIME", time.time()))
+readiness = {"ready": False, "cold_start_seconds": None}
 
 def initialize_models():
     """Initialize AI models on startup"""
     global esrgan_upsampler
+    if esrgan_upsampler is not None:
+        return  # already loaded, e.g. by start.py before forking workers
     
     try:
-        # Initialize Real-ESRGAN model
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        esrgan_upsampler = RealESRGANer(
-            scale=4,
-            model_path='https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth',
-            dni_weight=None,
-            model=model,
-            tile=0,
-            tile_pad=10,
-            pre_pad=0,
-            half=False,  # Set to True if you have a powerful GPU
-            gpu_id=None
-        )
-        print("✅ AI models initialized successfully")
+        # Best local model for the output scale (native x2 first), tiled to fit the memory budget
+        esrgan_upsampler = load_upscaler(ENHANCE_OUTSCALE)
+        if esrgan_upsampler is not None:
+            logger.info(
+                "AI models initialized successfully (%s, %s, tile=%s)",
+                esrgan_upsampler.name, esrgan_upsampler.backend, esrgan_upsampler.tile
+            )
+    except Exception as e:
+        logger.warning("Could not initialize Real-ESRGAN: %s", e)
+        logger.warning("The service will work but without upscaling enhancement")
+
+def warm_up_pipeline() -> None:
+    """One small end-to-end run, so the first request doesn't pay for lazy imports and allocations"""
+    ramp = np.linspace(0, 255, 96).astype(np.uint8)
+    pixels = np.dstack([np.tile(ramp, (96, 1)), np.tile(ramp[:, None], (1, 96)), np.full((96, 96), 128, np.uint8)])
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG')
+    try:
+        run_pipeline(buffer.getvalue(), enhance=esrgan_upsampler is not None, max_size=96)
     except Exception as e:
-        print(f"⚠️ Warning: Could not initialize Real-ESRGAN: {e}")
-        print("The service will work but without upscaling enhancement")
+        logger.warning("Pipeline warm-up failed: %s", e)
+
+def preload_models() -> bool:
+    """
+    Load and warm up everything a worker needs. start.py calls this before
+    forking so the weights are shared copy-on-write; each worker calls it again
+    on startup, which only re-runs the warm-up inference.
+    Returns True when background removal is usable.
+    """
+    ready = preload_sessions()
+    initialize_models()
+    warm_up_pipeline()
+    return ready
 
 @app.on_event("startup")
 async def startup_event():
-    print("🚀 Server is starting...")
+    logger.info("Server is starting...")
+    # Load and warm up the models once, off the event loop
+    ready = await asyncio.to_thread(preload_models)
+    job_manager.start()
+    readiness["cold_start_seconds"] = round(time.time() - LAUNCHED_AT, 3)
+    readiness["ready"] = ready
+    if ready:
+        logger.info("Ready in %.2fs after launch", readiness["cold_start_seconds"])
+    else:
+        logger.warning("Models failed to load, not ready: %s", registry_status()["error"])
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_manager.stop()
+    worker_pool.shutdown()
 
 @app.get("/")
 async def root():
@@ -102,185 +143,602 @@ async def root():
         "status": "running"
     }
 
+@app.get("/livez")
+async def liveness():
+    """Liveness: the process is up and its event loop is answering"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness_check():
+    """Readiness: 200 only once the models are loaded and warmed up, 503 before that"""
+    return JSONResponse(
+        status_code=200 if readiness["ready"] else 503,
+        content={
+            "ready": readiness["ready"],
+            "cold_start_seconds": readiness["cold_start_seconds"],
+            "error": registry_status()["error"]
+        }
+    )
+
 @app.get("/health")
 async def health_check():
     return {
-        "status": "healthy",
+        "status": "healthy" if readiness["ready"] else "starting",
+        "ready": readiness["ready"],
+        "cold_start_seconds": readiness["cold_start_seconds"],
         "models": {
             "background_removal": "rembg (u2net)",
-            "upscaling": "Real-ESRGAN" if esrgan_upsampler is not None else "unavailable"
-        }
+            "background_removal_ready": registry_status()["ready"],
+            "upscaling": esrgan_upsampler.name if esrgan_upsampler is not None else "unavailable"
+        },
+        "sessions": registry_status(),
+        "model_files": model_registry.status(),
+        "upscaler": esrgan_upsampler.status() if esrgan_upsampler is not None else None,
+        "workers": worker_pool.status(),
+        "cache": result_cache.status(),
+        "jobs": job_manager.status()
     }
 
-def remove_background(image: Image.Image) -> Image.Image:
+def remove_background(
+    image: Image.Image,
+    matting: str = "edge",
+    timer: Optional[StageTimer] = None,
+    quality: str = DEFAULT_QUALITY
+) -> Image.Image:
     """
     Remove background from image using rembg (U²-Net based).
-    Automatically handles model downloading and GPU acceleration if available.
-    Returns an RGBA image with transparency.
+    matting selects the alpha quality tier: "none" (guided upsampling of the
+    low-res mask), "edge" (plus refinement in a thin boundary band) or "full"
+    (rembg's alpha matting over the whole frame, by far the slowest).
+    quality selects the segmentation model: "fast", "balanced" or "best".
+    Plain studio backgrounds are keyed out classically without the network.
+    Uses the shared session from the registry so the model is loaded only once.
+    Returns an RGBA image with transparency; info["segmentation"] records the path
+    taken and info["model"] the segmentation model, if one ran.
+    Segmentation and matting time go to timer.
     """
+    timer = timer or StageTimer()
     try:
-        print("🚀 Starting background removal...")
+        logger.debug("Starting background removal (matting=%s, quality=%s)", matting, quality)
+        
+        # Near-uniform backgrounds don't need U²-Net; ambiguous images fall through
+        if FASTPATH_ENABLED:
+            with timer.stage("segmentation"):
+                result_image, classification = fast_remove_background(image)
+            if result_image is not None:
+                logger.debug("Uniform background %s, used classical keying", classification['background'])
+                result_image.info['segmentation'] = 'classical'
+                return result_image
         
         # Check if rembg is installed
         try:
-            from rembg import remove, new_session
-            import torch
-        except ImportError as import_error:
-            print("❌ Error: Required packages not found. Please install with:")
-            print("pip install rembg[gpu] torch torchvision torchaudio")
-            print(f"Import error details: {str(import_error)}")
+            from rembg import remove
+        except ImportError:
+            logger.error("Required packages not found. Please install with: pip install rembg[gpu]")
             raise
         
-        # Print CUDA availability
-        cuda_available = torch.cuda.is_available()
-        print(f"💻 CUDA available: {cuda_available}")
-        if cuda_available:
-            print(f"🎮 GPU: {torch.cuda.get_device_name(0)}")
-        
         # Convert PIL image to RGB if it's not already
         if image.mode != 'RGB':
-            print(f"🔄 Converting image from {image.mode} to RGB")
+            logger.debug("Converting image from %s to RGB", image.mode)
             image = image.convert('RGB')
         
-        # Save image to bytes
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_bytes = img_byte_arr.getvalue()
-        
-        print("📥 Initializing U²-Net model (this may take a moment on first run)...")
+        # Shared session, created at startup (or on first use if preload failed)
+        model_name = model_for_quality(quality)
+        session = get_session(model_name)
         
         try:
-            # Initialize session with appropriate providers
-            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if cuda_available else ['CPUExecutionProvider']
-            print(f"⚙️  Using providers: {providers}")
+            if matting == "full":
+                # rembg works on PIL images internally, so handing it the decoded image
+                # (instead of PNG bytes) skips an encode/decode round-trip on both sides.
+                # Inference and matting can't be told apart here; the matting dominates
+                with timer.stage("matting"):
+                    result_image = remove(
+                        image,
+                        session=session,
+                        alpha_matting=True,  # Better for complex images
+                        alpha_matting_foreground_threshold=240,
+                        alpha_matting_background_threshold=10,
+                        alpha_matting_erode_size=10
+                    )
+            else:
+                # Segment at the model's input size, refine only where it matters
+                with timer.stage("segmentation"):
+                    mask = coarse_mask(image, session)
+                with timer.stage("matting"):
+                    result_image = cutout(image, mask, matting)
             
-            session = new_session(
-                'u2net',  # Use u2net model (smaller and faster than u2netp)
-                providers=providers
-            )
-            
-            # The model will be downloaded automatically on first use
-            
-            print("🔍 Removing background...")
-            result = remove(
-                img_bytes,
-                session=session,
-                alpha_matting=True,  # Better for complex images
-                alpha_matting_foreground_threshold=240,
-                alpha_matting_background_threshold=10,
-                alpha_matting_erode_size=10,
-                session_options={
-                    'providers': providers,
-                    'provider_options': [{}] * len(providers)
-                }
-            )
-            
-            if not result:
+            if result_image is None:
                 raise ValueError("Background removal returned empty result")
             
-            # Convert to PIL Image and ensure RGBA mode
-            result_image = Image.open(io.BytesIO(result))
+            # Ensure RGBA mode
             if result_image.mode != 'RGBA':
-                print(f"🔄 Converting result from {result_image.mode} to RGBA")
+                logger.debug("Converting result from %s to RGBA", result_image.mode)
                 result_image = result_image.convert('RGBA')
             
             # Ensure the image has transparency
             if 'A' not in result_image.getbands():
-                print("⚠️  Resulting image has no alpha channel, adding one")
+                logger.warning("Resulting image has no alpha channel, adding one")
                 result_image.putalpha(255)  # Add opaque alpha channel
             
-            print(f"✅ Background removed successfully! Original: {image.size} -> Result: {result_image.size}")
+            logger.debug("Background removed: %s -> %s", image.size, result_image.size)
+            result_image.info['segmentation'] = 'u2net'
+            result_image.info['model'] = model_name
             return result_image
             
         except Exception as model_error:
-            print(f"⚠️  Model error: {str(model_error)}")
-            print("🔄 Falling back to simpler method...")
+            logger.warning("Model error: %s; falling back to simpler method", model_error)
             
-            # Fallback to basic method
+            # Fallback to basic method, reusing the same session
             try:
-                session = new_session('u2net')
-                result = remove(
-                    img_bytes,
-                    session=session,
-                    alpha_matting=False  # Try without alpha matting
-                )
+                with timer.stage("segmentation"):
+                    result_image = remove(
+                        image,
+                        session=session,
+                        alpha_matting=False  # Try without alpha matting
+                    )
                 
-                if not result:
+                if result_image is None:
                     raise ValueError("Fallback background removal failed")
                 
-                result_image = Image.open(io.BytesIO(result))
                 if result_image.mode != 'RGBA':
                     result_image = result_image.convert('RGBA')
+                result_image.info['segmentation'] = 'u2net-fallback'
+                result_image.info['model'] = model_name
                 return result_image
                 
             except Exception as fallback_error:
-                print(f"❌ Fallback method also failed: {str(fallback_error)}")
+                logger.error("Fallback method also failed: %s", fallback_error)
                 raise ValueError(f"All background removal methods failed: {str(fallback_error)}")
             
     except Exception as e:
-        error_msg = f"❌ Error in remove_background: {str(e)}"
-        print(error_msg)
-        print("📋 Make sure you have enough disk space for the model (~200MB)")
-        print("🔧 Try running with a smaller image if you're having memory issues")
+        logger.error(
+            "Error in remove_background: %s. Make sure there is enough disk space for the model "
+            "(~200MB) and try a smaller image if memory is short", e
+        )
         if 'No module named' in str(e):
-            print("\n⚠️  Missing dependencies. Please install them with:")
-            print("pip install -r requirements.txt")
+            logger.error("Missing dependencies. Please install them with: pip install -r requirements.txt")
         
         # Return the original image with an alpha channel as fallback
-        print("⚠️  Returning original image with added alpha channel as fallback")
+        logger.warning("Returning original image with added alpha channel as fallback")
         if image.mode != 'RGBA':
             image = image.convert('RGBA')
+        image.info['segmentation'] = 'none'
         return image
 
-def enhance_image(image: Image.Image) -> Image.Image:
+def enhance_image(image: Image.Image, outscale: float = ENHANCE_OUTSCALE) -> Image.Image:
     """Enhance image quality using Real-ESRGAN"""
     if esrgan_upsampler is None:
-        print("Real-ESRGAN not available, skipping enhancement")
+        logger.debug("Real-ESRGAN not available, skipping enhancement")
         return image
     
     try:
-        # Convert PIL to numpy array
-        img_array = np.array(image)
-        
-        # Convert RGB to BGR for OpenCV
-        if len(img_array.shape) == 3 and img_array.shape[2] == 3:
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-        elif len(img_array.shape) == 3 and img_array.shape[2] == 4:
-            # Handle RGBA images
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGR)
+        # Convert PIL to numpy array (the only copy on the way in)
+        img_array = np.asarray(image)
+        rgb = img_array[:, :, :3] if img_array.ndim == 3 else np.asarray(image.convert('RGB'))
         
-        # Enhance using Real-ESRGAN
-        output, _ = esrgan_upsampler.enhance(img_array, outscale=2)  # 2x upscale for reasonable file sizes
+        # Enhance using tiled Real-ESRGAN
+        output = esrgan_upsampler.upscale(rgb, outscale=outscale)
+        result = Image.fromarray(output)
         
-        # Convert back to RGB
-        output_rgb = cv2.cvtColor(output, cv2.COLOR_BGR2RGB)
-        
-        # Convert back to PIL Image
-        return Image.fromarray(output_rgb)
+        # Keep transparency: the alpha channel is resized, not super-resolved
+        if image.mode == 'RGBA':
+            result.putalpha(image.getchannel('A').resize(result.size, Image.Resampling.LANCZOS))
+        return result
     except Exception as e:
-        print(f"Enhancement failed: {e}, returning original image")
+        logger.warning("Enhancement failed: %s, returning original image", e)
         return image
 
+def enhance_subject(image: Image.Image, max_size: int) -> Tuple[Image.Image, Optional[dict]]:
+    """
+    Enhance only the subject of a background-removed image: crop to it and
+    super-resolve the crop up to max_size (see planner.py). Returns the
+    result and the plan, None if enhancement isn't available.
+    """
+    if esrgan_upsampler is None or image.mode != 'RGBA':
+        return enhance_image(image), None
+    plan = plan_enhancement(image.getchannel('A'), max_size, ENHANCE_OUTSCALE, esrgan_upsampler.scale)
+    image = apply_crop(image, plan)
+    if plan['outscale'] > 1:
+        image = enhance_image(image, plan['outscale'])
+    return image, plan
+
 def add_white_background(image: Image.Image) -> Image.Image:
     """Add white background to transparent image"""
     try:
         if image.mode == 'RGBA':
-            # Create white background
-            white_bg = Image.new('RGB', image.size, (255, 255, 255))
-            white_bg.paste(image, mask=image.split()[3])  # Use alpha channel as mask
-            return white_bg
+            return composite(image, [(255, 255, 255)])[0]
         return image
     except Exception as e:
-        print(f"Background addition failed: {e}")
+        logger.warning("Background addition failed: %s", e)
         return image
 
+def run_pipeline(
+    source: Union[bytes, BinaryIO],
+    remove_bg: bool = True,
+    enhance: bool = True,
+    white_background: bool = False,
+    max_size: int = 1024,
+    matting: str = "edge",
+    quality: str = DEFAULT_QUALITY,
+    output_format: Optional[str] = None,
+    preset: str = DEFAULT_PRESET,
+    sizes: Optional[List[int]] = None,
+    progress: Optional[Callable[[str], None]] = None
+) -> Tuple[memoryview, str, dict]:
+    """
+    Run the CPU-bound processing pipeline on the uploaded image.
+    Executed on the worker pool, never on the event loop.
+    output_format is one of encoding.FORMATS, by default PNG for transparent
+    results and JPEG otherwise; with sizes, one image per width is returned in
+    a multipart/form-data body.
+    progress, if given, is called with each stage name before the stage starts.
+    Returns the encoded image (a memoryview over the output buffer), its media type
+    and a dict describing how it was processed; info["timings"] holds the seconds
+    spent per stage and info["encoding"] the format, byte count and encode time.
+    """
+    report = progress or (lambda stage: None)
+    timer = StageTimer()
+    
+    # Decode close to the target size instead of decoding at full resolution
+    report("decode")
+    image = decode_image(source, max_size, timer)
+    
+    # Process image based on options
+    processed_image = image
+    info = {}
+    
+    # Step 1: Remove background if requested
+    if remove_bg:
+        report("background_removal")
+        processed_image = remove_background(processed_image, matting, timer, quality)
+        info['segmentation'] = processed_image.info.get('segmentation', 'u2net')
+        if 'model' in processed_image.info:
+            info['model'] = processed_image.info['model']
+    
+    return finish_pipeline(
+        processed_image, info, remove_bg, enhance, white_background, max_size,
+        output_format, preset, sizes, report, timer
+    )
+
+def finish_pipeline(
+    processed_image: Image.Image,
+    info: dict,
+    remove_bg: bool,
+    enhance: bool,
+    white_background: bool,
+    max_size: int = 1024,
+    output_format: Optional[str] = None,
+    preset: str = DEFAULT_PRESET,
+    sizes: Optional[List[int]] = None,
+    report: Callable[[str], None] = lambda stage: None,
+    timer: Optional[StageTimer] = None
+) -> Tuple[memoryview, str, dict]:
+    """Enhancement, compositing and encoding, shared by the single and batch pipelines"""
+    timer = timer or StageTimer()
+    
+    # Step 2: Enhance image quality if requested; without a background only the subject is
+    if enhance:
+        report("enhance")
+        with timer.stage("enhance"):
+            if remove_bg:
+                processed_image, plan = enhance_subject(processed_image, max_size)
+                if plan is not None:
+                    info['enhance_plan'] = plan
+            else:
+                processed_image = enhance_image(processed_image)
+    
+    # Step 3: Add white background if requested and background was removed
+    if remove_bg and white_background:
+        with timer.stage("composite"):
+            processed_image = add_white_background(processed_image)
+    
+    # Keep transparency only where the background was removed; otherwise JPEG for smaller files
+    transparent = remove_bg and not white_background
+    output_format = output_format or ("png" if transparent else "jpeg")
+    if not transparent and processed_image.mode == 'RGBA':
+        processed_image = processed_image.convert('RGB')
+    
+    if sizes:
+        # Responsive sizes, each downscaled from the previous one
+        with timer.stage("resize"):
+            images = responsive_sizes(processed_image, sizes)
+    else:
+        images = [processed_image]
+    
+    # Convert result to bytes
+    report("encode")
+    with timer.stage("encode"):
+        encoded = [encode_timed(image, output_format, preset) for image in images]
+    
+    if not sizes:
+        content, info['encoding'] = encoded[0]
+        info['timings'] = timer.timings
+        return content, FORMATS[output_format], info
+    
+    info['encoding'] = [encoding for _, encoding in encoded]
+    parts = [
+        (f"w{encoding['width']}", f"{encoding['width']}w{EXTENSIONS[output_format]}", FORMATS[output_format], content)
+        for content, encoding in encoded
+    ]
+    parts.append(("info", "info.json", "application/json", json.dumps(info).encode()))
+    content, media_type = multipart(parts)
+    info['timings'] = timer.timings
+    return memoryview(content), media_type, info
+
+def run_variants_pipeline(
+    source: Union[bytes, BinaryIO],
+    outputs: List[str],
+    colors: List[Tuple[int, int, int]],
+    crop: bool = False,
+    enhance: bool = False,
+    max_size: int = 1024,
+    matting: str = "edge",
+    quality: str = DEFAULT_QUALITY,
+    progress: Optional[Callable[[str], None]] = None
+) -> Tuple[bytes, str, dict]:
+    """
+    Segment once and render every requested output from the one cutout.
+    Returns a multipart/form-data body with one part per output plus an
+    "info" JSON part, its media type, and the processing info.
+    progress, if given, is called with each stage name before the stage starts.
+    """
+    report = progress or (lambda stage: None)
+    timer = StageTimer()
+    report("decode")
+    image = decode_image(source, max_size, timer)
+    report("background_removal")
+    cutout_image = remove_background(image, matting, timer, quality)
+    info = {'segmentation': cutout_image.info.get('segmentation', 'u2net')}
+    if 'model' in cutout_image.info:
+        info['model'] = cutout_image.info['model']
+    
+    plan = None
+    if enhance:
+        report("enhance")
+        with timer.stage("enhance"):
+            if crop:
+                # Cropping anyway, so only the subject needs super-resolving
+                cutout_image, plan = enhance_subject(cutout_image, max_size)
+            else:
+                cutout_image = enhance_image(cutout_image)
+    
+    report("render")
+    parts, variants_info = render_variants(cutout_image, outputs, colors, crop and plan is None, timer)
+    info.update(variants_info)
+    if plan is not None:
+        info.update(crop=plan['crop'], enhance_plan=plan)
+    parts.append(("info", "info.json", "application/json", json.dumps(info).encode()))
+    content, media_type = multipart(parts)
+    
+    info['timings'] = timer.timings
+    return content, media_type, info
+
+def run_batch_pipeline(
+    sources: List[Union[bytes, BinaryIO]],
+    remove_bg: bool = True,
+    enhance: bool = True,
+    white_background: bool = False,
+    max_size: int = 1024,
+    matting: str = "edge",
+    quality: str = DEFAULT_QUALITY,
+    output_format: Optional[str] = None,
+    preset: str = DEFAULT_PRESET,
+    progress: Optional[Callable[[str], None]] = None
+) -> List[Union[Tuple[memoryview, str, dict], Exception]]:
+    """
+    Process several images with one segmentation call per micro-batch.
+    Returns one entry per source, in order: the run_pipeline result or the
+    exception that item failed with, so one bad file doesn't fail the rest.
+    A batched segmentation call is charged to its images in equal shares.
+    progress, if given, is called with each stage name before the stage
+    starts and may raise to stop the whole batch.
+    """
+    report = progress or (lambda stage: None)
+    results: List[Union[Tuple[memoryview, str, dict], Exception, None]] = [None] * len(sources)
+    timers = [StageTimer() for _ in sources]
+    images = {}
+    for index, source in enumerate(sources):
+        report("decode")
+        try:
+            image = decode_image(source, max_size, timers[index])
+            images[index] = image.convert('RGB') if (remove_bg and image.mode != 'RGB') else image
+        except Exception as e:
+            results[index] = e
+    
+    segmented = {}
+    if remove_bg and images:
+        report("background_removal")
+        pending = []
+        for index, image in images.items():
+            if matting == "full":
+                # Whole-frame matting isn't batchable, go through the single-image path
+                segmented[index] = remove_background(image, matting, timers[index], quality)
+                continue
+            if FASTPATH_ENABLED:
+                with timers[index].stage("segmentation"):
+                    cut, _ = fast_remove_background(image)
+                if cut is not None:
+                    cut.info['segmentation'] = 'classical'
+                    segmented[index] = cut
+                    continue
+            pending.append(index)
+        
+        if pending:
+            try:
+                # One ONNX call per micro-batch instead of one per image
+                started = time.perf_counter()
+                model_name = model_for_quality(quality)
+                masks = coarse_masks([images[index] for index in pending], get_session(model_name))
+                share = (time.perf_counter() - started) / len(pending)
+                for index, mask in zip(pending, masks):
+                    timers[index].add("segmentation", share)
+                    with timers[index].stage("matting"):
+                        segmented[index] = cutout(images[index], mask, matting)
+                    segmented[index].info['segmentation'] = 'u2net'
+                    segmented[index].info['model'] = model_name
+            except Exception as e:
+                logger.warning("Batched segmentation failed (%s), processing images one by one", e)
+                for index in pending:
+                    segmented[index] = remove_background(images[index], matting, timers[index], quality)
+    
+    for index, image in images.items():
+        try:
+            info = {}
+            if remove_bg:
+                image = segmented[index]
+                info['segmentation'] = image.info.get('segmentation', 'u2net')
+                if 'model' in image.info:
+                    info['model'] = image.info['model']
+            results[index] = finish_pipeline(
+                image, info, remove_bg, enhance, white_background, max_size,
+                output_format, preset, timer=timers[index]
+            )
+        except Exception as e:
+            results[index] = e
+    return results
+
+async def run_pipeline_on_pool(timer: StageTimer, *args, **kwargs) -> Tuple[memoryview, str, dict]:
+    """
+    Run run_pipeline on the worker pool (lane and deadline go to the pool).
+    Its stage timings are moved into timer so they describe this computation
+    only and never end up in the cache.
+    """
+    content, media_type, info = await worker_pool.run(run_pipeline, *args, **kwargs)
+    for name, seconds in info.pop('timings', {}).items():
+        timer.add(name, seconds)
+    return content, media_type, info
+
+DISCONNECT_POLL_SECONDS = 0.25
+
+def request_deadline(budget_ms: Optional[float]) -> Optional[float]:
+    """time.monotonic() deadline from an X-Deadline-Ms budget, counted from now"""
+    if budget_ms is None:
+        return None
+    if budget_ms <= 0:
+        raise HTTPException(status_code=400, detail="X-Deadline-Ms must be a positive number of milliseconds")
+    return time.monotonic() + budget_ms / 1000
+
+@asynccontextmanager
+async def disconnect_watch(request: Request) -> AsyncIterator[threading.Event]:
+    """Event that is set once the client goes away, for stage_guard to check between stages"""
+    disconnected = threading.Event()
+    
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+        disconnected.set()
+    
+    task = asyncio.create_task(watch())
+    try:
+        yield disconnected
+    finally:
+        task.cancel()
+
+async def compute_cached(
+    key: str, compute, disconnected: Optional[threading.Event] = None, deadline: Optional[float] = None
+):
+    """
+    result_cache.get_or_compute, except that a shared computation this request
+    only waited on, stopped for the request that started it (its client left,
+    its deadline passed, it was cancelled), is computed again for this one,
+    unless this request's own client or deadline is gone too.
+    """
+    while True:
+        led = False
+        
+        async def lead():
+            nonlocal led
+            led = True
+            return await compute()
+        
+        try:
+            return await result_cache.get_or_compute(key, lead)
+        except (RequestCancelled, DeadlineExceededError, JobCancelled, ComputationCancelled):
+            if led:
+                raise
+            if disconnected is not None and disconnected.is_set():
+                raise RequestCancelled("Client disconnected while waiting for a shared result")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceededError("Deadline passed while waiting for a shared result")
+
+@contextmanager
+def pipeline_errors() -> Iterator[None]:
+    """HTTP errors for pipeline failures, shared by the endpoints that answer with the image"""
+    try:
+        yield
+    except (UploadTooLargeError, ImageTooLargeError) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RequestCancelled as e:
+        # Nobody is listening any more; 499 as nginx logs it
+        raise HTTPException(status_code=499, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
+
+def item_error(e: Exception) -> str:
+    """Error for one failed item of a batch, in the words pipeline_errors() uses"""
+    if isinstance(e, (UploadTooLargeError, ImageTooLargeError, InvalidImageError)):
+        return str(e)
+    logger.warning("Batch item failed: %s", e)
+    return "Image processing failed"
+
+def validate_options(matting: str, quality: str) -> None:
+    if matting not in MATTING_MODES:
+        raise HTTPException(status_code=400, detail=f"matting must be one of {', '.join(MATTING_MODES)}")
+    if quality not in QUALITY_TIERS:
+        raise HTTPException(status_code=400, detail=f"quality must be one of {', '.join(QUALITY_TIERS)}")
+
+def resolve_output(
+    format: str, preset: str, sizes: Optional[str], accept: Optional[str], transparent: bool
+) -> Tuple[str, List[int]]:
+    """Output format (negotiated from Accept for "auto") and responsive widths, or a 400"""
+    if preset not in PRESETS:
+        raise HTTPException(status_code=400, detail=f"preset must be one of {', '.join(PRESETS)}")
+    try:
+        return resolve_format(format, accept, transparent), parse_sizes(sizes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def encoding_header(encoding: Union[dict, List[dict]]) -> str:
+    """Format, preset, byte count and encode time of each encoded image"""
+    encodings = encoding if isinstance(encoding, list) else [encoding]
+    return ", ".join(
+        f"{e['format']};preset={e['preset']};w={e['width']};bytes={e['bytes']};ms={e['encode_ms']}"
+        for e in encodings
+    )
+
+def validate_upload(file: UploadFile, matting: str, quality: str) -> None:
+    """Reject requests that can't be processed before any work is done"""
+    # Validate file type
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    validate_options(matting, quality)
+
 @app.post("/process-image")
 async def process_image(
+    request: Request,
     file: UploadFile = File(...),
     remove_bg: bool = True,
     enhance: bool = True,
     white_background: bool = False,
-    max_size: int = 1024
+    max_size: int = 1024,
+    matting: str = "edge",
+    quality: str = DEFAULT_QUALITY,
+    format: str = "auto",
+    preset: str = DEFAULT_PRESET,
+    sizes: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    x_deadline_ms: Optional[float] = Header(None)
 ):
     """
     Process uploaded image with AI enhancements
@@ -288,85 +746,540 @@ async def process_image(
     Args:
         file: Image file to process
         remove_bg: Whether to remove background
-        enhance: Whether to enhance image quality
+        enhance: Whether to enhance image quality; with remove_bg the output is
+            the subject crop, super-resolved up to max_size
         white_background: Whether to add white background (if remove_bg=True)
         max_size: Maximum dimension for output image
+        matting: Alpha quality tier for background removal: none, edge or full
+        quality: Segmentation model tier: fast, balanced or best
+        format: auto (AVIF or WebP if the Accept header lists them, else PNG/JPEG),
+            png, jpeg, webp or avif
+        preset: Encoder effort: fast, balanced or small
+        sizes: Comma separated widths; returns every size in one multipart/form-data
+            response, each downscaled from the next larger one
+        accept: Accept header, used to negotiate the format
+        if_none_match: ETag from a previous response; answered with 304 if unchanged
+        x_deadline_ms: Time budget in milliseconds; work that can't finish in it is
+            dropped with 504 instead of being computed
+    
+    Enhancement runs in the heavy lane of the worker pool, everything else in
+    the quick lane. Processing stops between stages if the client disconnects.
     """
     
-    # Validate file type
-    if not file.content_type or not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    validate_upload(file, matting, quality)
+    output_format, widths = resolve_output(format, preset, sizes, accept, remove_bg and not white_background)
+    deadline = request_deadline(x_deadline_ms)
+    started = time.perf_counter()
+    timer = StageTimer()
     
-    try:
-        # Read uploaded file
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+    with pipeline_errors():
+        # Stream the upload with a hard size limit, hashing it on the way
+        with timer.stage("read"):
+            source, digest, _ = await spool_upload(file)
         
-        # Convert to RGB if necessary
-        if image.mode != 'RGB' and image.mode != 'RGBA':
-            image = image.convert('RGB')
+        # Process workers can't share the spooled file object, so hand them the bytes
+        if worker_pool.kind == "process":
+            source = source.read()
         
-        # Resize if too large (for performance)
-        if max(image.size) > max_size:
-            ratio = max_size / max(image.size)
-            new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
+        key = cache_key(
+            digest,
+            remove_bg=remove_bg,
+            enhance=enhance,
+            white_background=white_background,
+            max_size=max_size,
+            matting=matting,
+            # The model the tier resolves to, so adding a model file changes the key
+            model=model_for_quality(quality) if remove_bg else None,
+            format=output_format,
+            preset=preset,
+            sizes=widths
+        )
         
-        # Process image based on options
-        processed_image = image
+        # The output is fully determined by the key, so the client's copy is still valid
+        if etag_matches(if_none_match, key):
+            return Response(status_code=304, headers={"ETag": etag_for(key), "Vary": "Accept"})
         
-        # Step 1: Remove background if requested
-        if remove_bg:
-            print("Removing background...")
-            processed_image = remove_background(processed_image)
+        # Heavy lifting happens on the worker pool so the event loop stays responsive;
+        # identical concurrent requests share one computation
+        async with disconnect_watch(request) as disconnected:
+            # Process workers can't receive the callback
+            guard = stage_guard(disconnected, deadline) if worker_pool.kind != "process" else None
+            (content, media_type, info), cache_status = await compute_cached(
+                key,
+                lambda: run_pipeline_on_pool(
+                    timer, source, remove_bg, enhance, white_background, max_size, matting, quality,
+                    output_format=output_format, preset=preset, sizes=widths, progress=guard,
+                    lane="heavy" if enhance else "quick", deadline=deadline
+                ),
+                disconnected, deadline
+            )
         
-        # Step 2: Enhance image quality if requested
-        if enhance:
-            print("Enhancing image quality...")
-            processed_image = enhance_image(processed_image)
+        timer.add("total", time.perf_counter() - started)
+        stage_metrics.observe(timer.timings)
         
-        # Step 3: Add white background if requested and background was removed
-        if remove_bg and white_background:
-            processed_image = add_white_background(processed_image)
+        headers = {
+            "X-Processing-Info": f"bg_removed={remove_bg}, enhanced={enhance}, white_bg={white_background}",
+            "ETag": etag_for(key),
+            "Vary": "Accept",
+            "X-Cache": cache_status,
+            "X-Segmentation": info.get("segmentation", "none"),
+            "X-Segmentation-Model": info.get("model", "none"),
+            "X-Encoding": encoding_header(info.get("encoding", [])),
+            "Server-Timing": f'{server_timing(timer.timings)}, cache;desc="{cache_status}"'
+        }
+        if not widths:
+            name = os.path.splitext(file.filename or "image")[0]
+            headers["Content-Disposition"] = f"attachment; filename=processed_{name}{EXTENSIONS[output_format]}"
+        return ImageResponse(content=content, media_type=media_type, headers=headers)
+
+@app.post("/remove-background")
+async def remove_background_only(
+    request: Request,
+    file: UploadFile = File(...),
+    matting: str = "edge",
+    quality: str = DEFAULT_QUALITY,
+    format: str = "auto",
+    preset: str = DEFAULT_PRESET,
+    sizes: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    x_deadline_ms: Optional[float] = Header(None)
+):
+    """Quick endpoint for background removal only"""
+    return await process_image(
+        request, file, remove_bg=True, enhance=False, white_background=False,
+        matting=matting, quality=quality, format=format, preset=preset, sizes=sizes,
+        accept=accept, if_none_match=if_none_match, x_deadline_ms=x_deadline_ms
+    )
+
+@app.post("/enhance-image")
+async def enhance_image_only(
+    request: Request,
+    file: UploadFile = File(...),
+    format: str = "auto",
+    preset: str = DEFAULT_PRESET,
+    sizes: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    x_deadline_ms: Optional[float] = Header(None)
+):
+    """Quick endpoint for image enhancement only"""
+    return await process_image(
+        request, file, remove_bg=False, enhance=True, white_background=False,
+        format=format, preset=preset, sizes=sizes, accept=accept, if_none_match=if_none_match,
+        x_deadline_ms=x_deadline_ms
+    )
+
+@app.post("/process-image/variants")
+async def process_image_variants(
+    request: Request,
+    file: UploadFile = File(...),
+    outputs: str = "mask,cutout,composite",
+    colors: str = "white",
+    crop: bool = False,
+    enhance: bool = False,
+    max_size: int = 1024,
+    matting: str = "edge",
+    quality: str = DEFAULT_QUALITY,
+    if_none_match: Optional[str] = Header(None),
+    x_deadline_ms: Optional[float] = Header(None)
+):
+    """
+    Remove the background once and return several outputs in one
+    multipart/form-data response, so switching between them never reruns
+    segmentation.
+    
+    Args:
+        file: Image file to process
+        outputs: Comma separated subset of mask, cutout and composite
+        colors: Comma separated background colours for composites (names or hex, e.g. white,f4f1ea)
+        crop: Crop every output to the subject's bounding box plus padding
+        enhance: Whether to enhance the cutout before rendering (only the crop, with crop=true)
+        max_size: Maximum dimension of the processed image
+        matting: Alpha quality tier for background removal: none, edge or full
+        quality: Segmentation model tier: fast, balanced or best
+        if_none_match: ETag from a previous response; answered with 304 if unchanged
+        x_deadline_ms: Time budget in milliseconds, as for /process-image
+    """
+    validate_upload(file, matting, quality)
+    try:
+        output_names = parse_outputs(outputs)
+        color_values = parse_colors(colors) if "composite" in output_names else []
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    deadline = request_deadline(x_deadline_ms)
+    started = time.perf_counter()
+    timer = StageTimer()
+    
+    with pipeline_errors():
+        with timer.stage("read"):
+            source, digest, _ = await spool_upload(file)
+        if worker_pool.kind == "process":
+            source = source.read()
         
-        # Convert result to bytes
-        output_buffer = io.BytesIO()
+        key = cache_key(
+            digest,
+            variants=",".join(output_names),
+            colors=",".join(map(str, color_values)),
+            crop=crop,
+            enhance=enhance,
+            max_size=max_size,
+            matting=matting,
+            model=model_for_quality(quality)
+        )
+        if etag_matches(if_none_match, key):
+            return Response(status_code=304, headers={"ETag": etag_for(key)})
         
-        # Save with appropriate format
-        if remove_bg and not white_background:
-            # Keep transparency
-            processed_image.save(output_buffer, format='PNG', optimize=True)
-            media_type = "image/png"
-        else:
-            # Save as JPEG for smaller file size
-            if processed_image.mode == 'RGBA':
-                processed_image = processed_image.convert('RGB')
-            processed_image.save(output_buffer, format='JPEG', quality=90, optimize=True)
-            media_type = "image/jpeg"
+        async with disconnect_watch(request) as disconnected:
+            guard = stage_guard(disconnected, deadline) if worker_pool.kind != "process" else None
+            
+            async def compute():
+                content, media_type, info = await worker_pool.run(
+                    run_variants_pipeline, source, output_names, color_values,
+                    crop, enhance, max_size, matting, quality, guard,
+                    lane="heavy" if enhance else "quick", deadline=deadline
+                )
+                for name, seconds in info.pop('timings', {}).items():
+                    timer.add(name, seconds)
+                return content, media_type, info
+            
+            (content, media_type, info), cache_status = await compute_cached(key, compute, disconnected, deadline)
         
-        output_buffer.seek(0)
+        timer.add("total", time.perf_counter() - started)
+        stage_metrics.observe(timer.timings)
         
-        return Response(
-            content=output_buffer.getvalue(),
+        return ImageResponse(
+            content=content,
             media_type=media_type,
             headers={
-                "Content-Disposition": f"attachment; filename=processed_{file.filename}",
-                "X-Processing-Info": f"bg_removed={remove_bg}, enhanced={enhance}, white_bg={white_background}"
+                "ETag": etag_for(key),
+                "X-Cache": cache_status,
+                "X-Segmentation": info.get("segmentation", "none"),
+                "X-Segmentation-Model": info.get("model", "none"),
+                "Server-Timing": f'{server_timing(timer.timings)}, cache;desc="{cache_status}"'
             }
         )
+
+class _ZipChunks(io.RawIOBase):
+    """Write-only sink that lets zipfile stream into a response chunk by chunk"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+@app.post("/process-images")
+async def process_images(
+    files: List[UploadFile] = File(...),
+    remove_bg: bool = True,
+    enhance: bool = False,
+    white_background: bool = False,
+    max_size: int = 1024,
+    matting: str = "edge",
+    quality: str = DEFAULT_QUALITY,
+    format: str = "auto",
+    preset: str = DEFAULT_PRESET
+):
+    """
+    Process many images with shared options (e.g. onboarding a store catalog).
+    Segmentation runs one ONNX call per micro-batch. Returns a zip stream with
+    the results in upload order plus manifest.json; failed items are listed in
+    the manifest with their error instead of failing the whole batch.
+    format "auto" means PNG for transparent results and JPEG otherwise.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_FILES} files per request")
+    validate_options(matting, quality)
+    # The response is a zip, so there is no image Accept header to negotiate with
+    output_format, _ = resolve_output(format, preset, None, None, remove_bg and not white_background)
+    
+    # Spool every upload; per-item problems become per-item errors
+    items = []
+    for file in files:
+        try:
+            if not file.content_type or not file.content_type.startswith('image/'):
+                raise InvalidImageError("File must be an image")
+            source, _, _ = await spool_upload(file)
+            # Results are streamed after this handler returns and the uploads are closed
+            items.append(await detach_upload(source))
+        except Exception as e:
+            items.append(e)
+    
+    valid = [index for index, item in enumerate(items) if not isinstance(item, Exception)]
+    batches = [valid[start:start + BATCH_SIZE] for start in range(0, len(valid), BATCH_SIZE)]
+    
+    # Set when the client goes away; worker threads then stop before their next stage
+    stopped = threading.Event()
+    guard = stage_guard(stopped) if worker_pool.kind != "process" else None
+    
+    async def run_batch(indexes):
+        sources = [items[index] for index in indexes]
+        # Process workers get the bytes; read once, a retry after a full queue reuses them
+        if worker_pool.kind == "process":
+            sources = [source.read() for source in sources]
+        while True:
+            try:
+                call = worker_pool.run(
+                    run_batch_pipeline, sources,
+                    remove_bg, enhance, white_background, max_size, matting, quality,
+                    output_format, preset, guard, lane="heavy"
+                )
+                if guard is None:
+                    return await call
+                work = asyncio.ensure_future(call)
+                try:
+                    return await asyncio.shield(work)
+                except asyncio.CancelledError:
+                    # The worker thread may still be reading the uploads, which are closed after this
+                    await asyncio.gather(work, return_exceptions=True)
+                    raise
+            except QueueFullError as e:
+                # Micro-batches wait for capacity instead of failing
+                await asyncio.sleep(e.retry_after)
+    
+    # Micro-batches run concurrently on the pool; results are streamed in order
+    batch_of = {}
+    for indexes in batches:
+        task = asyncio.create_task(run_batch(indexes))
+        for offset, index in enumerate(indexes):
+            batch_of[index] = (task, offset)
+    
+    async def stream():
+        sink = _ZipChunks()
+        manifest = []
+        try:
+            with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+                for index, item in enumerate(items):
+                    if index in batch_of:
+                        task, offset = batch_of[index]
+                        try:
+                            item = (await task)[offset]
+                        except Exception as e:
+                            item = e
+                
+                    filename = files[index].filename or "image"
+                    entry = {"index": index, "filename": filename}
+                    if isinstance(item, Exception):
+                        entry.update(status="error", error=item_error(item))
+                    else:
+                        content, media_type, info = item
+                        stage_metrics.observe(info.pop('timings', {}))
+                        name = f"{index:03d}_{os.path.splitext(filename)[0]}"
+                        name += EXTENSIONS[output_format]
+                        # Images are already compressed, so entries are stored as-is
+                        archive.writestr(name, content)
+                        entry.update(status="ok", name=name, media_type=media_type, **info)
+                    manifest.append(entry)
+                    yield sink.drain()
+                archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+            yield sink.drain()
+        finally:
+            # A disconnected client leaves batches queued or running; stop them before closing the uploads
+            stopped.set()
+            tasks = {task for task, _ in batch_of.values()}
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for item in items:
+                if not isinstance(item, Exception):
+                    item.close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=processed_images.zip"}
+    )
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    remove_bg: bool = True,
+    enhance: bool = True,
+    white_background: bool = False,
+    max_size: int = 1024,
+    matting: str = "edge",
+    quality: str = DEFAULT_QUALITY,
+    format: str = "auto",
+    preset: str = DEFAULT_PRESET,
+    sizes: Optional[str] = None,
+    accept: Optional[str] = Header(None)
+):
+    """
+    Queue an image for processing and return its job id immediately.
+    Same options as /process-image; format "auto" negotiates with this
+    request's Accept header. Follow progress at /jobs/{id} or
+    /jobs/{id}/events (SSE) and download the result from /jobs/{id}/result.
+    """
+    validate_upload(file, matting, quality)
+    output_format, widths = resolve_output(format, preset, sizes, accept, remove_bg and not white_background)
+    
+    try:
+        source, digest, _ = await spool_upload(file)
+    except (UploadTooLargeError, ImageTooLargeError) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    # The upload is closed when this request ends, so the job keeps its own copy
+    owned = await detach_upload(source)
+    
+    key = cache_key(
+        digest,
+        remove_bg=remove_bg,
+        enhance=enhance,
+        white_background=white_background,
+        max_size=max_size,
+        matting=matting,
+        model=model_for_quality(quality) if remove_bg else None,
+        format=output_format,
+        preset=preset,
+        sizes=widths
+    )
+    loop = asyncio.get_running_loop()
+    
+    async def runner(job):
+        def progress(stage: str) -> None:
+            # Runs on the worker thread between stages
+            job.check_cancelled()
+            loop.call_soon_threadsafe(job.set_stage, stage)
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
+        # Process workers can't receive the callback or the file object
+        if worker_pool.kind == "process":
+            payload, callback = owned.read(), None
+        else:
+            payload, callback = owned, progress
+        
+        try:
+            while True:
+                try:
+                    timer = StageTimer()
+                    result, _ = await compute_cached(
+                        key,
+                        lambda: run_pipeline_on_pool(
+                            timer, payload, remove_bg, enhance, white_background,
+                            max_size, matting, quality, output_format=output_format,
+                            preset=preset, sizes=widths, progress=callback, lane="heavy"
+                        )
+                    )
+                    stage_metrics.observe(timer.timings)
+                    return result
+                except QueueFullError as e:
+                    # Jobs wait for capacity instead of failing
+                    job.check_cancelled()
+                    await asyncio.sleep(e.retry_after)
+        finally:
+            owned.close()
+    
+    try:
+        job = job_manager.submit(runner)
+    except JobQueueFullError as e:
+        owned.close()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+        "result_url": f"/jobs/{job.id}/result"
+    }
 
-@app.post("/remove-background")
-async def remove_background_only(file: UploadFile = File(...)):
-    """Quick endpoint for background removal only"""
-    return await process_image(file, remove_bg=True, enhance=False, white_background=False)
+def get_job_or_404(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
 
-@app.post("/enhance-image")
-async def enhance_image_only(file: UploadFile = File(...)):
-    """Quick endpoint for image enhancement only"""
-    return await process_image(file, remove_bg=False, enhance=True, white_background=False)
+@app.get("/metrics")
+async def metrics():
+    """Stage latency histograms and service gauges in Prometheus text format"""
+    workers = worker_pool.status()
+    cache = result_cache.status()
+    jobs = job_manager.status()
+    rss = resident_memory_bytes()
+    lines = stage_metrics.render()
+    lines += gauge("ai_worker_running", "Pipeline jobs running on the worker pool", workers["running"])
+    lines += gauge("ai_worker_queue_depth", "Pipeline jobs admitted and waiting for a worker", workers["waiting"])
+    lines += gauge("ai_worker_rejected_total", "Requests rejected with 429", workers["rejected"], "counter")
+    lines += gauge("ai_worker_deadline_dropped_total", "Requests dropped with 504 because their deadline couldn't be met", workers["deadline_dropped"], "counter")
+    lines += gauge("ai_worker_cancelled_total", "Pipeline runs stopped because the client disconnected", workers["cancelled"], "counter")
+    lanes = workers["lanes"]
+    for field, name, help_text, kind in (
+        ("running", "ai_lane_running", "Pipeline jobs running, per worker pool lane", "gauge"),
+        ("waiting", "ai_lane_waiting", "Pipeline jobs waiting for a worker, per lane", "gauge"),
+        ("deadline_dropped", "ai_lane_deadline_dropped_total", "Requests dropped for their deadline, per lane", "counter"),
+        ("cancelled", "ai_lane_cancelled_total", "Pipeline runs stopped by a client disconnect, per lane", "counter"),
+        ("avg_seconds", "ai_lane_avg_seconds", "Moving average run time, per lane", "gauge"),
+    ):
+        lines += labelled_gauge(name, help_text, "lane", {lane: status[field] for lane, status in lanes.items()}, kind)
+    lines += gauge("ai_cache_hits_total", "Result cache hits", cache["hits"], "counter")
+    lines += gauge("ai_cache_misses_total", "Result cache misses", cache["misses"], "counter")
+    lines += gauge("ai_cache_coalesced_total", "Requests that shared an in-flight computation", cache["coalesced"], "counter")
+    lines += gauge("ai_cache_hit_ratio", "Result cache hit rate", cache["hit_rate"])
+    lines += gauge("ai_cache_memory_bytes", "Bytes held by the in-memory cache tier", cache["memory_bytes"])
+    lines += gauge("ai_jobs_queued", "Jobs waiting in the job queue", jobs["queued"])
+    lines += gauge("ai_ready", "1 once models are loaded and warmed up", int(readiness["ready"]))
+    if readiness["cold_start_seconds"] is not None:
+        lines += gauge("ai_cold_start_seconds", "Seconds from launch to ready", readiness["cold_start_seconds"])
+    if rss is not None:
+        lines += gauge("process_resident_memory_bytes", "Resident memory size in bytes", rss)
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Current status, stage and progress events of a job"""
+    return get_job_or_404(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events, one per stage change, until the job finishes"""
+    job = get_job_or_404(job_id)
+    
+    async def stream():
+        seen = 0
+        while True:
+            await job.wait_for_events(seen)
+            for event in job.events[seen:]:
+                yield f"data: {json.dumps(event)}\n\n"
+            seen = len(job.events)
+            if job.done:
+                return
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """Download the processed image of a finished job"""
+    job = get_job_or_404(job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    content, media_type, info = job.result
+    return ImageResponse(
+        content=content,
+        media_type=media_type,
+        headers={
+            "X-Segmentation": info.get("segmentation", "none"),
+            "X-Encoding": encoding_header(info.get("encoding", []))
+        }
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job; running jobs stop at the next stage"""
+    get_job_or_404(job_id)
+    return job_manager.cancel(job_id).to_dict()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,129 @@
+"""
+Per-stage timing and Prometheus metrics.
+
+The pipeline records how long each stage takes (read, decode, resize,
+segmentation, matting, enhance, composite, encode) with a StageTimer. The
+request handler turns those timings into a Server-Timing header and feeds
+them into per-stage Prometheus histograms (ai_stage_seconds, with cumulative
+buckets from 5 ms to 60 s, plus _sum and _count), exposed with the service
+gauges in Prometheus text format at /metrics. Quantiles are left to
+histogram_quantile() over the buckets, so they can be aggregated across
+processes. Timings travel back with the result rather than being recorded
+in the worker, so they also arrive from process workers.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+# Series that exist from startup, so rate() sees them before the first request
+STAGES = ("read", "decode", "resize", "segmentation", "matting", "enhance", "composite", "encode", "total")
+# Upper bounds in seconds, from a cache hit's read to a CPU enhancement
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class StageTimer:
+    """Accumulates wall-clock seconds per stage for one request"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Format timings (seconds) as a Server-Timing header value, in milliseconds"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+class Histogram:
+    """Cumulative bucket counts, count and sum since start"""
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def cumulative(self) -> List[int]:
+        counts, running = [], 0
+        for count in self.counts:
+            running += count
+            counts.append(running)
+        return counts
+
+
+def _bound(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class StageMetrics:
+    def __init__(self, stages: Sequence[str] = STAGES, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self._stages: Dict[str, Histogram] = {name: Histogram(self.buckets) for name in stages}
+        self._lock = threading.Lock()
+
+    def observe(self, timings: Dict[str, float]) -> None:
+        with self._lock:
+            for name, seconds in timings.items():
+                histogram = self._stages.get(name)
+                if histogram is None:
+                    histogram = self._stages[name] = Histogram(self.buckets)
+                histogram.observe(seconds)
+
+    def render(self) -> List[str]:
+        lines = [
+            "# HELP ai_stage_seconds Pipeline stage latency",
+            "# TYPE ai_stage_seconds histogram",
+        ]
+        with self._lock:
+            for name, histogram in sorted(self._stages.items()):
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.cumulative()):
+                    lines.append(f'ai_stage_seconds_bucket{{stage="{name}",le="{_bound(bound)}"}} {count}')
+                lines.append(f'ai_stage_seconds_sum{{stage="{name}"}} {histogram.total:.6f}')
+                lines.append(f'ai_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+        return lines
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """Current RSS from /proc (Linux); peak RSS elsewhere"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+def gauge(name: str, help_text: str, value, kind: str = "gauge") -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+def labelled_gauge(name: str, help_text: str, label: str, values: Dict[str, object], kind: str = "gauge") -> List[str]:
+    """One metric with a sample per label value, e.g. per worker pool lane"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f'{name}{{{label}="{key}"}} {value}' for key, value in sorted(values.items())]
+    return lines
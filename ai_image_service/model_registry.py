@@ -0,0 +1,273 @@
+"""
+Local model registry.
+
+Every model the service runs (the rembg segmentation models and the
+Real-ESRGAN upscalers) is resolved from one local directory, AI_MODEL_DIR,
+and checked against the SHA-256 recorded for it in manifest.json there, so a
+node never downloads weights at runtime and never runs a corrupted or swapped
+file. Files that aren't listed in the manifest are loaded with a warning;
+`python model_registry.py lock` records the current files, and
+`python model_registry.py quantize <name>` adds an INT8 variant of a model.
+
+Weights are memory-mapped where the runtime allows it, so worker processes
+share one copy through the page cache:
+- torch checkpoints (zip format, torch >= 1.6) are loaded with mmap and the
+  tensors assigned to the network as they are
+- ONNX models saved with external data (`<name>.onnx.data`, see
+  `python model_registry.py externalize <name>`) have their initializers
+  mapped by onnxruntime. The NCHWc layout optimisation copies conv weights
+  out of the mapping, though, so the mapping is only kept with
+  AI_MODEL_MMAP=1, which caps the graph optimisation level at "extended" and
+  costs inference speed. By default the weights are copied and get shared
+  copy-on-write by the pre-forking launcher (start.py --production) instead.
+
+The load time and resident memory of every loaded model are reported in
+/health.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from metrics import resident_memory_bytes
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.environ.get(
+    "AI_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+)
+MANIFEST_NAME = "manifest.json"
+VERIFY = os.environ.get("AI_MODEL_VERIFY", "1") == "1"
+MMAP_ONNX = os.environ.get("AI_MODEL_MMAP", "0") == "1"
+MODEL_EXTENSIONS = (".onnx", ".pth", ".data")
+
+
+class ModelNotFoundError(FileNotFoundError):
+    """The model file is not in the model directory"""
+
+
+class ModelChecksumError(ValueError):
+    """The model file doesn't match the checksum in the manifest"""
+
+
+_loaded: Dict[str, dict] = {}
+_verified: Dict[str, tuple] = {}  # path -> (size, mtime) it was verified at
+_lock = threading.Lock()
+
+
+def sha256_file(path: str, chunk_size: int = 8 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(model_dir: str = MODEL_DIR) -> Dict[str, dict]:
+    """{filename: {"sha256": ..., "size": ...}} from the directory's manifest, empty if none"""
+    try:
+        with open(os.path.join(model_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def verify(path: str, manifest: Dict[str, dict]) -> bool:
+    """
+    Check path against its manifest entry. Returns False if it isn't listed,
+    raises ModelChecksumError if it doesn't match. Hashes once per file version.
+    """
+    entry = manifest.get(os.path.basename(path))
+    if entry is None:
+        return False
+    stat = os.stat(path)
+    if _verified.get(path) == (stat.st_size, stat.st_mtime):
+        return True
+    if stat.st_size != entry.get("size", stat.st_size) or sha256_file(path) != entry["sha256"]:
+        raise ModelChecksumError(f"{path} does not match the checksum in {MANIFEST_NAME}")
+    _verified[path] = (stat.st_size, stat.st_mtime)
+    return True
+
+
+def resolve(filename: str, model_dir: str = MODEL_DIR) -> str:
+    """
+    Local path of a model file, checked against the manifest (with its external
+    data file, if any). Raises ModelNotFoundError or ModelChecksumError.
+    """
+    path = os.path.join(model_dir, filename)
+    if not os.path.exists(path):
+        raise ModelNotFoundError(f"{filename} not found in {model_dir}")
+    if VERIFY:
+        manifest = load_manifest(model_dir)
+        for part in (path, path + ".data"):
+            if os.path.exists(part) and not verify(part, manifest):
+                logger.warning("%s is not listed in %s, loading it unverified", part, MANIFEST_NAME)
+    return path
+
+
+def available(filename: str, model_dir: str = MODEL_DIR) -> bool:
+    return os.path.exists(os.path.join(model_dir, filename))
+
+
+def has_external_data(path: str) -> bool:
+    return path.endswith(".onnx") and os.path.exists(path + ".data")
+
+
+def session_options(path: str, intra_op_threads: int = 0, spinning: bool = True):
+    """
+    onnxruntime session options for a model file: intra_op_threads per
+    inference (0 lets onnxruntime use every core), sequential execution,
+    full graph optimisation and arena/memory-pattern reuse. Keeps external
+    weights mapped with AI_MODEL_MMAP=1.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    # The U²-Net graphs are one chain; parallel execution only adds a second thread pool
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    # Inputs have a fixed shape, so the allocation plan of one run fits the next
+    options.enable_cpu_mem_arena = True
+    options.enable_mem_pattern = True
+    if not spinning:
+        # Spinning threads burn the cores the other sessions' inferences are running on
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    # Same thread override rembg applies to the sessions it creates
+    if "OMP_NUM_THREADS" in os.environ:
+        options.inter_op_num_threads = int(os.environ["OMP_NUM_THREADS"])
+        options.intra_op_num_threads = int(os.environ["OMP_NUM_THREADS"])
+    if MMAP_ONNX and has_external_data(path):
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    else:
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+@contextmanager
+def track_load(name: str, path: str, mmap: bool = False) -> Iterator[None]:
+    """Record load time and the resident memory a model load added"""
+    rss_before = resident_memory_bytes() or 0
+    started = time.perf_counter()
+    yield
+    with _lock:
+        _loaded[name] = {
+            "path": path,
+            "format": os.path.splitext(path)[1].lstrip("."),
+            "mmap": mmap,
+            "load_seconds": round(time.perf_counter() - started, 3),
+            "load_rss_bytes": max(0, (resident_memory_bytes() or 0) - rss_before),
+        }
+
+
+def mapped_resident_bytes(paths) -> Dict[str, int]:
+    """Resident bytes of each file's memory mappings in this process (Linux)"""
+    resident = {path: 0 for path in paths}
+    try:
+        with open("/proc/self/smaps") as smaps:
+            current = None
+            for line in smaps:
+                if line[0] in "0123456789abcdef" and "-" in line.split(" ", 1)[0]:
+                    fields = line.split(None, 5)
+                    current = fields[5].strip() if len(fields) == 6 else None
+                elif current in resident and line.startswith("Rss:"):
+                    resident[current] += int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resident
+
+
+def status() -> list:
+    """Loaded models with load time and memory footprint, for /health"""
+    with _lock:
+        loaded = {name: dict(info) for name, info in _loaded.items()}
+    mapped_files = {
+        name: [os.path.abspath(info["path"] + (".data" if info["format"] == "onnx" else ""))]
+        for name, info in loaded.items() if info["mmap"]
+    }
+    resident = mapped_resident_bytes([path for paths in mapped_files.values() for path in paths])
+    models = []
+    for name, info in loaded.items():
+        if name in mapped_files:
+            info["mapped_rss_bytes"] = sum(resident[path] for path in mapped_files[name])
+        models.append({"name": name, **info})
+    return models
+
+
+def lock(model_dir: str = MODEL_DIR) -> Dict[str, dict]:
+    """Write manifest.json with the checksums of every model file in the directory"""
+    manifest = {}
+    for filename in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, filename)
+        if filename.endswith(MODEL_EXTENSIONS) and os.path.isfile(path):
+            manifest[filename] = {"sha256": sha256_file(path), "size": os.path.getsize(path)}
+    tmp_path = os.path.join(model_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(model_dir, MANIFEST_NAME))
+    return manifest
+
+
+def externalize(name: str, model_dir: str = MODEL_DIR) -> str:
+    """Rewrite <name>.onnx with its weights in <name>.onnx.data, which onnxruntime can map"""
+    import onnx
+
+    path = os.path.join(model_dir, name + ".onnx")
+    model = onnx.load(path)
+    tmp_path = path + ".tmp"
+    onnx.save_model(
+        model, tmp_path, save_as_external_data=True, all_tensors_to_one_file=True,
+        location=os.path.basename(path) + ".data", size_threshold=1024
+    )
+    os.replace(tmp_path, path)
+    return path
+
+
+def quantize(name: str, model_dir: str = MODEL_DIR) -> str:
+    """Write <name>.int8.onnx, <name>.onnx with its weights quantized to INT8"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    path = os.path.join(model_dir, name + ".int8.onnx")
+    tmp_path = path + ".tmp"
+    quantize_dynamic(os.path.join(model_dir, name + ".onnx"), tmp_path, weight_type=QuantType.QUInt8)
+    os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "lock":
+        for filename, entry in lock().items():
+            print(f"{entry['sha256']}  {filename}")
+        print(f"✅ Wrote {os.path.join(MODEL_DIR, MANIFEST_NAME)}")
+    elif command == "verify":
+        manifest = load_manifest()
+        failed = False
+        for filename in sorted(manifest):
+            try:
+                verify(os.path.join(MODEL_DIR, filename), manifest)
+                print(f"✅ {filename}")
+            except (OSError, ModelChecksumError) as e:
+                print(f"❌ {filename}: {e}")
+                failed = True
+        sys.exit(1 if failed else 0)
+    elif command == "externalize" and len(sys.argv) > 2:
+        path = externalize(sys.argv[2])
+        if has_external_data(path):
+            print(f"✅ Wrote {path}.data; run `python model_registry.py lock` to update the manifest")
+        else:
+            print(f"⚠️  {path} has no tensors large enough to move out")
+    elif command == "quantize" and len(sys.argv) > 2:
+        path = quantize(sys.argv[2])
+        print(f"✅ Wrote {path} ({os.path.getsize(path) / 2 ** 20:.1f} MB); "
+              "run `python model_registry.py lock` to update the manifest")
+    else:
+        print("Usage: python model_registry.py lock | verify | externalize <name> | quantize <name>")
+        sys.exit(1)
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Bulk catalog reprocessing.
+
+Runs the service pipeline (remove_background, enhance, add_white_background
+and encoding, through run_pipeline) in-process on a directory of images, or
+on a manifest listing them, without going through HTTP. Models are loaded
+and warmed up once, then worker processes are forked as in
+`start.py --production`, so the weights are shared copy-on-write.
+
+Catalogs contain the same product shot uploaded by many sellers, re-saved,
+re-compressed or resized. Every image is first reduced to a 64-bit
+perceptual hash (the 64 lowest DCT frequencies of a 32x32 greyscale
+thumbnail) and an 8x8 colour thumbnail. Images within --distance bits of an
+earlier image whose thumbnails also agree (mean absolute difference within
+COLOUR_TOLERANCE) are not processed again but get a copy of its result: the
+hash only sees greyscale structure, so the same shape in another colour
+would otherwise count as a duplicate. Near neighbours are found through the
+pigeonhole principle: with the hash split into distance + 1 segments, two
+hashes within the distance share at least one segment exactly.
+
+Progress is appended to OUT_DIR/reprocess-journal.jsonl as every image
+finishes, so an interrupted run started again with the same options picks up
+where it stopped. Results are written to OUT_DIR with the input's relative
+path and the output format's extension, and a summary with throughput and
+skip counts to OUT_DIR/reprocess-report.json.
+
+Usage:
+    python reprocess.py INPUT OUT_DIR [--workers 4] [--no-remove-bg] [--enhance]
+        [--white-background] [--max-size 1024] [--matting edge] [--quality balanced]
+        [--format auto] [--preset balanced] [--distance 3] [--restart]
+
+INPUT is a directory (searched recursively) or a manifest: a text file with
+one image path per line, or a JSON list of paths or {"path": ...} objects.
+Relative paths in a manifest are relative to the manifest's directory.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".avif", ".bmp", ".tif", ".tiff")
+JOURNAL_NAME = "reprocess-journal.jsonl"
+REPORT_NAME = "reprocess-report.json"
+HASH_BITS = 64
+# The HASH_BITS lowest frequencies after the DC term, in zigzag order
+HASH_FREQUENCIES = sorted(((row, column) for row in range(12) for column in range(12)),
+                          key=lambda rc: (rc[0] + rc[1], rc[0]))[1:HASH_BITS + 1]
+THUMBNAIL_SIZE = 8
+# Mean absolute difference (0-255) of two colour thumbnails still counted as the same image;
+# re-encoding and resizing stay within a few levels
+COLOUR_TOLERANCE = float(os.environ.get("AI_REPROCESS_COLOUR_TOLERANCE", "10"))
+
+service = None  # main, imported by prepare() before the workers are forked
+
+
+def find_images(source: str) -> List[Tuple[str, str]]:
+    """(absolute path, path relative to the input) of every image, sorted"""
+    if os.path.isdir(source):
+        found = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    found.append((path, os.path.relpath(path, source)))
+        return sorted(found, key=lambda item: item[1])
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        if source.endswith(".json"):
+            entries = [entry["path"] if isinstance(entry, dict) else entry for entry in json.load(f)]
+        else:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    images = {}
+    for entry in entries:
+        path = os.path.normpath(os.path.join(base, entry))
+        relative = os.path.relpath(path, base)
+        if relative.startswith(".."):
+            # Outside the manifest's directory: keep the structure below the root
+            relative = os.path.splitdrive(path)[1].lstrip(os.sep)
+        images[relative] = path
+    return [(path, relative) for relative, path in sorted(images.items())]
+
+
+def fingerprint(path: str) -> Tuple[str, str]:
+    """64-bit DCT hash (16 hex digits) and 8x8 RGB thumbnail (hex) of the image; robust to re-encoding and resizing"""
+    with Image.open(path) as image:
+        # JPEGs are decoded straight at a fraction of their size
+        image.draft("RGB", (64, 64))
+        image = image.convert("RGB")
+        thumbnail = image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BOX)
+        grey = image.convert("L").resize((32, 32), Image.Resampling.BILINEAR)
+    dct = cv2.dct(np.asarray(grey, dtype=np.float32))
+    low = np.array([dct[row, column] for row, column in HASH_FREQUENCIES])
+    bits = low > np.median(low)
+    return "%016x" % int("".join("1" if bit else "0" for bit in bits), 2), thumbnail.tobytes().hex()
+
+
+def same_colours(thumbnail: str, other: str, tolerance: float = COLOUR_TOLERANCE) -> bool:
+    """Whether two thumbnails from fingerprint() differ by at most tolerance per channel on average"""
+    a = np.frombuffer(bytes.fromhex(thumbnail), dtype=np.uint8).astype(np.int16)
+    b = np.frombuffer(bytes.fromhex(other), dtype=np.uint8).astype(np.int16)
+    return float(np.abs(a - b).mean()) <= tolerance
+
+
+class DuplicateIndex:
+    """Representative hashes, searchable for any within max_distance bits"""
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self.segments = max_distance + 1
+        bounds = [round(HASH_BITS * index / self.segments) for index in range(self.segments + 1)]
+        self.masks = [(((1 << (high - low)) - 1) << low, low) for low, high in zip(bounds, bounds[1:])]
+        self.buckets: List[Dict[int, List[Tuple[int, str]]]] = [{} for _ in range(self.segments)]
+
+    def find(self, value: int, accept: Callable[[str], bool] = lambda key: True) -> Optional[str]:
+        """Key of the first representative within the distance that accept() agrees with, if any"""
+        for buckets, (mask, shift) in zip(self.buckets, self.masks):
+            for other, key in buckets.get((value & mask) >> shift, ()):
+                if bin(value ^ other).count("1") <= self.max_distance and accept(key):
+                    return key
+        return None
+
+    def add(self, value: int, key: str) -> None:
+        for buckets, (mask, shift) in zip(self.buckets, self.masks):
+            buckets.setdefault((value & mask) >> shift, []).append((value, key))
+
+
+def group_duplicates(fingerprints: Dict[str, Tuple[str, str]], order: List[str], max_distance: int,
+                     tolerance: float = COLOUR_TOLERANCE) -> Dict[str, str]:
+    """relative path -> relative path of the image processed in its place (itself for representatives)"""
+    if max_distance < 0:
+        return {key: key for key in order}
+    index = DuplicateIndex(max_distance)
+    representative = {}
+    for key in order:
+        if key not in fingerprints:
+            continue
+        phash, thumbnail = fingerprints[key]
+        value = int(phash, 16)
+        found = index.find(value, lambda other: same_colours(thumbnail, fingerprints[other][1], tolerance))
+        if found is None:
+            index.add(value, key)
+            found = key
+        representative[key] = found
+    return representative
+
+
+class Journal:
+    """Append-only JSON lines of finished work; a torn last line from a crash is ignored"""
+
+    def __init__(self, path: str, options: dict, restart: bool = False):
+        self.path = path
+        self.fingerprints: Dict[str, Tuple[str, str]] = {}
+        self.finished: Dict[str, dict] = {}
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if "options" in record:
+                        if record["options"] != options:
+                            raise ValueError(
+                                f"{path} was written with other options; use another output directory or --restart"
+                            )
+                    elif "phash" in record:
+                        if "thumbnail" in record:
+                            self.fingerprints[record["path"]] = (record["phash"], record["thumbnail"])
+                    elif record.get("status") == "failed":
+                        self.finished.pop(record["path"], None)
+                    else:
+                        self.finished[record["path"]] = record
+        self.file = open(path, "a+")
+        if self.file.tell() == 0:
+            self.write({"options": options})
+        else:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != "\n":
+                # Terminate the torn line so the next record starts on its own
+                self.file.write("\n")
+
+    def write(self, record: dict) -> None:
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def configure(workers: int) -> None:
+    """Size the service for the worker processes; must run before any service module is imported"""
+    if "workers" in sys.modules:
+        raise RuntimeError("configure() must run before the service modules are imported")
+    # Sessions size their thread pools for every worker running inferences at once
+    os.environ["AI_SERVER_WORKERS"] = str(workers)
+    # Each process runs one image at a time
+    os.environ.setdefault("AI_WORKER_COUNT", "1")
+
+
+def prepare() -> bool:
+    """Import the service and load and warm up the models once, before forking"""
+    global service
+    import main
+
+    service = main
+    return service.preload_models()
+
+
+def output_paths(out_dir: str, order: List[str], output_format: str) -> Dict[str, str]:
+    """Result path per input; inputs differing only in extension (a.jpg, a.png) keep it in the name"""
+    from encoding import EXTENSIONS
+
+    stems = {}
+    for relative in order:
+        stem = os.path.splitext(relative)[0]
+        stems[stem] = stems.get(stem, 0) + 1
+    paths = {}
+    for relative in order:
+        stem = os.path.splitext(relative)[0]
+        paths[relative] = os.path.join(out_dir, (stem if stems[stem] == 1 else relative) + EXTENSIONS[output_format])
+    return paths
+
+
+def process_one(path: str, destination: str, options: dict) -> dict:
+    """Run the pipeline on one image in a worker process and write the result atomically"""
+    started = time.perf_counter()
+    with open(path, "rb") as source:
+        content, _, info = service.run_pipeline(
+            source, options["remove_bg"], options["enhance"], options["white_background"],
+            options["max_size"], options["matting"], options["quality"],
+            output_format=options["format"], preset=options["preset"]
+        )
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = destination + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, destination)
+    return {
+        "seconds": round(time.perf_counter() - started, 3),
+        "segmentation": info.get("segmentation"),
+        "timings": info.get("timings", {}),
+    }
+
+
+def copy_result(source: str, destination: str) -> None:
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = destination + ".tmp"
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def reprocess(source: str, out_dir: str, options: dict, workers: int, distance: int, restart: bool = False) -> dict:
+    """Run the catalog through the pipeline; configure(workers) must have run first"""
+    started = time.time()
+    images = find_images(source)
+    paths = dict((relative, path) for path, relative in images)
+    order = [relative for _, relative in images]
+    os.makedirs(out_dir, exist_ok=True)
+    journal = Journal(os.path.join(out_dir, JOURNAL_NAME), dict(options, distance=distance), restart)
+    destination = output_paths(out_dir, order, options["format"])
+    resumed = {relative for relative in journal.finished if relative in paths and os.path.exists(destination[relative])}
+    print(f"📂 {len(order)} images, {len(resumed)} already done")
+
+    print("⏳ Loading and warming up models...")
+    if not prepare() and options["remove_bg"]:
+        raise RuntimeError("Background removal models failed to load")
+    context = multiprocessing.get_context("fork")
+
+    counts = {"processed": 0, "duplicates": 0, "resumed": len(resumed), "failed": 0, "unreadable": 0}
+    stage_seconds: Dict[str, float] = {}
+    errors = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        # 1. Fingerprints of everything not hashed by an earlier run
+        hashing_started = time.perf_counter()
+        pending = [relative for relative in order if relative not in journal.fingerprints]
+        futures = {executor.submit(fingerprint, paths[relative]): relative for relative in pending}
+        for future in futures:
+            relative = futures[future]
+            try:
+                phash, thumbnail = journal.fingerprints[relative] = future.result()
+                journal.write({"path": relative, "phash": phash, "thumbnail": thumbnail})
+            except Exception as e:
+                counts["unreadable"] += 1
+                errors[relative] = f"unreadable: {e}"
+        hashing_seconds = time.perf_counter() - hashing_started
+        representative = group_duplicates(journal.fingerprints, order, distance)
+        duplicates_of: Dict[str, List[str]] = {}
+        for relative, rep in representative.items():
+            if rep != relative:
+                duplicates_of.setdefault(rep, []).append(relative)
+        todo = [relative for relative in order if representative.get(relative) == relative]
+        print(f"🔎 Hashed {len(pending)} images in {hashing_seconds:.1f}s: {len(todo)} distinct, "
+              f"{len(representative) - len(todo)} near-duplicates of {len(duplicates_of)} of them")
+
+        def finish_duplicates(rep: str) -> None:
+            for duplicate in duplicates_of.get(rep, ()):
+                if duplicate in resumed:
+                    continue
+                copy_result(destination[rep], destination[duplicate])
+                journal.write({"path": duplicate, "status": "duplicate", "of": rep})
+                counts["duplicates"] += 1
+
+        # 2. Representatives, a bounded number in flight so memory stays flat
+        processing_started = time.perf_counter()
+        in_flight = {}
+        position = 0
+        while position < len(todo) or in_flight:
+            while position < len(todo) and len(in_flight) < workers * 2:
+                relative = todo[position]
+                position += 1
+                if relative in resumed:
+                    finish_duplicates(relative)
+                    continue
+                future = executor.submit(process_one, paths[relative], destination[relative], options)
+                in_flight[future] = relative
+            if not in_flight:
+                continue
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                relative = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    counts["failed"] += 1
+                    errors[relative] = str(e)
+                    journal.write({"path": relative, "status": "failed", "error": str(e)})
+                    print(f"  ❌ {relative}: {e}")
+                    continue
+                for name, seconds in result.pop("timings").items():
+                    stage_seconds[name] = stage_seconds.get(name, 0.0) + seconds
+                journal.write({"path": relative, "status": "done", **result})
+                counts["processed"] += 1
+                finish_duplicates(relative)
+                done_count = counts["processed"] + counts["failed"]
+                if done_count % 50 == 0:
+                    rate = counts["processed"] / (time.perf_counter() - processing_started)
+                    print(f"  {done_count} processed ({rate:.1f} images/s)")
+        processing_seconds = time.perf_counter() - processing_started
+    journal.close()
+
+    elapsed = time.time() - started
+    finished = counts["processed"] + counts["duplicates"]
+    report = {
+        "input": source,
+        "output": out_dir,
+        "options": options,
+        "workers": workers,
+        "distance": distance,
+        "images": len(order),
+        **counts,
+        "seconds": {
+            "total": round(elapsed, 3),
+            "hashing": round(hashing_seconds, 3),
+            "processing": round(processing_seconds, 3),
+        },
+        "throughput": {
+            # Pipeline runs per second, and images finished per second counting copies of duplicates
+            "processed_per_second": round(counts["processed"] / processing_seconds, 3) if processing_seconds else None,
+            "finished_per_second": round(finished / elapsed, 3) if elapsed else None,
+        },
+        "stage_seconds": {name: round(seconds, 3) for name, seconds in sorted(stage_seconds.items())},
+        "errors": errors,
+    }
+    with open(os.path.join(out_dir, REPORT_NAME), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Reprocess a catalog of images with the service pipeline")
+    parser.add_argument("input", help="directory of images, or a manifest (.txt with one path per line, or .json)")
+    parser.add_argument("out_dir")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--no-remove-bg", dest="remove_bg", action="store_false")
+    parser.add_argument("--enhance", action="store_true")
+    parser.add_argument("--white-background", action="store_true")
+    parser.add_argument("--max-size", type=int, default=1024)
+    parser.add_argument("--matting", default="edge", choices=("none", "edge", "full"))
+    parser.add_argument("--quality", default=None, help="segmentation tier: fast, balanced or best")
+    parser.add_argument("--format", default="auto", help="auto (PNG if transparent, else JPEG), png, jpeg, webp or avif")
+    parser.add_argument("--preset", default=None, help="encoder preset: fast, balanced or small")
+    parser.add_argument("--distance", type=int, default=3,
+                        help="perceptual hash bits two images may differ in to count as duplicates (-1: no dedup)")
+    parser.add_argument("--restart", action="store_true", help="discard the journal and start over")
+    args = parser.parse_args()
+
+    configure(max(1, args.workers))
+    from encoding import DEFAULT_PRESET, PRESETS, resolve_format
+    from sessions import DEFAULT_QUALITY, QUALITY_TIERS
+
+    quality = args.quality or DEFAULT_QUALITY
+    preset = args.preset or DEFAULT_PRESET
+    if quality not in QUALITY_TIERS or preset not in PRESETS:
+        print(f"❌ --quality must be one of {', '.join(QUALITY_TIERS)} and --preset one of {', '.join(PRESETS)}")
+        return 1
+    if not 0 <= args.distance < 16 and args.distance != -1:
+        print("❌ --distance must be -1 or between 0 and 15")
+        return 1
+    try:
+        output_format = resolve_format(args.format, None, args.remove_bg and not args.white_background)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    options = {
+        "remove_bg": args.remove_bg,
+        "enhance": args.enhance,
+        "white_background": args.white_background,
+        "max_size": args.max_size,
+        "matting": args.matting,
+        "quality": quality,
+        "format": output_format,
+        "preset": preset,
+    }
+
+    print("🖼️  Catalog reprocessing")
+    print("=" * 40)
+    try:
+        report = reprocess(args.input, args.out_dir, options, max(1, args.workers), args.distance, args.restart)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
+        return 1
+
+    print(f"\n📊 {report['images']} images in {report['seconds']['total']:.1f}s: "
+          f"{report['processed']} processed, {report['duplicates']} near-duplicates copied, "
+          f"{report['resumed']} already done, {report['failed']} failed, {report['unreadable']} unreadable")
+    if report["throughput"]["processed_per_second"]:
+        print(f"⚡ {report['throughput']['processed_per_second']:.2f} pipeline runs/s, "
+              f"{report['throughput']['finished_per_second']:.2f} images/s overall")
+    print(f"✅ Report written to {os.path.join(args.out_dir, REPORT_NAME)}")
+    return 0 if not report["failed"] else 1
+
+
+if __name__ == "__main__":
+    # Service modules live next to this script; INPUT and OUT_DIR stay relative to the caller
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    status = main()
+    sys.stdout.flush()
+    os._exit(status)  # onnxruntime threads can keep the interpreter alive
@@ -0,0 +1,210 @@
+"""
+Process-wide rembg session registry.
+
+Creating a rembg session loads the ONNX graph and builds an onnxruntime
+InferenceSession, which costs far more than a single inference on CPU nodes.
+Sessions are therefore created once per (model name, execution providers) key,
+preloaded during startup and shared by every request. Model files come from
+the local model registry; rembg's own download is only a fallback for models
+that aren't there, and is disabled with AI_MODEL_OFFLINE=1.
+
+Requests pick a quality tier rather than a model. Each tier lists models in
+order of preference and uses the first one found locally:
+
+  tier      model                     file    input    relative cost
+  fast      u2netp (INT8 if present)  4.7 MB  320x320  lowest, visibly coarser edges
+  balanced  silueta, else u2net       43 MB   320x320  about u2net's masks, 1/4 the weights
+  best      isnet-general-use         176 MB  1024x1024  ~10x the pixels of the 320 models
+
+INT8 variants are `<name>.int8.onnx` files made with
+`python model_registry.py quantize <name>`. `python benchmarks/quality.py`
+measures each tier on 8 synthetic 1024px product shots (3 runs each, fast
+path off): segmentation p50/p95 and mean IoU against the true mask and
+against the best tier's mask. On a 1-CPU Xeon (1 intra-op thread) with the
+stand-in models of benchmarks/stubs.py, the only weights available there:
+
+  tier      model              p50     p95     IoU (truth)  IoU (vs best)
+  fast      u2netp.int8        24 ms   32 ms   0.340        0.607
+  balanced  silueta            31 ms   37 ms   0.336        0.607
+  best      isnet-general-use  77 ms   85 ms   0.227        1.000
+
+The stand-ins keep each model's input size, so the timings show the
+resize/normalise/post-processing cost around the network and the 1024x1024
+tier's ~3x overhead. They are not trained, so their IoUs are not a quality
+ranking. Re-run with the real weights in AI_MODEL_DIR before changing the
+default tier.
+
+Sessions are tuned for the worker pool rather than a single caller: every pool
+worker in every server process may be running an inference at the same time,
+so each session gets its share of the cores as intra-op threads (spinning off
+when sessions share the machine), sequential execution, full graph
+optimisation and the CPU memory arena with memory-pattern reuse, which works
+because the input shape is fixed.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+import model_registry
+from workers import WORKER_COUNT
+
+# Segmentation models per quality tier, most preferred first
+QUALITY_TIERS = {
+    "fast": ("u2netp.int8", "u2netp"),
+    "balanced": ("silueta", "u2net"),
+    "best": ("isnet-general-use", "u2net"),
+}
+DEFAULT_QUALITY = os.environ.get("AI_DEFAULT_QUALITY", "balanced")
+
+# Models to load during startup (comma separated), default: the default tier's model
+PRELOAD_MODELS = [
+    name.strip()
+    for name in os.environ.get("AI_REMBG_PRELOAD_MODELS", "").split(",")
+    if name.strip()
+]
+
+logger = logging.getLogger(__name__)
+
+# Never download a model that isn't in the local model directory
+OFFLINE = os.environ.get("AI_MODEL_OFFLINE", "0") == "1"
+
+SessionKey = Tuple[str, Tuple[str, ...]]
+
+_sessions: Dict[SessionKey, object] = {}
+_load_times: Dict[SessionKey, float] = {}
+_lock = threading.Lock()
+_state = {"ready": False, "error": None}
+
+
+def default_providers() -> List[str]:
+    """Return the onnxruntime execution providers to use, GPU first if available"""
+    try:
+        import onnxruntime as ort
+        available = ort.get_available_providers()
+    except ImportError:
+        return ["CPUExecutionProvider"]
+
+    if "CUDAExecutionProvider" in available:
+        return ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    return ["CPUExecutionProvider"]
+
+
+def base_model(model_name: str) -> str:
+    """rembg model behind a variant name, e.g. u2netp for u2netp.int8"""
+    return model_name.split(".", 1)[0]
+
+
+def model_for_quality(quality: str = DEFAULT_QUALITY) -> str:
+    """
+    The tier's first model that is available locally. If none is, its first
+    full-precision model, which rembg downloads unless running offline.
+    """
+    candidates = QUALITY_TIERS[quality]
+    for model_name in candidates:
+        if model_registry.available(f"{model_name}.onnx"):
+            return model_name
+    return next(name for name in candidates if base_model(name) == name)
+
+
+def concurrent_inferences() -> int:
+    """Inferences that can run at once: every pool worker of every server process"""
+    return WORKER_COUNT * int(os.environ.get("AI_SERVER_WORKERS", "1"))
+
+
+def inference_threads() -> int:
+    """Each session's share of the cores"""
+    return max(1, (os.cpu_count() or 1) // concurrent_inferences())
+
+
+def _new_session(model_name: str, providers: List[str]):
+    """rembg session for model_name, loading the model file from the local registry"""
+    from rembg.sessions import sessions_class
+
+    rembg_name = base_model(model_name)
+    base = next(cls for cls in sessions_class if cls.name() == rembg_name)
+    spinning = concurrent_inferences() == 1
+    try:
+        path = model_registry.resolve(f"{model_name}.onnx")
+    except model_registry.ModelNotFoundError:
+        if OFFLINE or rembg_name != model_name:
+            raise
+        logger.warning("%s.onnx is not in %s, letting rembg download it", model_name, model_registry.MODEL_DIR)
+        options = model_registry.session_options("", inference_threads(), spinning=spinning)
+        with model_registry.track_load(model_name, f"{model_name}.onnx"):
+            return base(rembg_name, options, providers=providers)
+
+    # Same session class (and so the same pre/post-processing), minus the download
+    local = type(base.__name__, (base,), {"download_models": classmethod(lambda cls, *args, **kwargs: path)})
+    mmap = model_registry.MMAP_ONNX and model_registry.has_external_data(path)
+    options = model_registry.session_options(path, inference_threads(), spinning=spinning)
+    with model_registry.track_load(model_name, path, mmap=mmap):
+        # model_name is what the matting code looks input sizes up by, so it's the rembg name
+        return local(rembg_name, options, providers=providers)
+
+
+def get_session(model_name: str = "u2net", providers: Optional[List[str]] = None):
+    """
+    Return the shared rembg session for a model, creating it on first use.
+    Raises ImportError if rembg is not installed, ModelNotFoundError if the
+    model is missing in offline mode and ModelChecksumError if it is corrupted.
+    """
+    providers = providers or default_providers()
+    key = (model_name, tuple(providers))
+
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _lock:
+        # Another thread may have created it while we waited for the lock
+        session = _sessions.get(key)
+        if session is None:
+            started = time.perf_counter()
+            session = _new_session(model_name, list(providers))
+            _load_times[key] = time.perf_counter() - started
+            _sessions[key] = session
+            logger.info("Loaded rembg session %s %s in %.2fs", model_name, list(providers), _load_times[key])
+    return session
+
+
+def warm_up(session) -> None:
+    """Run one dummy inference so lazy allocations happen before real traffic"""
+    session.predict(Image.new("RGB", (64, 64), (127, 127, 127)))
+
+
+def preload_sessions(models: Optional[List[str]] = None) -> bool:
+    """
+    Create and warm up sessions for all configured models.
+    Returns True when the registry is ready to serve requests.
+    """
+    try:
+        for model_name in models or PRELOAD_MODELS or [model_for_quality()]:
+            warm_up(get_session(model_name))
+        _state["ready"] = True
+        _state["error"] = None
+    except Exception as e:
+        _state["ready"] = False
+        _state["error"] = str(e)
+        logger.warning("Could not preload rembg sessions: %s", e)
+    return _state["ready"]
+
+
+def registry_status() -> dict:
+    """Summary of loaded sessions for the health endpoint"""
+    return {
+        "ready": _state["ready"],
+        "error": _state["error"],
+        "sessions": [
+            {
+                "model": model_name,
+                "providers": list(providers),
+                "load_seconds": round(_load_times.get((model_name, providers), 0.0), 3),
+            }
+            for model_name, providers in list(_sessions)
+        ],
+    }
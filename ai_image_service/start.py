@@ -1,12 +1,31 @@
 #!/usr/bin/env python3
 """
 AI Image Processing Service Starter
-Simple script to start the FastAPI service with proper configuration
+
+Development (default): installs requirements and runs one uvicorn process
+with --reload.
+
+Production (--production): no installation. The models are loaded and warmed
+up once in this process, then N workers are forked onto a shared listening
+socket, so the weights are shared copy-on-write instead of loaded N times.
+Workers that die are replaced. Each worker reports readiness at /readyz and
+the time from launch to ready as cold_start_seconds.
+
+Usage:
+    python start.py
+    python start.py --production [--workers 4] [--host 0.0.0.0] [--port 8000]
 """
 
+import time
+
+LAUNCHED_AT = time.time()  # before the heavy imports, so cold start includes them
+
+import argparse
+import gc
+import os
+import signal
 import subprocess
 import sys
-import os
 
 def install_requirements():
     """Install required packages"""
@@ -19,35 +38,124 @@ def install_requirements():
         return False
     return True
 
-def start_service():
+def start_service(host: str = "0.0.0.0", port: int = 8000):
     """Start the FastAPI service"""
     print("Starting AI Image Processing Service...")
-    print("🚀 Service will be available at: http://localhost:8000")
-    print("📖 API docs will be available at: http://localhost:8000/docs")
+    print(f"🚀 Service will be available at: http://localhost:{port}")
+    print(f"📖 API docs will be available at: http://localhost:{port}/docs")
     print("Press Ctrl+C to stop the service\n")
-    
+
     try:
         subprocess.run([
-            sys.executable, "-m", "uvicorn", 
-            "main:app", 
-            "--host", "0.0.0.0", 
-            "--port", "8000", 
+            sys.executable, "-m", "uvicorn",
+            "main:app",
+            "--host", host,
+            "--port", str(port),
             "--reload"
         ])
     except KeyboardInterrupt:
         print("\n👋 Service stopped by user")
 
+def serve_worker(service, sock, respawned: bool) -> None:
+    """Run one uvicorn server on the inherited socket; never returns"""
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if respawned:
+        # A replacement worker's cold start is measured from its own fork
+        service.LAUNCHED_AT = time.time()
+
+    config = uvicorn.Config(service.app, lifespan="on", log_level=os.environ.get("AI_LOG_LEVEL", "info").lower())
+    status = 0
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        status = 1
+    finally:
+        os._exit(status)
+
+def start_production(workers: int, host: str, port: int) -> None:
+    """Preload models, then fork workers onto a shared socket and supervise them"""
+    import uvicorn
+
+    os.environ["AI_LAUNCH_TIME"] = str(LAUNCHED_AT)
+    # Sessions size their thread pools for every worker running inferences at once
+    os.environ["AI_SERVER_WORKERS"] = str(workers)
+    sys.path.insert(0, os.getcwd())
+    import main as service
+
+    print("⏳ Loading and warming up models before forking workers...")
+    started = time.time()
+    if not service.preload_models():
+        print("⚠️  Background removal models failed to load; workers will report not ready")
+    print(f"✅ Models ready in {time.time() - started:.2f}s ({time.time() - LAUNCHED_AT:.2f}s since launch)")
+
+    sock = uvicorn.Config(service.app, host=host, port=port).bind_socket()
+    # Objects that exist now are never collected, so the collector won't dirty the shared pages
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(respawned: bool = False) -> None:
+        sys.stdout.flush()  # or the child inherits unwritten output
+        pid = os.fork()
+        if pid == 0:
+            serve_worker(service, sock, respawned)
+        children[pid] = time.time()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(f"🚀 {workers} workers serving on http://{host}:{port} (ready when /readyz returns 200)")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        forked_at = children.pop(pid, None)
+        if not stopping:
+            print(f"⚠️  Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, starting a new one")
+            if forked_at is not None and time.time() - forked_at < 5:
+                time.sleep(1)  # don't spin if workers die right after starting
+            spawn(respawned=True)
+    print("👋 Service stopped")
+
 if __name__ == "__main__":
     # Change to service directory
     service_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(service_dir)
-    
+
+    parser = argparse.ArgumentParser(description="AI Image Processing Service")
+    parser.add_argument("--production", action="store_true", help="skip installation, preload models and fork workers")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("AI_SERVER_WORKERS", str(os.cpu_count() or 1))))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    args = parser.parse_args()
+
     print("🤖 AI Image Processing Service")
     print("=" * 40)
-    
+
+    if args.production:
+        start_production(max(1, args.workers), args.host, args.port)
     # Install requirements
-    if install_requirements():
-        start_service()
+    elif install_requirements():
+        start_service(args.host, args.port)
     else:
         print("❌ Failed to start service due to installation errors")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
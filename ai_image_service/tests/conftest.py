@@ -0,0 +1,37 @@
+"""
+Shared test setup. The service modules are imported from the directory above,
+as start.py runs them; anything that imports main gets the stand-in models
+from benchmarks/stubs.py, written before the first import so no real weights
+are needed.
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.join(SERVICE_DIR, "benchmarks"))
+
+os.environ.setdefault("AI_LOG_LEVEL", "WARNING")
+
+if importlib.util.find_spec("onnx") is not None:
+    from stubs import write_stub_models
+
+    write_stub_models(tempfile.mkdtemp(prefix="ai-stub-models-"))
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Test client for the app, started up once with the stand-in models"""
+    pytest.importorskip("onnx")
+    pytest.importorskip("rembg")
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
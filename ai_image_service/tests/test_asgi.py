@@ -0,0 +1,28 @@
+import asyncio
+import io
+
+from asgi import ImageResponse
+
+
+def sent_messages(response: ImageResponse) -> list:
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response({"type": "http"}, None, send))
+    return messages
+
+
+def test_image_response_sends_bytes_chunks():
+    buffer = io.BytesIO(bytes(range(256)) * 10)
+    messages = sent_messages(ImageResponse(buffer.getbuffer(), media_type="image/png", chunk_size=1000))
+    bodies = [message for message in messages if message["type"] == "http.response.body"]
+    assert [type(message["body"]) for message in bodies] == [bytes] * 3
+    assert [message["more_body"] for message in bodies] == [True, True, False]
+    assert b"".join(message["body"] for message in bodies) == buffer.getvalue()
+
+
+def test_empty_image_response_ends_the_body():
+    messages = sent_messages(ImageResponse(b"", media_type="image/png"))
+    assert messages[-1] == {"type": "http.response.body", "body": b""}
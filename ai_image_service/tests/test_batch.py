@@ -0,0 +1,86 @@
+"""The /process-images batch endpoint"""
+
+import asyncio
+import io
+import json
+import time
+import zipfile
+
+import httpx
+from PIL import Image
+
+from test_coalescing import call
+from workers import QueueFullError
+
+
+def png(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def post_batch(client, files) -> list:
+    response = client.post(
+        "/process-images", params={"remove_bg": "false", "format": "png"},
+        files=[("files", file) for file in files],
+    )
+    assert response.status_code == 200
+    return json.loads(zipfile.ZipFile(io.BytesIO(response.content)).read("manifest.json"))
+
+
+class BusyOnce:
+    """Process-kind pool whose first call is turned away as if the queue were full"""
+
+    kind = "process"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def run(self, fn, *args, lane="quick", **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise QueueFullError(0)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+def test_batch_retried_after_full_queue_gets_the_uploads(client, monkeypatch):
+    import main
+
+    pool = BusyOnce()
+    monkeypatch.setattr(main, "worker_pool", pool)
+    manifest = post_batch(client, [("a.png", png("red"), "image/png"), ("b.png", png("blue"), "image/png")])
+
+    assert pool.calls == 2
+    assert [entry["status"] for entry in manifest] == ["ok", "ok"]
+
+
+def test_invalid_item_error_names_no_internals(client):
+    manifest = post_batch(client, [("a.png", png("red"), "image/png"), ("b.png", b"not an image", "image/png")])
+
+    assert manifest[0]["status"] == "ok"
+    assert manifest[1] == {"index": 1, "filename": "b.png", "status": "error", "error": "Invalid image file"}
+
+
+def test_disconnect_waits_for_worker_threads_before_closing_uploads(client, monkeypatch):
+    import main
+
+    decode_image = main.decode_image
+    closed = []
+
+    def slow(source, *args, **kwargs):
+        time.sleep(0.3)
+        closed.append(source.closed)
+        return decode_image(source, *args, **kwargs)
+
+    monkeypatch.setattr(main, "decode_image", slow)
+    request = httpx.Request(
+        "POST", "http://test/process-images?remove_bg=false",
+        files=[("files", (f"{index}.png", png((index, 0, 0)), "image/png")) for index in range(4)],
+    )
+    request.read()
+    client.portal.call(call, main.app, request, True, 0.1)
+
+    # The response is torn down in the background; give the worker thread time to decode more
+    time.sleep(1)
+    # The batch stopped after the image it was decoding, with its upload still open
+    assert closed == [False]
@@ -0,0 +1,18 @@
+import os
+
+from cache import ResultCache
+
+
+def disk_files_size(directory: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(directory))
+
+
+def test_disk_usage_counts_sidecars_and_rewrites_once(tmp_path):
+    cache = ResultCache(memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=1 << 20)
+    cache._disk_put("a", (b"x" * 1000, "image/png", {"segmentation": "u2net"}))
+    cache._disk_put("b", (b"y" * 500, "image/jpeg", {}))
+    cache._disk_put("a", (b"z" * 800, "image/png", {"segmentation": "classical", "model": "silueta"}))
+
+    assert cache._disk_used == disk_files_size(tmp_path)
+    # The same figure a restart would count
+    assert ResultCache(memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=1 << 20)._disk_used == cache._disk_used
@@ -0,0 +1,114 @@
+"""Requests sharing one computation through the result cache, driven at the ASGI level"""
+
+import asyncio
+import io
+import time
+
+import httpx
+import pytest
+from PIL import Image
+
+SLOW_DECODE_SECONDS = 0.6
+
+
+def upload(color, deadline_ms=None) -> httpx.Request:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, "PNG")
+    request = httpx.Request(
+        "POST", "http://test/process-image?remove_bg=false&enhance=false",
+        files={"file": ("item.png", buffer.getvalue(), "image/png")},
+        headers={"X-Deadline-Ms": str(deadline_ms)} if deadline_ms else None,
+    )
+    request.read()
+    return request
+
+
+async def call(app, request: httpx.Request, disconnected: bool, disconnect_after: float = 0) -> dict:
+    """Run one request; a disconnected client reports http.disconnect disconnect_after seconds after the body"""
+    body_sent = False
+    messages = []
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": request.content, "more_body": False}
+        if disconnected:
+            if disconnect_after:
+                await asyncio.sleep(disconnect_after)
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()  # still connected
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": request.url.path, "raw_path": request.url.raw_path,
+        "query_string": request.url.query, "root_path": "", "client": ("test", 1), "server": ("test", 80),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in request.headers.items()],
+    }
+    await app(scope, receive, send)
+    start = next(message for message in messages if message["type"] == "http.response.start")
+    return {"status": start["status"], "headers": dict(start["headers"])}
+
+
+@pytest.fixture
+def slow_decode(client, monkeypatch):
+    import main
+
+    decode_image = main.decode_image
+
+    def slow(*args, **kwargs):
+        time.sleep(SLOW_DECODE_SECONDS)
+        return decode_image(*args, **kwargs)
+
+    monkeypatch.setattr(main, "decode_image", slow)
+    return main
+
+
+def test_live_follower_of_disconnected_leader_gets_result(client, slow_decode):
+    main = slow_decode
+
+    async def scenario():
+        leader = asyncio.create_task(call(main.app, upload((10, 200, 30)), disconnected=True))
+        await asyncio.sleep(0.1)  # the follower joins the leader's computation
+        # A deadline with time to spare doesn't stop the follower either
+        follower = asyncio.create_task(call(main.app, upload((10, 200, 30), deadline_ms=30000), disconnected=False))
+        return await leader, await follower
+
+    leader, follower = client.portal.call(scenario)
+    assert leader["status"] == 499
+    assert follower["status"] == 200
+    assert follower["headers"][b"x-cache"] == b"MISS"  # computed again as the new leader
+
+
+def test_follower_of_cancelled_leader_gets_result(client, slow_decode):
+    main = slow_decode
+
+    async def scenario():
+        request = upload((200, 10, 30))
+        leader = asyncio.create_task(call(main.app, request, disconnected=False))
+        await asyncio.sleep(0.1)
+        follower = asyncio.create_task(call(main.app, request, disconnected=False))
+        await asyncio.sleep(0.1)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert client.portal.call(scenario)["status"] == 200
+
+
+def test_disconnected_follower_is_not_recomputed(client, slow_decode):
+    main = slow_decode
+
+    async def scenario():
+        request = upload((30, 10, 200))
+        leader = asyncio.create_task(call(main.app, request, disconnected=True))
+        await asyncio.sleep(0.1)
+        follower = asyncio.create_task(call(main.app, request, disconnected=True))
+        return await leader, await follower
+
+    leader, follower = client.portal.call(scenario)
+    assert (leader["status"], follower["status"]) == (499, 499)
@@ -0,0 +1,38 @@
+from metrics import BUCKETS, STAGES, StageMetrics
+
+
+def buckets(lines, stage):
+    prefix = f'ai_stage_seconds_bucket{{stage="{stage}",le="'
+    return {
+        line[len(prefix):].split('"')[0]: int(line.rsplit(" ", 1)[1])
+        for line in lines if line.startswith(prefix)
+    }
+
+
+def test_stages_are_registered_before_any_request():
+    lines = StageMetrics().render()
+    assert "# TYPE ai_stage_seconds histogram" in lines
+    for stage in STAGES:
+        assert buckets(lines, stage) == {**{repr(b): 0 for b in BUCKETS}, "+Inf": 0}
+        assert f'ai_stage_seconds_count{{stage="{stage}"}} 0' in lines
+
+
+def test_buckets_are_cumulative_and_inclusive():
+    metrics = StageMetrics()
+    for seconds in (0.004, 0.1, 0.3, 120.0):
+        metrics.observe({"decode": seconds})
+    lines = metrics.render()
+    counts = buckets(lines, "decode")
+    assert counts["0.005"] == 1
+    assert counts["0.1"] == 2  # le is an inclusive upper bound
+    assert counts["0.5"] == 3
+    assert counts["60.0"] == 3
+    assert counts["+Inf"] == 4
+    assert 'ai_stage_seconds_count{stage="decode"} 4' in lines
+    assert 'ai_stage_seconds_sum{stage="decode"} 120.404000' in lines
+
+
+def test_unknown_stages_get_their_own_series():
+    metrics = StageMetrics()
+    metrics.observe({"upload": 0.2})
+    assert buckets(metrics.render(), "upload")["0.25"] == 1
@@ -0,0 +1,85 @@
+"""End to end through /process-image on the stand-in models, as benchmarks/pipeline.py runs it"""
+
+import io
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from input_stage import InvalidImageError, UploadTooLargeError
+from pipeline import synthetic_image
+from workers import DeadlineExceededError, QueueFullError, RequestCancelled
+
+
+def post(client, data: bytes, **params):
+    response = client.post(
+        "/process-image",
+        params={name: str(value).lower() for name, value in params.items()},
+        files={"file": ("product.jpg", data, "image/jpeg")},
+    )
+    assert response.status_code == 200, response.text
+    return response, Image.open(io.BytesIO(response.content))
+
+
+@pytest.mark.parametrize("background, segmentation", [("uniform", "classical"), ("textured", "u2net")])
+def test_background_removal(client, background, segmentation):
+    response, image = post(client, synthetic_image(background, 600, seed=1), enhance=False, max_size=400)
+
+    assert response.headers["X-Segmentation"] == segmentation
+    assert response.headers["content-type"] == "image/png"
+    assert image.mode == "RGBA" and image.size == (400, 400)
+    alpha = np.asarray(image.getchannel("A"))
+    if segmentation == "classical":
+        # The backdrop is keyed out and the product kept
+        assert alpha.min() == 0 and alpha.max() == 255
+    else:
+        # The stand-in model gives a mask with structure, not a real cutout
+        assert alpha.min() < alpha.max()
+        assert response.headers["X-Segmentation-Model"] != "none"
+        assert "segmentation;dur=" in response.headers["Server-Timing"]
+
+
+def test_without_background_removal(client):
+    response, image = post(client, synthetic_image("gradient", 300, seed=2), remove_bg=False, enhance=False)
+
+    assert response.headers["X-Segmentation"] == "none"
+    assert image.format == "JPEG" and image.mode == "RGB" and image.size == (300, 300)
+
+
+def test_white_background(client):
+    _, image = post(client, synthetic_image("uniform", 300, seed=3), enhance=False, white_background=True)
+
+    assert image.mode == "RGB"
+    # The corners were background
+    assert image.getpixel((0, 0)) == image.getpixel((299, 299))
+    assert min(image.getpixel((0, 0))) >= 250
+
+
+def test_enhanced_subject_stays_within_max_size(client):
+    import main
+
+    if main.esrgan_upsampler is None:
+        pytest.skip("no upscaler loaded")
+    response, image = post(client, synthetic_image("uniform", 200, seed=4), max_size=300)
+
+    assert "enhance;dur=" in response.headers["Server-Timing"]
+    assert image.mode == "RGBA"
+    assert max(image.size) <= 300
+
+
+@pytest.mark.parametrize("error, status", [
+    (UploadTooLargeError("too large"), 413),
+    (InvalidImageError("Invalid image file"), 400),
+    (QueueFullError(1), 429),
+    (DeadlineExceededError("late"), 504),
+    (RequestCancelled("gone"), 499),
+    (ValueError("broken"), 500),
+])
+def test_pipeline_errors(client, error, status):
+    import main
+
+    with pytest.raises(HTTPException) as raised:
+        with main.pipeline_errors():
+            raise error
+    assert raised.value.status_code == status
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from reprocess import HASH_BITS, fingerprint, group_duplicates
+
+
+def circle(path, colour: str, size: int = 256, **save) -> str:
+    """A filled circle on white, the same shape whatever the size"""
+    image = Image.new("RGB", (size, size), "white")
+    ImageDraw.Draw(image).ellipse((size * 0.2, size * 0.25, size * 0.75, size * 0.8), fill=colour)
+    image.save(path, **save)
+    return str(path)
+
+
+def distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+@pytest.fixture
+def circles(tmp_path):
+    return {
+        "red.png": fingerprint(circle(tmp_path / "red.png", "red")),
+        "black.png": fingerprint(circle(tmp_path / "black.png", "black")),
+        "blue.png": fingerprint(circle(tmp_path / "blue.png", "blue")),
+        "red-small.jpg": fingerprint(circle(tmp_path / "red-small.jpg", "red", size=180, quality=60)),
+    }
+
+
+def test_hash_uses_every_bit(tmp_path):
+    rng = np.random.default_rng(0)
+    hashes = []
+    for index in range(16):
+        blocks = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        Image.fromarray(blocks).resize((128, 128), Image.Resampling.NEAREST).save(tmp_path / f"{index}.png")
+        hashes.append(int(fingerprint(str(tmp_path / f"{index}.png"))[0], 16))
+    # Every bit, the last one included, is set for some images and clear for others
+    for bit in range(HASH_BITS):
+        assert 0 < sum(value >> bit & 1 for value in hashes) < len(hashes)
+
+
+def test_same_shape_in_other_colours_is_not_a_duplicate(circles):
+    # The greyscale hash alone cannot tell them apart
+    assert distance(circles["red.png"][0], circles["black.png"][0]) <= 3
+    order = ["red.png", "black.png", "blue.png"]
+    assert group_duplicates(circles, order, 3) == {key: key for key in order}
+
+
+def test_resized_and_recompressed_copy_is_a_duplicate(circles):
+    order = ["red.png", "black.png", "red-small.jpg"]
+    assert group_duplicates(circles, order, 3) == {
+        "red.png": "red.png", "black.png": "black.png", "red-small.jpg": "red.png",
+    }
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from upscaler import UPSCALER_MODELS, TiledUpscaler, receptive_radius, tiling_error
+
+RADIUS = 5
+
+
+def blur_and_double(batch: np.ndarray) -> np.ndarray:
+    """Stand-in network: RADIUS 3x3 box blurs, then x2 nearest neighbour, NCHW"""
+    for _ in range(RADIUS):
+        padded = np.pad(batch, ((0, 0), (0, 0), (1, 1), (1, 1)), mode="edge")
+        height, width = batch.shape[2:]
+        batch = sum(
+            padded[:, :, dy:dy + height, dx:dx + width] for dy in range(3) for dx in range(3)
+        ) / 9
+    return batch.repeat(2, axis=2).repeat(2, axis=3)
+
+
+def stand_in(pad: int) -> TiledUpscaler:
+    upscaler = TiledUpscaler(blur_and_double, 2, "stand-in", "numpy", arch="srvgg", tile_workers=2, pad=pad)
+    upscaler.tile = 64
+    return upscaler
+
+
+@pytest.fixture
+def rgb():
+    return np.random.default_rng(0).integers(0, 256, (150, 200, 3), dtype=np.uint8)
+
+
+def test_tiles_match_single_pass_with_receptive_field_margin(rgb):
+    assert tiling_error(stand_in(pad=RADIUS), rgb) < 1e-3
+
+
+def test_narrower_margin_shows_seams(rgb):
+    assert tiling_error(stand_in(pad=RADIUS - 2), rgb) > 1
+
+
+def test_receptive_radius():
+    assert receptive_radius("realesr-general-x4v3") == UPSCALER_MODELS["realesr-general-x4v3"]["args"]["num_conv"] + 2
+    # x2 RRDB works on a 2x pixel-unshuffled input, so its field is twice that of x4 in input pixels
+    assert receptive_radius("RealESRGAN_x2plus") == 2 * receptive_radius("RealESRGAN_x4plus")
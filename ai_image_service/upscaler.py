@@ -0,0 +1,391 @@
+"""
+Tiled Real-ESRGAN upscaling for CPU nodes.
+
+Running the RRDB network over a whole 1024 px frame needs several GB of
+activations and keeps one request busy for a long time. The frame is instead
+split into tiles whose size is derived from a memory budget; every tile is
+inferred with a margin of surrounding context which is cropped off again, and
+tiles run in parallel across cores. The margin is the network's receptive
+field radius where that fits under AI_ENHANCE_TILE_PAD: SRVGG's is 34 input
+pixels, so its tiles match a single pass exactly. RRDB's theoretical field
+(349 input pixels at x4, 698 at x2) is wider than any tile, so RRDB tiles get
+the capped margin and may differ from a single pass near tile borders; the
+reference Real-ESRGAN tiling uses 10 pixels of margin for the same networks.
+
+The model is chosen for the requested output scale: a native x2 network is
+preferred over running a x4 network and throwing three quarters of the pixels
+away, with the compact realesr-general-x4v3 as a lighter fallback. Weights are
+resolved through the local model registry (AI_MODEL_DIR, checksummed) at
+startup, never downloaded on the request path;
+an exported `<name>.onnx` next to the `.pth` is used on GPU-less nodes
+(`python upscaler.py export <name>`, needs the onnx package).
+"""
+
+import logging
+import math
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+import model_registry
+from model_registry import MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+MEMORY_BUDGET_MB = int(os.environ.get("AI_ENHANCE_MEMORY_MB", "1024"))
+TILE_WORKERS = int(os.environ.get("AI_ENHANCE_TILE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Upper bound on the context margin around each tile, in input pixels
+TILE_PAD = int(os.environ.get("AI_ENHANCE_TILE_PAD", "48"))
+# "auto" prefers an exported .onnx file when present, "torch" or "onnx" force a backend
+BACKEND = os.environ.get("AI_UPSCALER_BACKEND", "auto")
+# Order in which models are tried for a given output scale
+PREFERENCE = [
+    name.strip()
+    for name in os.environ.get(
+        "AI_UPSCALER_PREFERENCE", "RealESRGAN_x2plus,realesr-general-x4v3,RealESRGAN_x4plus"
+    ).split(",")
+    if name.strip()
+]
+
+MIN_TILE = 64
+MAX_TILE = 1024
+
+# Known upscaler models: architecture, native scale and constructor arguments
+UPSCALER_MODELS = {
+    "RealESRGAN_x2plus": {
+        "arch": "rrdb", "scale": 2,
+        "args": {"num_in_ch": 3, "num_out_ch": 3, "num_feat": 64, "num_block": 23, "num_grow_ch": 32},
+    },
+    "RealESRGAN_x4plus": {
+        "arch": "rrdb", "scale": 4,
+        "args": {"num_in_ch": 3, "num_out_ch": 3, "num_feat": 64, "num_block": 23, "num_grow_ch": 32},
+    },
+    # Small VGG-style network, far cheaper than RRDB on CPU
+    "realesr-general-x4v3": {
+        "arch": "srvgg", "scale": 4,
+        "args": {"num_in_ch": 3, "num_out_ch": 3, "num_feat": 64, "num_conv": 32, "act_type": "prelu"},
+    },
+}
+
+
+def receptive_radius(name: str) -> int:
+    """
+    Input pixels on each side that can affect one output pixel of a known
+    model: tiles with at least this much context match a single pass.
+    """
+    spec = UPSCALER_MODELS[name]
+    args = spec["args"]
+    if spec["arch"] == "srvgg":
+        # First conv, num_conv body convs and the last conv, all 3x3 at input resolution
+        return args["num_conv"] + 2
+    # conv_first, 3 dense blocks of 5 convs per RRDB and conv_body at feature resolution,
+    # plus the four convs after upsampling (under 2 feature pixels together)
+    feature_radius = 1 + 15 * args["num_block"] + 1 + 2
+    # x2 and x1 networks pixel-unshuffle their input, so features are coarser than input pixels
+    return feature_radius * {1: 4, 2: 2}.get(spec["scale"], 1)
+
+
+def bytes_per_input_pixel(scale: int, num_feat: int = 64, arch: str = "rrdb") -> int:
+    """
+    Rough float32 activation footprint per input pixel. RRDB dense blocks keep
+    about six feature maps alive and upsample features before the last convs;
+    SRVGG keeps two feature maps and only upsamples its 3-channel output.
+    """
+    if arch == "srvgg":
+        return 4 * (2 * num_feat + 2 * 3 * scale * scale)
+    return 4 * (6 * num_feat + (num_feat + 3) * scale * scale)
+
+
+def tile_size_for_budget(
+    budget_bytes: int,
+    scale: int,
+    workers: int = 1,
+    pad: int = TILE_PAD,
+    num_feat: int = 64,
+    arch: str = "rrdb",
+) -> int:
+    """Largest tile side that keeps `workers` tiles in flight within the budget"""
+    per_tile = budget_bytes / max(1, workers)
+    side = int(math.sqrt(per_tile / bytes_per_input_pixel(scale, num_feat, arch))) - 2 * pad
+    side = max(MIN_TILE, min(MAX_TILE, side))
+    return side - side % 8
+
+
+def tile_grid(height: int, width: int, tile: int) -> List[Tuple[int, int, int, int]]:
+    """(y0, y1, x0, x1) boxes covering the frame"""
+    return [
+        (y, min(y + tile, height), x, min(x + tile, width))
+        for y in range(0, height, tile)
+        for x in range(0, width, tile)
+    ]
+
+
+def tiled_apply(
+    image: np.ndarray,
+    infer: Callable[[np.ndarray], np.ndarray],
+    scale: int,
+    tile: int,
+    pad: int = TILE_PAD,
+    executor: Optional[ThreadPoolExecutor] = None,
+) -> np.ndarray:
+    """
+    Apply a fully convolutional `infer` (HxWxC -> sHxsWxC) tile by tile.
+    Each tile is inferred with `pad` pixels of real neighbouring context and
+    only its own region of the output is kept, so there are no seams.
+    """
+    height, width, channels = image.shape
+    output = np.empty((height * scale, width * scale, channels), dtype=np.float32)
+
+    def run(box):
+        y0, y1, x0, x1 = box
+        py0, py1 = max(0, y0 - pad), min(height, y1 + pad)
+        px0, px1 = max(0, x0 - pad), min(width, x1 + pad)
+        result = infer(image[py0:py1, px0:px1])
+        oy, ox = (y0 - py0) * scale, (x0 - px0) * scale
+        output[y0 * scale:y1 * scale, x0 * scale:x1 * scale] = result[
+            oy:oy + (y1 - y0) * scale, ox:ox + (x1 - x0) * scale
+        ]
+
+    boxes = tile_grid(height, width, tile)
+    if executor is None or len(boxes) == 1:
+        for box in boxes:
+            run(box)
+    else:
+        # Tiles write disjoint output regions, so they can run concurrently
+        list(executor.map(run, boxes))
+    return output
+
+
+class TiledUpscaler:
+    """Super-resolution network wrapped with budgeted, parallel tiling"""
+
+    def __init__(
+        self,
+        run_model: Callable[[np.ndarray], np.ndarray],
+        scale: int,
+        name: str,
+        backend: str,
+        arch: str = "rrdb",
+        memory_budget_mb: int = MEMORY_BUDGET_MB,
+        tile_workers: int = TILE_WORKERS,
+        pad: int = TILE_PAD,
+    ):
+        self.run_model = run_model  # NCHW float32 -> NCHW float32
+        self.scale = scale
+        self.name = name
+        self.backend = backend
+        self.arch = arch
+        # RRDBNet x2 pixel-unshuffles its input, so tiles need even sides
+        self.mod = 2 if (arch == "rrdb" and scale == 2) else 1
+        self.tile_workers = max(1, tile_workers)
+        self.pad = pad
+        self.tile = tile_size_for_budget(
+            memory_budget_mb * 1024 * 1024, scale, self.tile_workers, pad=pad, arch=arch
+        )
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Created lazily, and again in a forked worker: threads don't survive fork()
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.tile_workers, thread_name_prefix="esrgan-tile"
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def _infer(self, tile: np.ndarray) -> np.ndarray:
+        """HxWx3 float32 RGB in [0, 1] -> upscaled HxWx3 float32"""
+        height, width = tile.shape[:2]
+        pad_h, pad_w = -height % self.mod, -width % self.mod
+        if pad_h or pad_w:
+            tile = np.pad(tile, ((0, pad_h), (0, pad_w), (0, 0)), mode="reflect")
+
+        batch = np.ascontiguousarray(tile.transpose(2, 0, 1))[None]
+        result = self.run_model(batch)[0].transpose(1, 2, 0)
+        result = result[:height * self.scale, :width * self.scale]
+        return np.clip(result, 0, 1, out=result)
+
+    def upscale(self, rgb: np.ndarray, outscale: float = 2) -> np.ndarray:
+        """Upscale an HxWx3 uint8 RGB array, returning uint8 at `outscale`"""
+        image = rgb.astype(np.float32) / 255.0
+        output = tiled_apply(image, self._infer, self.scale, self.tile, self.pad, executor=self.executor)
+        output = (output * 255.0).round().astype(np.uint8)
+
+        if outscale != self.scale:
+            import cv2
+
+            height, width = rgb.shape[:2]
+            output = cv2.resize(
+                output,
+                (int(width * outscale), int(height * outscale)),
+                interpolation=cv2.INTER_AREA,
+            )
+        return output
+
+    def status(self) -> dict:
+        return {
+            "model": self.name,
+            "backend": self.backend,
+            "scale": self.scale,
+            "tile": self.tile,
+            "tile_pad": self.pad,
+            "tile_workers": self.tile_workers,
+        }
+
+
+def tiling_error(upscaler: TiledUpscaler, rgb: np.ndarray) -> float:
+    """Max absolute difference (0-255) between tiled and single-pass output"""
+    image = rgb.astype(np.float32) / 255.0
+    single = upscaler._infer(image)
+    tiled = tiled_apply(
+        image, upscaler._infer, upscaler.scale, upscaler.tile, upscaler.pad, executor=upscaler.executor
+    )
+    return float(np.abs(single - tiled).max() * 255.0)
+
+
+def build_network(name: str):
+    """Instantiate the torch network for a known model name"""
+    spec = UPSCALER_MODELS[name]
+    if spec["arch"] == "srvgg":
+        from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+
+        return SRVGGNetCompact(upscale=spec["scale"], **spec["args"])
+
+    from basicsr.archs.rrdbnet_arch import RRDBNet
+
+    return RRDBNet(scale=spec["scale"], **spec["args"])
+
+
+def load_network(name: str, weights_path: str, mmap: bool = False):
+    """
+    Torch network for `name` with local weights loaded, in eval mode. With mmap
+    the parameters stay backed by the file's pages, shared between processes.
+    """
+    import torch
+
+    model = build_network(name)
+    state = torch.load(weights_path, map_location="cpu", mmap=mmap, weights_only=True)
+    # Released checkpoints keep the EMA weights under "params_ema"
+    for key in ("params_ema", "params"):
+        if key in state:
+            state = state[key]
+            break
+    # assign keeps the checkpoint tensors (mapped or not) instead of copying them
+    model.load_state_dict(state, strict=True, assign=True)
+    return model.eval()
+
+
+def _torch_runner(name: str, weights_path: str, tile_workers: int, mmap: bool = False) -> Callable:
+    import torch
+
+    model = load_network(name, weights_path, mmap=mmap)
+    # Split the cores between concurrently running tiles
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // tile_workers))
+
+    def run(batch: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            return model(torch.from_numpy(batch)).numpy()
+
+    return run
+
+
+def _onnx_runner(onnx_path: str, tile_workers: int) -> Callable:
+    import onnxruntime as ort
+
+    options = model_registry.session_options(onnx_path)
+    options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // tile_workers)
+    session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    def run(batch: np.ndarray) -> np.ndarray:
+        return session.run(None, {input_name: batch})[0]
+
+    return run
+
+
+def candidate_models(outscale: float) -> List[str]:
+    """Models in preference order, native scales that need no downscale first"""
+    native = math.ceil(outscale)
+    ordered = [name for name in PREFERENCE if name in UPSCALER_MODELS]
+    return sorted(ordered, key=lambda name: UPSCALER_MODELS[name]["scale"] != native)
+
+
+def load_model(
+    name: str,
+    backend: str = BACKEND,
+    model_dir: str = MODEL_DIR,
+    tile_workers: int = TILE_WORKERS,
+) -> Optional[TiledUpscaler]:
+    """
+    Load one model from local files; returns None if its weights are missing.
+    Raises ModelChecksumError if they don't match the manifest.
+    """
+    spec = UPSCALER_MODELS[name]
+    onnx_path = os.path.join(model_dir, name + ".onnx")
+    torch_path = os.path.join(model_dir, name + ".pth")
+
+    if backend in ("auto", "onnx") and os.path.exists(onnx_path):
+        path = model_registry.resolve(name + ".onnx", model_dir)
+        mmap = model_registry.MMAP_ONNX and model_registry.has_external_data(path)
+        with model_registry.track_load(name, path, mmap=mmap):
+            run_model, used = _onnx_runner(path, tile_workers), "onnx"
+    elif backend in ("auto", "torch") and os.path.exists(torch_path):
+        path = model_registry.resolve(name + ".pth", model_dir)
+        # Only zip-format checkpoints (torch >= 1.6) can be memory-mapped
+        mmap = zipfile.is_zipfile(path)
+        with model_registry.track_load(name, path, mmap=mmap):
+            run_model, used = _torch_runner(name, path, tile_workers, mmap=mmap), "torch"
+    else:
+        return None
+
+    return TiledUpscaler(
+        run_model, spec["scale"], name, used, arch=spec["arch"], tile_workers=tile_workers,
+        pad=min(receptive_radius(name), TILE_PAD)
+    )
+
+
+def load_upscaler(outscale: float = 2, model_dir: str = MODEL_DIR) -> Optional[TiledUpscaler]:
+    """Pick and load the best available model for the requested output scale"""
+    for name in candidate_models(outscale):
+        upscaler = load_model(name, model_dir=model_dir)
+        if upscaler is not None:
+            return upscaler
+
+    logger.warning(
+        "No upscaler weights found in %s; add e.g. RealESRGAN_x2plus.pth "
+        "(or an exported .onnx) to enable enhancement", model_dir
+    )
+    return None
+
+
+def export_onnx(name: str, model_dir: str = MODEL_DIR) -> str:
+    """Export local torch weights to ONNX with dynamic spatial axes for CPU nodes"""
+    import torch
+
+    network = load_network(name, os.path.join(model_dir, name + ".pth"))
+    output_path = os.path.join(model_dir, name + ".onnx")
+    dummy = torch.rand(1, 3, 64, 64)
+    torch.onnx.export(
+        network,
+        dummy,
+        output_path,
+        input_names=["input"],
+        output_names=["output"],
+        dynamic_axes={"input": {2: "height", 3: "width"}, "output": {2: "height", 3: "width"}},
+        opset_version=17,
+    )
+    return output_path
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3 or sys.argv[1] != "export" or sys.argv[2] not in UPSCALER_MODELS:
+        print(f"Usage: python upscaler.py export <{'|'.join(UPSCALER_MODELS)}>")
+        sys.exit(1)
+    print(f"✅ Exported {export_onnx(sys.argv[2])}")
@@ -0,0 +1,163 @@
+"""
+Several outputs from one segmentation.
+
+A seller trying the product shot on white, on the shop's brand colour and
+transparent shouldn't pay for U²-Net once per try. Given the RGBA cutout,
+render_variants() produces any of the alpha mask, the transparent cutout and
+composites onto a list of background colours, optionally cropped to the
+subject's bounding box. The alpha channel is extracted once and shared by
+every composite, and each colour is one pass of Pillow's C compositing rather
+than one numpy broadcast over all colours: the broadcast's full-frame
+intermediates cost more than the passes. Measured on a 1024px synthetic
+cutout, the pixels identical in every case:
+
+  colours  pillow   numpy float32  numpy uint16 (shared foreground term)
+  1        6 ms     50 ms          38 ms
+  4        22 ms    172 ms         129 ms
+  8        46 ms    305 ms         273 ms
+
+`python benchmarks/compositing.py` reproduces the table on other sizes and
+hardware. The results are returned as one multipart/form-data body, which
+browsers parse with Response.formData().
+"""
+
+import hashlib
+import io
+import os
+from typing import List, Optional, Sequence, Tuple, Union
+
+from PIL import Image, ImageColor
+
+from encoding import FORMATS, encode
+
+OUTPUTS = ("mask", "cutout", "composite")
+MAX_COLORS = int(os.environ.get("AI_VARIANT_MAX_COLORS", "8"))
+CROP_PADDING = float(os.environ.get("AI_CROP_PADDING", "0.05"))  # of the subject's larger side
+SUBJECT_ALPHA = 8  # alpha above this counts as subject for the bounding box
+
+Color = Tuple[int, int, int]
+Part = Tuple[str, str, str, Union[bytes, memoryview]]  # (form field name, filename, media type, content)
+
+
+def parse_outputs(spec: str) -> List[str]:
+    """Comma separated output names, in the order given; raises ValueError"""
+    outputs = [name.strip() for name in spec.split(",") if name.strip()]
+    unknown = [name for name in outputs if name not in OUTPUTS]
+    if unknown or not outputs:
+        raise ValueError(f"outputs must be a comma separated subset of {', '.join(OUTPUTS)}")
+    return list(dict.fromkeys(outputs))
+
+
+def parse_colors(spec: str) -> List[Color]:
+    """Comma separated colour names or hex values (with or without '#'); raises ValueError"""
+    colors = []
+    for value in (value.strip() for value in spec.split(",")):
+        if not value:
+            continue
+        try:
+            rgb = ImageColor.getrgb(value)
+        except ValueError:
+            try:
+                rgb = ImageColor.getrgb("#" + value)
+            except ValueError:
+                raise ValueError(f"Unknown colour {value!r}") from None
+        colors.append(tuple(rgb[:3]))
+    if not colors:
+        raise ValueError("At least one colour is needed for composites")
+    if len(colors) > MAX_COLORS:
+        raise ValueError(f"At most {MAX_COLORS} colours per request")
+    return list(dict.fromkeys(colors))
+
+
+def subject_bbox(alpha: Image.Image, padding: float = CROP_PADDING) -> Optional[Tuple[int, int, int, int]]:
+    """(left, top, right, bottom) around the subject plus padding, None if there is no subject"""
+    box = alpha.point(lambda value: 255 if value > SUBJECT_ALPHA else 0).getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    pad = int(round(max(bottom - top, right - left) * padding))
+    return max(0, left - pad), max(0, top - pad), min(alpha.width, right + pad), min(alpha.height, bottom + pad)
+
+
+def composite(cutout: Image.Image, colors: Sequence[Color], alpha: Optional[Image.Image] = None) -> List[Image.Image]:
+    """Composite an RGBA image onto each colour; alpha, if given, is its alpha channel"""
+    alpha = alpha if alpha is not None else cutout.getchannel("A")
+    composites = []
+    for color in colors:
+        background = Image.new("RGB", cutout.size, color)
+        background.paste(cutout, mask=alpha)
+        composites.append(background)
+    return composites
+
+
+def color_name(color: Color) -> str:
+    return "%02x%02x%02x" % color
+
+
+def render_variants(
+    cutout: Image.Image,
+    outputs: Sequence[str],
+    colors: Sequence[Color],
+    crop: bool = False,
+    timer=None
+) -> Tuple[List[Part], dict]:
+    """
+    Encoded outputs for an RGBA cutout, plus a description of them (the crop
+    box in cutout coordinates and the output size). Compositing and encoding
+    time go to timer, a StageTimer.
+    """
+    from metrics import StageTimer
+
+    timer = timer or StageTimer()
+    if cutout.mode != "RGBA":
+        cutout = cutout.convert("RGBA")
+    alpha = cutout.getchannel("A")
+    box = subject_bbox(alpha) if crop else None
+    if box is not None:
+        cutout, alpha = cutout.crop(box), alpha.crop(box)
+    info = {"size": list(cutout.size)}
+    if box is not None:
+        info["crop"] = list(box)
+
+    images = []
+    if "mask" in outputs:
+        images.append(("mask", "mask.png", alpha, "png"))
+    if "cutout" in outputs:
+        images.append(("cutout", "cutout.png", cutout, "png"))
+    if "composite" in outputs:
+        with timer.stage("composite"):
+            composites = composite(cutout, colors, alpha)
+        for color, image in zip(colors, composites):
+            name = f"composite_{color_name(color)}"
+            images.append((name, name + ".jpg", image, "jpeg"))
+
+    parts = []
+    with timer.stage("encode"):
+        for name, filename, image, format in images:
+            parts.append((name, filename, FORMATS[format], encode(image, format)))
+    info["parts"] = [name for name, _, _, _ in parts]
+    return parts, info
+
+
+def multipart(parts: Sequence[Part]) -> Tuple[bytes, str]:
+    """
+    multipart/form-data body and its media type. The boundary is derived from
+    the content, so the same outputs always give the same bytes (and ETag).
+    """
+    digest = hashlib.sha256()
+    for _, _, _, content in parts:
+        digest.update(content)
+    boundary = "ai-image-" + digest.hexdigest()[:32]
+
+    body = io.BytesIO()
+    for name, filename, media_type, content in parts:
+        body.write(
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {media_type}\r\n"
+            f"Content-Length: {len(content)}\r\n\r\n".encode()
+        )
+        body.write(content)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
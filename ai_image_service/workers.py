@@ -0,0 +1,274 @@
+"""
+Bounded worker pool for the CPU-bound image pipeline.
+
+Decoding, resizing, segmentation, enhancement and encoding all hold the CPU
+for a long time, so they run on a thread or process pool instead of the event
+loop. Concurrency is capped at the pool size and admission is bounded: once
+`workers + queue_depth` jobs are in flight in a lane, new work is rejected
+immediately with QueueFullError so callers can answer 429 instead of queueing
+without limit.
+
+Work is admitted into lanes: "quick" (background removal, a few hundred
+milliseconds) and "heavy" (enhancement, batches and jobs, seconds). Each lane
+has its own queue, and a free worker goes to the lane chosen by smooth
+weighted round-robin over the lanes with waiters (AI_LANE_WEIGHTS, default
+quick=3,heavy=1). Heavy work may hold at most AI_HEAVY_MAX_RUNNING workers
+(default all but one), so a burst of Real-ESRGAN runs can't leave cutouts
+waiting for seconds.
+
+Callers can pass a deadline (time.monotonic() seconds). Work whose lane's
+average run time no longer fits before it is dropped with
+DeadlineExceededError, both at admission and when a worker frees up, instead
+of being computed for a client that has given up. stage_guard() builds the
+between-stage check the pipeline calls, which also stops work for clients
+that disconnected.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Deque, Dict, Optional
+
+WORKER_KIND = os.environ.get("AI_WORKER_KIND", "thread")  # "thread" or "process"
+WORKER_COUNT = int(os.environ.get("AI_WORKER_COUNT", str(os.cpu_count() or 2)))
+QUEUE_DEPTH = int(os.environ.get("AI_QUEUE_DEPTH", str(WORKER_COUNT * 2)))
+LANE_WEIGHTS = {
+    name.strip(): int(weight)
+    for name, weight in (
+        item.split("=") for item in os.environ.get("AI_LANE_WEIGHTS", "quick=3,heavy=1").split(",") if item.strip()
+    )
+}
+HEAVY_MAX_RUNNING = int(os.environ.get("AI_HEAVY_MAX_RUNNING", str(max(1, WORKER_COUNT - 1))))
+
+
+def _picklable(value):
+    """Convert memoryviews (not picklable), also inside tuples and lists, to bytes"""
+    if isinstance(value, memoryview):
+        return bytes(value)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_picklable(item) for item in value)
+    return value
+
+
+def _call_for_process(fn: Callable, *args, **kwargs):
+    """Run fn in a process worker and make its result safe to send back"""
+    return _picklable(fn(*args, **kwargs))
+
+
+class QueueFullError(Exception):
+    """Raised when the pool cannot admit more work"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Worker queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    """Raised when work can't finish before the caller's deadline"""
+
+
+class RequestCancelled(Exception):
+    """Raised between pipeline stages once the client has disconnected"""
+
+
+def stage_guard(disconnected: threading.Event, deadline: Optional[float] = None) -> Callable[[str], None]:
+    """Progress callback that stops the pipeline between stages for gone or late clients"""
+    def check(stage: str) -> None:
+        if disconnected.is_set():
+            raise RequestCancelled(f"Client disconnected before {stage}")
+        if deadline is not None and time.monotonic() > deadline:
+            raise DeadlineExceededError(f"Deadline passed before {stage}")
+    return check
+
+
+class _Lane:
+    def __init__(self, name: str, weight: int, max_running: int):
+        self.name = name
+        self.weight = max(1, weight)
+        self.max_running = max_running
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.current = 0  # smooth weighted round-robin credit
+        self.admitted = 0
+        self.running = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.cancelled = 0
+        self.avg_seconds = 0.0  # moving average of job duration, 0 until the first one finishes
+        self.completed = 0
+
+    def status(self) -> dict:
+        return {
+            "weight": self.weight,
+            "max_running": self.max_running,
+            "running": self.running,
+            "waiting": self.admitted - self.running,
+            "rejected": self.rejected,
+            "deadline_dropped": self.dropped,
+            "cancelled": self.cancelled,
+            "avg_seconds": round(self.avg_seconds, 3),
+        }
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        workers: int = WORKER_COUNT,
+        queue_depth: int = QUEUE_DEPTH,
+        kind: str = WORKER_KIND,
+        initializer: Optional[Callable] = None,
+    ):
+        self.workers = max(1, workers)
+        self.queue_depth = max(0, queue_depth)
+        self.kind = kind
+        self.initializer = initializer
+        self._executor: Optional[Executor] = None
+        self._running = 0
+        self.lanes: Dict[str, _Lane] = {
+            name: _Lane(name, weight, HEAVY_MAX_RUNNING if name == "heavy" else self.workers)
+            for name, weight in (LANE_WEIGHTS or {"quick": 1}).items()
+        }
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=self.initializer
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="image-worker"
+                )
+        return self._executor
+
+    def lane(self, name: str) -> _Lane:
+        return self.lanes.get(name) or next(iter(self.lanes.values()))
+
+    def retry_after(self, lane: _Lane) -> int:
+        """Rough estimate of when a slot in the lane frees up, in whole seconds"""
+        waves = max(1, lane.admitted) / min(self.workers, lane.max_running)
+        return max(1, math.ceil(lane.avg_seconds * waves))
+
+    def admit(self, lane: _Lane, deadline: Optional[float] = None) -> None:
+        """Reserve a place in the lane or raise QueueFullError / DeadlineExceededError"""
+        if lane.admitted >= self.workers + self.queue_depth:
+            lane.rejected += 1
+            raise QueueFullError(self.retry_after(lane))
+        if deadline is not None and time.monotonic() + lane.avg_seconds > deadline:
+            lane.dropped += 1
+            raise DeadlineExceededError(f"{lane.name} work takes about {lane.avg_seconds:.1f}s, past the deadline")
+        lane.admitted += 1
+
+    def release(self, lane: _Lane) -> None:
+        lane.admitted -= 1
+
+    def _can_start(self, lane: _Lane) -> bool:
+        return self._running < self.workers and lane.running < lane.max_running
+
+    def _start(self, lane: _Lane) -> None:
+        self._running += 1
+        lane.running += 1
+
+    def _dispatch(self) -> None:
+        """Hand free workers to waiting lanes by smooth weighted round-robin"""
+        while self._running < self.workers:
+            eligible = [lane for lane in self.lanes.values() if lane.waiters and lane.running < lane.max_running]
+            if not eligible:
+                return
+            for lane in eligible:
+                lane.current += lane.weight
+            chosen = max(eligible, key=lambda lane: lane.current)
+            chosen.current -= sum(lane.weight for lane in eligible)
+            waiter = chosen.waiters.popleft()
+            if not waiter.done():
+                self._start(chosen)
+                waiter.set_result(None)
+
+    async def _acquire(self, lane: _Lane) -> None:
+        """Wait for a worker; lanes are served in weighted order"""
+        if not lane.waiters and self._can_start(lane):
+            self._start(lane)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        lane.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a worker just as the caller went away: pass it on
+                self._finish(lane)
+            else:
+                try:
+                    lane.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def _finish(self, lane: _Lane) -> None:
+        self._running -= 1
+        lane.running -= 1
+        self._dispatch()
+
+    async def run(self, fn: Callable, *args, lane: str = "quick", deadline: Optional[float] = None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the pool in the given lane, subject to
+        admission control. deadline is a time.monotonic() value.
+        """
+        lane = self.lane(lane)
+        self.admit(lane, deadline)
+        try:
+            await self._acquire(lane)
+            try:
+                # Waiting may have used up the time the work needed
+                if deadline is not None and time.monotonic() + lane.avg_seconds > deadline:
+                    lane.dropped += 1
+                    raise DeadlineExceededError(
+                        f"{lane.name} work takes about {lane.avg_seconds:.1f}s, past the deadline"
+                    )
+                started = time.perf_counter()
+                try:
+                    loop = asyncio.get_running_loop()
+                    if self.kind == "process":
+                        call = partial(_call_for_process, fn, *args, **kwargs)
+                    else:
+                        call = partial(fn, *args, **kwargs)
+                    result = await loop.run_in_executor(self.executor, call)
+                except RequestCancelled:
+                    lane.cancelled += 1
+                    raise
+                except DeadlineExceededError:
+                    lane.dropped += 1
+                    raise
+                # Only complete runs say how long the lane's work takes
+                elapsed = time.perf_counter() - started
+                lane.avg_seconds = 0.8 * lane.avg_seconds + 0.2 * elapsed if lane.completed else elapsed
+                lane.completed += 1
+                return result
+            finally:
+                self._finish(lane)
+        finally:
+            self.release(lane)
+
+    def status(self) -> dict:
+        lanes = {name: lane.status() for name, lane in self.lanes.items()}
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "running": self._running,
+            "waiting": sum(lane["waiting"] for lane in lanes.values()),
+            "rejected": sum(lane["rejected"] for lane in lanes.values()),
+            "deadline_dropped": sum(lane["deadline_dropped"] for lane in lanes.values()),
+            "cancelled": sum(lane["cancelled"] for lane in lanes.values()),
+            "lanes": lanes,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,274 @@
+"""
+extract-digitalocean-data.py against a real PostgreSQL. Skipped unless
+DATABASE_URL points at a scratch database, e.g.
+DATABASE_URL='postgresql://postgres@localhost/scratch?sslmode=disable'.
+Tables are created in public with a pytest_ prefix and dropped afterwards.
+"""
+
+import gzip
+import importlib.util
+import json
+import os
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "extract-digitalocean-data.py")
+
+# Values the NDJSON export has to carry through COPY's CSV mode untouched
+AWKWARD_TEXT = [
+    'comma, "double quotes" and \'single\'',
+    "back\\slash \\n not a newline",
+    "real\nnewline\r\nand\ttab",
+    "\x01 \x02 the quote and delimiter bytes",
+    "unicode: żółw 🐢  ",
+    "",
+    None,
+]
+
+
+@pytest.fixture(scope="module")
+def database_url():
+    url = os.environ.get("DATABASE_URL")
+    if not url:
+        pytest.skip("DATABASE_URL is not set")
+    return url
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    spec = importlib.util.spec_from_file_location("extract_digitalocean_data", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def db(database_url, extractor):
+    """Autocommit connection; tables named in the returned list are dropped afterwards"""
+    conn = extractor.connect(database_url)
+    conn.autocommit = True
+    created = []
+    yield conn, created
+    with conn.cursor() as cursor:
+        for table in created:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.close()
+
+
+def read_ndjson(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_ndjson_round_trip(db, database_url, extractor, tmp_path):
+    conn, created = db
+    created.append("pytest_awkward")
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE pytest_awkward (id int PRIMARY KEY, label text, doc jsonb)")
+        for index, text in enumerate(AWKWARD_TEXT):
+            cursor.execute(
+                "INSERT INTO pytest_awkward VALUES (%s, %s, %s)",
+                (index, text, json.dumps({"text": text, "nested": [text]})),
+            )
+
+    assert extractor.export(database_url, str(tmp_path), "ndjson", jobs=2, tables=["pytest_awkward"])
+
+    rows = sorted(read_ndjson(tmp_path / "pytest_awkward.ndjson.gz"), key=lambda row: row["id"])
+    assert [row["label"] for row in rows] == AWKWARD_TEXT
+    assert [row["doc"] for row in rows] == [{"text": text, "nested": [text]} for text in AWKWARD_TEXT]
+
+
+def test_export_resumes_missing_chunks(db, database_url, extractor, tmp_path):
+    conn, created = db
+    created.append("pytest_chunked")
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE pytest_chunked (id int PRIMARY KEY, value text)")
+        cursor.execute("INSERT INTO pytest_chunked SELECT g, 'v' || g FROM generate_series(1, 5000) g")
+        cursor.execute("ANALYZE pytest_chunked")
+
+    assert extractor.export(database_url, str(tmp_path), "ndjson", jobs=2, tables=["pytest_chunked"], chunk_rows=1000)
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    chunks = manifest["tables"]["pytest_chunked"]["chunks"]
+    assert len(chunks) >= 5 and all(chunk["status"] == "done" for chunk in chunks)
+
+    # Lose one file and mark another as failed, as an interrupted run would leave them
+    lost, failed = chunks[1]["file"], chunks[2]["file"]
+    os.remove(tmp_path / lost)
+    chunks[2]["status"] = "failed"
+    (tmp_path / "manifest.json").write_text(json.dumps(manifest))
+    untouched = {chunk["file"]: os.stat(tmp_path / chunk["file"]).st_mtime_ns for chunk in chunks[3:]}
+
+    assert extractor.export(database_url, str(tmp_path), "ndjson", jobs=2, tables=["pytest_chunked"], chunk_rows=1000)
+    resumed = json.loads((tmp_path / "manifest.json").read_text())["tables"]["pytest_chunked"]["chunks"]
+    assert [chunk["file"] for chunk in resumed] == [chunk["file"] for chunk in chunks]
+    assert all(chunk["status"] == "done" for chunk in resumed)
+    assert (tmp_path / lost).exists() and (tmp_path / failed).exists()
+    assert {name: os.stat(tmp_path / name).st_mtime_ns for name in untouched} == untouched
+
+    ids = sorted(row["id"] for chunk in resumed for row in read_ndjson(tmp_path / chunk["file"]))
+    assert ids == list(range(1, 5001))
+
+
+def test_incremental_advances_watermark(db, database_url, extractor, tmp_path):
+    conn, created = db
+    created.append("pytest_changes")
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE pytest_changes (id int PRIMARY KEY, value text, "
+            "updated_at timestamptz NOT NULL DEFAULT now() - interval '1 hour')"
+        )
+        cursor.execute("INSERT INTO pytest_changes (id, value) SELECT g, 'v' || g FROM generate_series(1, 30) g")
+
+    def run():
+        assert extractor.incremental(database_url, str(tmp_path), jobs=1, tables=["pytest_changes"],
+                                     fetch_size=7, lag_seconds=0)
+        return json.loads((tmp_path / "state.json").read_text())["tables"]["pytest_changes"]
+
+    first = run()
+    assert first["column"] == "updated_at" and first["rows"] == 30
+    assert first["mark"][1] == 30
+
+    # Nothing changed: nothing appended, the mark stays
+    assert run()["mark"] == first["mark"]
+
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE pytest_changes SET value = 'changed', updated_at = now() - interval '1 second' WHERE id = 3")
+        cursor.execute("INSERT INTO pytest_changes (id, value, updated_at) VALUES (31, 'new', now() - interval '1 second')")
+    third = run()
+    assert third["rows"] == 32
+    assert third["mark"] > first["mark"] and third["mark"][1] == 31
+
+    rows = read_ndjson(tmp_path / "pytest_changes.ndjson.gz")
+    assert [row["id"] for row in rows[30:]] == [3, 31]
+    assert rows[30]["value"] == "changed"
+    assert os.path.getsize(tmp_path / "pytest_changes.ndjson.gz") == third["bytes"]
+
+
+def test_incremental_follows_null_timestamps_by_primary_key(db, database_url, extractor, tmp_path):
+    conn, created = db
+    created += ["pytest_nullable", "pytest_nullable_text_pk"]
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE pytest_nullable (id int PRIMARY KEY, value text, updated_at timestamptz)")
+        cursor.execute(
+            "INSERT INTO pytest_nullable SELECT g, 'v' || g, "
+            "CASE WHEN g % 2 = 0 THEN now() - interval '1 hour' END FROM generate_series(1, 20) g"
+        )
+        cursor.execute("CREATE TABLE pytest_nullable_text_pk (code text PRIMARY KEY, updated_at timestamptz)")
+
+    def run():
+        assert extractor.incremental(database_url, str(tmp_path), jobs=2,
+                                     tables=["pytest_nullable", "pytest_nullable_text_pk"],
+                                     fetch_size=4, lag_seconds=0)
+        return json.loads((tmp_path / "state.json").read_text())["tables"]
+
+    first = run()
+    # NULL timestamps can't be ordered among text primary keys, so that table is refused
+    assert "pytest_nullable_text_pk" not in first
+    entry = first["pytest_nullable"]
+    assert entry["rows"] == 20 and entry["null_mark"] == [19] and entry["mark"][1] == 20
+
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO pytest_nullable VALUES (21, 'no timestamp', NULL)")
+        cursor.execute("INSERT INTO pytest_nullable VALUES (22, 'timestamp', now() - interval '1 second')")
+    entry = run()["pytest_nullable"]
+    assert entry["rows"] == 22 and entry["null_mark"] == [21] and entry["mark"][1] == 22
+    rows = read_ndjson(tmp_path / "pytest_nullable.ndjson.gz")
+    assert sorted(row["id"] for row in rows) == list(range(1, 23))
+
+
+def test_never_analyzed_table_is_counted(db, database_url, extractor, tmp_path):
+    conn, created = db
+    created.append("pytest_unanalyzed")
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE pytest_unanalyzed (id int PRIMARY KEY) WITH (autovacuum_enabled = false)")
+        cursor.execute("INSERT INTO pytest_unanalyzed SELECT generate_series(1, 3000)")
+        # Before PostgreSQL 14 a never analyzed table reports 0 rows, not -1
+        cursor.execute("UPDATE pg_class SET reltuples = 0 WHERE relname = 'pytest_unanalyzed'")
+        assert extractor.list_tables(cursor, ["pytest_unanalyzed"])["pytest_unanalyzed"]["estimated_rows"] is None
+
+    assert extractor.export(database_url, str(tmp_path), "ndjson", jobs=2, tables=["pytest_unanalyzed"], chunk_rows=1000)
+    chunks = json.loads((tmp_path / "manifest.json").read_text())["tables"]["pytest_unanalyzed"]["chunks"]
+    assert len(chunks) >= 3
+    assert sum(chunk["rows"] for chunk in chunks) == 3000
+
+
+@pytest.fixture
+def profiled(db):
+    """1000 rows: unique ids, a label NULL in every fourth row with 10 values, a flag and a json document"""
+    conn, created = db
+    created.append("pytest_profiled")
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE pytest_profiled (id int PRIMARY KEY, label text, flag bool, doc json)"
+            " WITH (autovacuum_enabled = false)"
+        )
+        cursor.execute("""
+            INSERT INTO pytest_profiled
+            SELECT n, CASE WHEN n % 4 = 0 THEN NULL ELSE 'label ' || n % 10 END, n % 2 = 0,
+                   json_build_object('n', n % 3)
+            FROM generate_series(1, 1000) AS n
+        """)
+    return conn
+
+
+def test_profile_scan(profiled, database_url, extractor):
+    report = extractor.profile(database_url, tables=["pytest_profiled"])
+
+    assert report["meta"]["mode"] == "scan"
+    table = report["tables"]["pytest_profiled"]
+    assert table["rows"] == table["rows_scanned"] == 1000
+    columns = table["columns"]
+    assert (columns["id"]["null_frac"], columns["id"]["distinct"]) == (0, 1000)
+    assert (columns["id"]["min"], columns["id"]["max"]) == (1, 1000)
+    assert (columns["label"]["null_frac"], columns["label"]["distinct"]) == (0.25, 10)
+    # No ordering: booleans report bool_and/bool_or, json no bounds at all
+    assert (columns["flag"]["min"], columns["flag"]["max"], columns["flag"]["distinct"]) == (False, True, 2)
+    assert (columns["doc"]["min"], columns["doc"]["max"], columns["doc"]["distinct"]) == (None, None, 3)
+
+
+def test_profile_sample_is_extrapolated(db, database_url, extractor):
+    conn, created = db
+    created.append("pytest_sampled")
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TABLE pytest_sampled (id int PRIMARY KEY, kind int)")
+        cursor.execute("INSERT INTO pytest_sampled SELECT n, n % 5 FROM generate_series(1, 20000) AS n")
+
+    table = extractor.profile(database_url, tables=["pytest_sampled"], sample_percent=50)["tables"]["pytest_sampled"]
+
+    # SYSTEM sampling picks whole pages, so the scanned count varies from run to run
+    scanned = table["rows_scanned"]
+    assert 0 < scanned < 20000
+    assert table["rows"] == round(scanned / 0.5)
+    assert 0.6 * 20000 < table["rows"] < 1.4 * 20000
+    # Unique in the sample, so scaled up; the others have shown all their values
+    assert table["columns"]["id"]["distinct"] == round(scanned / 0.5)
+    assert table["columns"]["kind"]["distinct"] == 5
+
+
+def test_profile_cheap_reads_pg_stats(profiled, db, database_url, extractor):
+    conn, created = db
+    created.append("pytest_unprofiled")
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE pytest_profiled")
+        cursor.execute("CREATE TABLE pytest_unprofiled (id int PRIMARY KEY) WITH (autovacuum_enabled = false)")
+        cursor.execute("INSERT INTO pytest_unprofiled SELECT generate_series(1, 100)")
+
+    report = extractor.profile(database_url, tables=["pytest_profiled", "pytest_unprofiled"], cheap=True)
+
+    assert (report["meta"]["mode"], report["meta"]["sample_percent"]) == ("pg_stats", None)
+    table = report["tables"]["pytest_profiled"]
+    assert table["rows"] == 1000 and "analyzed" not in table
+    columns = table["columns"]
+    # n_distinct of a unique column is stored as -1, a fraction of the rows
+    assert (columns["id"]["null_frac"], columns["id"]["distinct"]) == (0, 1000)
+    assert (columns["id"]["min"], columns["id"]["max"]) == ("1", "1000")
+    assert (columns["label"]["null_frac"], columns["label"]["distinct"]) == (0.25, 10)
+
+    never = report["tables"]["pytest_unprofiled"]
+    assert never["analyzed"] is False and never["rows"] is None
+    assert never["columns"]["id"] == {
+        "type": "integer", "nullable": False, "null_frac": None, "distinct": None, "min": None, "max": None,
+        "avg_width": None,
+    }